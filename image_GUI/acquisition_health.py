@@ -0,0 +1,145 @@
+# Acquisition health monitoring
+# Records per-frame receive timestamps during capture and summarizes frame-ID gaps,
+# late frames, inter-frame jitter and achieved frame rate for each trial
+
+import json
+
+import numpy as np
+
+HEALTH_NAME = 'health.json'
+LATE_FACTOR = 1.5 # frames arriving this many nominal periods after the last are late
+JITTER_BINS = np.array([-np.inf, -1.0, -0.5, -0.2, -0.1, -0.05, 0.05, 0.1, 0.2, 0.5, 1.0, np.inf]) # ms
+
+
+class AcquisitionMonitor:
+    """
+    Per-trial record of received frame IDs and receive times. record() is cheap
+    enough to call from the frame callback; everything else happens in report().
+    """
+    def __init__(self, expected, frame_rate, margin=1024, tick_frequency=None):
+        """
+        Params:
+        expected (int) number of frames the camera was asked to capture
+        frame_rate (float) requested frame rate [Hz]
+        margin (int) extra records allocated beyond expected
+        tick_frequency (float) camera timestamp ticks per second, None if not recorded
+        """
+        self.expected = int(expected)
+        self.frame_rate = float(frame_rate)
+        self.tick_frequency = tick_frequency
+        self.frame_ids = np.zeros(self.expected + margin, dtype=np.int64)
+        self.times = np.zeros(self.expected + margin, dtype=np.float64)
+        self.camera_times = np.zeros(self.expected + margin, dtype=np.int64)
+        self.count = 0
+        self.overflow = 0
+
+    def record(self, frame_id, timestamp, camera_time=0):
+        if self.count >= len(self.frame_ids):
+            self.overflow += 1
+            return
+        self.frame_ids[self.count] = frame_id
+        self.times[self.count] = timestamp
+        self.camera_times[self.count] = camera_time
+        self.count += 1
+
+    def progress(self):
+        # (received, frames missing between the first and latest received) while capture runs
+        count = self.count
+        if count == 0:
+            return 0, 0
+        span = int(self.frame_ids[count - 1] - self.frame_ids[0]) + 1
+        return count, max(span - count, 0)
+
+    def gap_log(self):
+        """
+        Returns:
+        List of (first_missing_id, length, time_before, time_after) for every
+        run of missing frame IDs between received frames
+        """
+        ids = self.frame_ids[:self.count]
+        times = self.times[:self.count]
+        steps = np.diff(ids)
+        gaps = np.nonzero(steps > 1)[0]
+        return [(int(ids[i] + 1), int(steps[i] - 1), float(times[i]), float(times[i + 1])) for i in gaps]
+
+    def report(self, writer_stats=None):
+        """
+        Params:
+        writer_stats (dict) optional FrameWriter.stats() for frames lost after receipt
+        Returns:
+        dict summary: expected vs received frames, drop runs, late frames,
+        jitter histogram (ms from nominal period), achieved fps and the capture time
+        from first to last frame received; with camera timestamps also the
+        camera-side frame rate and jitter, free of host latency
+        """
+        ids = self.frame_ids[:self.count]
+        times = self.times[:self.count]
+        period = 1.0 / self.frame_rate
+        runs = self.gap_log()
+
+        intervals = np.diff(times)
+        if len(intervals):
+            jitter = (intervals - period) * 1e3
+            hist = np.histogram(jitter, bins=JITTER_BINS)[0]
+            achieved = (self.count - 1) / (times[-1] - times[0]) if times[-1] > times[0] else 0.0
+            late = int(np.count_nonzero(intervals > LATE_FACTOR * period))
+            jitter_std = float(np.std(jitter))
+            max_interval = float(intervals.max())
+        else:
+            hist = np.zeros(len(JITTER_BINS) - 1, dtype=int)
+            achieved, late, jitter_std, max_interval = 0.0, 0, 0.0, 0.0
+
+        report = {'expected': self.expected,
+                  'received': self.count + self.overflow,
+                  'missing': max(self.expected - self.count - self.overflow, 0),
+                  'gap_frames': int(sum(run[1] for run in runs)),
+                  'drop_runs': len(runs),
+                  'longest_drop_run': max([run[1] for run in runs], default=0),
+                  'gaps': runs,
+                  'first_frame_id': int(ids[0]) if self.count else None,
+                  'last_frame_id': int(ids[-1]) if self.count else None,
+                  'late_frames': late,
+                  'requested_fps': self.frame_rate,
+                  'achieved_fps': float(achieved),
+                  'capture_s': float(times[-1] - times[0]) if self.count else 0.0,
+                  'jitter_std_ms': jitter_std,
+                  'max_interval_ms': max_interval * 1e3,
+                  'jitter_bins_ms': [float(b) for b in JITTER_BINS[1:-1]],
+                  'jitter_hist': [int(n) for n in hist]}
+        camera_times = self.camera_times[:self.count]
+        if self.tick_frequency and self.count > 1 and camera_times.all():
+            # Exposure spacing per frame ID step, as the camera saw it
+            steps = np.maximum(np.diff(ids), 1)
+            per_frame = np.diff(camera_times) / self.tick_frequency / steps
+            span = (camera_times[-1] - camera_times[0]) / self.tick_frequency
+            report['camera_fps'] = float((ids[-1] - ids[0]) / span) if span > 0 else 0.0
+            report['camera_jitter_std_ms'] = float(np.std(per_frame - period) * 1e3)
+        if writer_stats is not None:
+            report['writer'] = writer_stats
+            report['stored'] = writer_stats['written']
+        return report
+
+    def save(self, path=HEALTH_NAME, report=None, writer_stats=None):
+        # Writes the report as json next to the trial frames and returns it
+        if report is None:
+            report = self.report(writer_stats)
+        with open(path, 'w') as f:
+            json.dump(report, f, indent=2)
+        return report
+
+
+def print_report(report):
+    # Console summary of a health report
+    print('Frames: {received}/{expected} received, {missing} missing in {drop_runs} drop runs '
+          '(longest {longest_drop_run})'.format(**report))
+    print('Rate: {achieved_fps:.1f} fps achieved of {requested_fps:.1f} requested, '
+          '{late_frames} late frames, jitter {jitter_std_ms:.3f} ms rms'.format(**report))
+    if 'camera_fps' in report:
+        print('Camera clock: {camera_fps:.1f} fps, jitter {camera_jitter_std_ms:.4f} ms rms'.format(**report))
+    if 'writer' in report:
+        print('Stored: {} frames, {} dropped by writer'.format(report['stored'], report['writer']['dropped']))
+
+
+def load_report(path=HEALTH_NAME):
+    with open(path) as f:
+        return json.load(f)
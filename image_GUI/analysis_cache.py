@@ -0,0 +1,129 @@
+# Persistent per-trial analysis cache
+# Positions and spectra are saved next to the frames as analysis_<params>.npz,
+# tagged with a content fingerprint of the trial's frame files. A later
+# analysis with the same parameters loads the sidecar instead of re-tracking;
+# changed frames (or parameters) miss the cache and are recomputed.
+#
+# The fingerprint is a blake2b hash of the files' bytes. Hashing is skipped when
+# every file still has the size and mtime recorded with the sidecar.
+
+import hashlib
+import json
+import os
+
+import numpy as np
+
+CACHE_PREFIX = 'analysis_'
+CACHE_VERSION = 2 # bump when the analysis itself changes, invalidating old sidecars
+HASH_CHUNK = 16 * 2**20
+
+
+def params_key(params):
+    # Short stable hash of the analysis parameters, used in the sidecar name
+    text = json.dumps(dict(params, version=CACHE_VERSION), sort_keys=True, default=str)
+    return hashlib.blake2b(text.encode(), digest_size=8).hexdigest()
+
+
+def cache_path(trial_dir, params):
+    return os.path.join(trial_dir, CACHE_PREFIX + params_key(params) + '.npz')
+
+
+def file_stats(paths):
+    # [name, size, mtime_ns] per source file, sorted so the order of paths does not matter
+    stats = []
+    for path in sorted(paths):
+        stat = os.stat(path)
+        stats.append([os.path.basename(path), stat.st_size, stat.st_mtime_ns])
+    return stats
+
+
+def fingerprint(paths, chunk_bytes=HASH_CHUNK):
+    """
+    Params:
+    paths (list) source files of a trial (frame container, frame .npy files or positions)
+    Returns:
+    Hex blake2b digest of the names and contents of the files
+    """
+    digest = hashlib.blake2b(digest_size=16)
+    for path in sorted(paths):
+        digest.update(os.path.basename(path).encode())
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(chunk_bytes), b''):
+                digest.update(block)
+    return digest.hexdigest()
+
+
+def load(path):
+    """
+    Returns:
+    (meta, arrays) of a sidecar: meta dict with fingerprint, stats, params and any
+    scalar results, arrays dict of the saved numpy arrays
+    """
+    with np.load(path) as data:
+        meta = json.loads(str(data['meta']))
+        arrays = {key: data[key] for key in data.files if key != 'meta'}
+    return meta, arrays
+
+
+def save(path, meta, arrays):
+    # Written to a temporary file then renamed, so readers never see a partial sidecar
+    tmp = path + '.tmp.npz'
+    np.savez(tmp, meta=json.dumps(meta), **arrays)
+    os.replace(tmp, path)
+
+
+def cached_analysis(trial_dir, compute, sources, **params):
+    """
+    Params:
+    trial_dir (str) trial directory the sidecar is kept in
+    compute: callable returning a dict of results (numpy arrays and json scalars)
+    sources (list) files the results are derived from, fingerprinted
+    params: analysis parameters (json serializable); any change gives a new sidecar
+    Returns:
+    dict of results, from the sidecar if it matches the sources and params, else from
+    compute() (and then saved)
+    """
+    path = cache_path(trial_dir, params)
+    stats = file_stats(sources)
+    digest = None
+    if os.path.exists(path):
+        try:
+            meta, arrays = load(path)
+        except (OSError, ValueError, KeyError):
+            meta = None # unreadable sidecar, recompute
+        if meta is not None and meta['params'] == json.loads(json.dumps(params, default=str)):
+            if meta['stats'] != stats:
+                # Files touched or replaced: only a content change invalidates
+                digest = fingerprint(sources)
+            if digest is None or digest == meta['fingerprint']:
+                if digest is not None:
+                    meta['stats'] = stats
+                    _try_save(path, meta, arrays)
+                return dict(meta['scalars'], **arrays)
+
+    result = compute()
+    if digest is None:
+        digest = fingerprint(sources)
+    arrays = {key: value for key, value in result.items() if isinstance(value, np.ndarray)}
+    scalars = {key: value for key, value in result.items() if key not in arrays}
+    meta = {'fingerprint': digest, 'stats': stats, 'params': params, 'scalars': scalars}
+    _try_save(path, json.loads(json.dumps(meta, default=str)), arrays)
+    return result
+
+
+def _try_save(path, meta, arrays):
+    # A read-only trial directory just means no caching
+    try:
+        save(path, meta, arrays)
+    except OSError as e:
+        print('Analysis cache not written ({}): {}'.format(path, e))
+
+
+def clear(trial_dir):
+    # Removes every analysis sidecar of a trial, returns the number removed
+    removed = 0
+    for file in os.listdir(trial_dir):
+        if file.startswith(CACHE_PREFIX) and file.endswith('.npz'):
+            os.remove(os.path.join(trial_dir, file))
+            removed += 1
+    return removed
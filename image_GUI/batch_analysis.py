@@ -0,0 +1,116 @@
+# Batch trial analysis
+# Fans trial directories out over a process pool; each worker loads, tracks and
+# computes PSDs for one trial and sends back only the compact results. Results
+# are kept in each trial's analysis sidecar, so unchanged trials are not redone
+#
+# Usage: python batch_analysis.py <data directory> [--processes N] [--method centroid] [--no-cache]
+
+import argparse
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+import analysis_cache
+import bead_tracking
+import camera_control_analysis as cca
+import roi_tracking
+import trial_manifest
+
+
+def analyze_trial(trial_dir, method=cca.TRACK_METHOD, nperseg=None, cache=True):
+    """
+    Params:
+    trial_dir (str) path of one trial_N directory, or one camera stream of a multi-camera trial
+    method (str) bead_tracking estimator
+    nperseg (int) Welch segment length, None for the default
+    cache (bool) reuse/save the trial's analysis sidecar (see analysis_cache)
+    Returns:
+    dict with the trial name (trial_N/camera_<id> for a camera stream), frame_rate, num_frames, positions x, y and PSD
+    freqs, x_psd, y_psd (no raw frames)
+    """
+    frame_rate = cca.trial_frame_rate(trial_dir)
+    timestamps = cca.load_frame_times(trial_dir, frame_rate) # gaps and jitter pick the PSD estimator
+    roi_shifts = roi_tracking.load_shifts(trial_dir) # tracking-ROI trials are stitched to sensor coordinates
+    image_paths = cca.create_image_path(trial_dir)
+    if image_paths:
+        sources = list(image_paths)
+        compute = lambda: cca.data_analysis(cca.load_trial(trial_dir), method=method, frame_rate=frame_rate,
+                                            nperseg=nperseg, roi_shifts=roi_shifts, timestamps=timestamps)
+    else:
+        positions = cca.load_positions(trial_dir)
+        if positions is None:
+            raise ValueError('No frames or positions in {}'.format(trial_dir))
+        sources = [os.path.join(trial_dir, bead_tracking.POSITIONS_NAME)]
+        method = 'online' # tracked during acquisition, method is whatever was used then
+        compute = lambda: cca.position_analysis(positions, frame_rate=frame_rate, nperseg=nperseg,
+                                                roi_shifts=roi_shifts, timestamps=timestamps)
+    if roi_shifts is not None:
+        sources.append(os.path.join(trial_dir, roi_tracking.ROI_LOG_NAME))
+
+    name = os.path.basename(os.path.normpath(trial_dir))
+    manifest = trial_manifest.read_manifest(trial_dir)
+    if manifest is not None and manifest.get('camera') is not None:
+        name = os.path.basename(os.path.dirname(os.path.normpath(trial_dir))) + '/' + name
+
+    def analyze():
+        (x, y), (freqs, x_psd, y_psd) = compute()
+        return {'frame_rate': frame_rate,
+                'num_frames': len(x),
+                'x': np.asarray(x, dtype=np.float64),
+                'y': np.asarray(y, dtype=np.float64),
+                'freqs': freqs,
+                'x_psd': x_psd,
+                'y_psd': y_psd}
+
+    if not cache:
+        result = analyze()
+    else:
+        result = analysis_cache.cached_analysis(trial_dir, analyze, sources, method=method,
+                                                nperseg=nperseg, frame_rate=frame_rate)
+    # Named after where the trial is now, not where its sidecar was written (copies, renames)
+    result['trial'] = name
+    return result
+
+
+def analyze_trials(trial_dirs, processes=None, method=cca.TRACK_METHOD, nperseg=None, cache=True):
+    """
+    Params:
+    trial_dirs (list) trial directory paths
+    processes (int) worker processes, None for one per core, 1 to run in this process
+    Returns:
+    dict of trial name -> analyze_trial result, in the order of trial_dirs
+    """
+    trial_dirs = [os.path.abspath(d) for d in trial_dirs]
+    if processes == 1 or len(trial_dirs) <= 1:
+        results = [analyze_trial(d, method, nperseg, cache) for d in trial_dirs]
+    else:
+        with ProcessPoolExecutor(max_workers=processes) as pool:
+            results = list(pool.map(analyze_trial, trial_dirs,
+                                    [method] * len(trial_dirs), [nperseg] * len(trial_dirs),
+                                    [cache] * len(trial_dirs)))
+    return {result['trial']: result for result in results}
+
+
+def analyze_directory(directory, processes=None, method=cca.TRACK_METHOD, nperseg=None, cache=True):
+    # Analyzes every trial_N subdirectory of directory, each camera of a multi-camera trial on its own
+    trial_dirs = []
+    for trial in cca.find_trials(directory):
+        trial_dirs.extend(cca.trial_streams(os.path.join(directory, trial)).values())
+    return analyze_trials(trial_dirs, processes, method, nperseg, cache)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Analyze every trial in a data directory in parallel')
+    parser.add_argument('directory')
+    parser.add_argument('--processes', type=int, default=None)
+    parser.add_argument('--method', default=cca.TRACK_METHOD)
+    parser.add_argument('--nperseg', type=int, default=None)
+    parser.add_argument('--no-cache', action='store_true', help='recompute, ignoring analysis sidecars')
+    args = parser.parse_args()
+
+    results = analyze_directory(args.directory, args.processes, args.method, args.nperseg, not args.no_cache)
+    for name, result in results.items():
+        print('{}: {} frames, x {:.3f} +/- {:.3f}, y {:.3f} +/- {:.3f} px'.format(
+            name, result['num_frames'], np.mean(result['x']), np.std(result['x']),
+            np.mean(result['y']), np.std(result['y'])))
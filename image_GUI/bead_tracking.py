@@ -0,0 +1,292 @@
+# Bead tracking engine
+# Batched position estimators over (n, H, W) frame blocks:
+#   argmax    - integer argmax of the column/row sums (original track_mean)
+#   centroid  - thresholded center of mass
+#   gaussian  - weighted log-parabola (Gaussian) fit to the column/row sums around the peak
+#   quadratic - 3-point parabola through the peak of the column/row sums
+# localize_bead finds the bead in a full frame (coarse-to-fine) for placing the ROI
+
+import numpy as np
+
+METHODS = ('argmax', 'centroid', 'gaussian', 'quadratic')
+CHUNK_BYTES = 64 * 2**20
+POSITIONS_NAME = 'positions.npz'
+
+
+def iter_chunks(frames, chunk_bytes=CHUNK_BYTES):
+    """
+    Params:
+    frames: (N, H, W) stack, in memory or lazy (memmap, frame_store.NpyTrial)
+    chunk_bytes (int) bound on the size of each block
+    Yields:
+    (start, block) with block an in-memory (n, H, W) slice of frames
+    """
+    num_frames, height, width = frames.shape
+    frame_bytes = height * width * np.dtype(frames.dtype).itemsize
+    step = max(1, chunk_bytes // frame_bytes)
+    for start in range(0, num_frames, step):
+        yield start, np.asarray(frames[start:start + step])
+
+
+def marginals(block):
+    # Column sums (n, W) and row sums (n, H) of each frame
+    return block.sum(axis=1, dtype=np.float64), block.sum(axis=2, dtype=np.float64)
+
+
+def argmax_peak(profiles):
+    # Integer peak of each (n, L) profile
+    return np.argmax(profiles, axis=1).astype(np.float64)
+
+
+def quadratic_peak(profiles):
+    # Sub-pixel peak from the parabola through the maximum and its two neighbours
+    n, length = profiles.shape
+    peak = np.argmax(profiles, axis=1)
+    inner = np.clip(peak, 1, length - 2)
+    rows = np.arange(n)
+    left = profiles[rows, inner - 1]
+    center = profiles[rows, inner]
+    right = profiles[rows, inner + 1]
+    denom = left - 2 * center + right
+    with np.errstate(divide='ignore', invalid='ignore'):
+        offset = np.where(denom < 0, 0.5 * (left - right) / denom, 0.0)
+    offset = np.clip(offset, -0.5, 0.5)
+    # Peaks on the profile edge have no neighbour on one side, keep them integer
+    offset[(peak == 0) | (peak == length - 1)] = 0.0
+    return inner + offset
+
+
+def gaussian_peak(profiles, half_width=3):
+    """
+    Params:
+    profiles (n, L) column or row sums
+    half_width (int) points either side of the peak used in the fit
+    Returns:
+    (n,) centers of a Gaussian fitted to each profile: weighted least squares of
+    log(profile - background) against a parabola, weights profile^2 (Guo, 2011)
+    """
+    n, length = profiles.shape
+    background = profiles.min(axis=1, keepdims=True)
+    signal = profiles - background
+    peak = np.argmax(signal, axis=1)
+
+    offsets = np.arange(-half_width, half_width + 1)
+    raw = peak[:, None] + offsets[None, :]
+    valid = (raw >= 0) & (raw < length)
+    idx = np.clip(raw, 0, length - 1)
+    vals = np.take_along_axis(signal, idx, axis=1)
+    tiny = np.finfo(np.float64).tiny
+    vals = np.maximum(vals, tiny)
+    weights = np.where(valid & (vals > tiny), vals ** 2, 0.0)
+    logs = np.log(vals)
+
+    t = offsets.astype(np.float64)[None, :]
+    s = [np.sum(weights * t ** k, axis=1) for k in range(5)]
+    r = [np.sum(weights * t ** k * logs, axis=1) for k in range(3)]
+    lhs = np.stack([np.stack([s[0], s[1], s[2]], axis=-1),
+                    np.stack([s[1], s[2], s[3]], axis=-1),
+                    np.stack([s[2], s[3], s[4]], axis=-1)], axis=-2)
+    rhs = np.stack(r, axis=-1)
+
+    center = peak.astype(np.float64)
+    # Singular systems (flat or too few points) keep the integer peak
+    ok = np.abs(np.linalg.det(lhs)) > 1e-12 * np.maximum(s[0], 1.0) ** 3
+    if np.any(ok):
+        coef = np.linalg.solve(lhs[ok], rhs[ok][..., None])[..., 0]
+        b, c = coef[:, 1], coef[:, 2]
+        fit = c < 0
+        shift = np.zeros_like(b)
+        shift[fit] = -b[fit] / (2 * c[fit])
+        shift = np.clip(shift, -half_width, half_width)
+        center[ok] += shift
+    return center
+
+
+def centroid(block, threshold=0.3):
+    """
+    Params:
+    block (n, H, W) frames
+    threshold (float) fraction of each frame's (max - min) range subtracted before
+        weighting, so the dark background does not pull the centroid to the middle
+    Returns:
+    (x, y) arrays of the thresholded center of mass of each frame
+    """
+    n, height, width = block.shape
+    frames = block.astype(np.float32)
+    low = frames.min(axis=(1, 2), keepdims=True)
+    high = frames.max(axis=(1, 2), keepdims=True)
+    frames -= low + threshold * (high - low)
+    np.maximum(frames, 0, out=frames)
+
+    cols = frames.sum(axis=1, dtype=np.float64)
+    rows = frames.sum(axis=2, dtype=np.float64)
+    total = cols.sum(axis=1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        x = cols @ np.arange(width, dtype=np.float64) / total
+        y = rows @ np.arange(height, dtype=np.float64) / total
+    # Uniform frames have no centroid, fall back to the frame center
+    x[total == 0] = (width - 1) / 2
+    y[total == 0] = (height - 1) / 2
+    return x, y
+
+
+def estimate_positions(block, method='centroid', **options):
+    """
+    Params:
+    block (n, H, W) in-memory frames
+    method (str) one of METHODS
+    options: threshold (centroid) or half_width (gaussian)
+    Returns:
+    (x, y) float arrays of bead positions in frame pixel coordinates
+    """
+    if block.ndim == 2:
+        block = block[None]
+    if method == 'centroid':
+        return centroid(block, **options)
+    cols, rows = marginals(block)
+    if method == 'argmax':
+        return argmax_peak(cols), argmax_peak(rows)
+    if method == 'quadratic':
+        return quadratic_peak(cols), quadratic_peak(rows)
+    if method == 'gaussian':
+        return gaussian_peak(cols, **options), gaussian_peak(rows, **options)
+    raise ValueError('Unknown tracking method {}, use one of {}'.format(method, METHODS))
+
+
+def smooth(image):
+    # Separable binomial [1, 4, 6, 4, 1] / 16 blur with edge padding, on a float image
+    kernel = (1.0, 4.0, 6.0, 4.0, 1.0)
+    for axis in (0, 1):
+        padded = np.pad(image, [(2, 2) if a == axis else (0, 0) for a in (0, 1)], mode='edge')
+        length = image.shape[axis]
+        image = sum(k * np.take(padded, np.arange(i, i + length), axis=axis) for i, k in enumerate(kernel)) / 16
+    return image
+
+
+def localize_bead(frames, downsample=4, window=None):
+    """
+    Coarse-to-fine bead search over a full frame, robust to hot pixels and stray light.
+    Params:
+    frames: (H, W) frame or (n, H, W) frames, averaged before searching
+    downsample (int) block size of the coarse search image
+    window (int) half width of the full resolution window the centroid is refined in,
+        default 2 * downsample
+    Returns:
+    (x, y, confidence): sub-pixel bead center in frame coordinates, and how clearly
+    the brightest blob stands out from the next brightest one, from 0 (ambiguous or
+    blank frame) to 1 (a single clear bead)
+    """
+    frames = np.asarray(frames)
+    image = frames.reshape((-1,) + frames.shape[-2:]).mean(axis=0, dtype=np.float32)
+    height, width = image.shape
+    if window is None:
+        window = 2 * downsample
+
+    # Block mean dilutes single hot pixels, the blur then favours extended blobs
+    h, w = height // downsample, width // downsample
+    coarse = image[:h * downsample, :w * downsample].reshape(h, downsample, w, downsample).mean(axis=(1, 3))
+    coarse = smooth(coarse)
+    iy, ix = np.unravel_index(np.argmax(coarse), coarse.shape)
+    peak = coarse[iy, ix]
+    background = np.median(coarse)
+
+    # Second brightest blob, outside the first one's neighbourhood
+    masked = coarse.copy()
+    masked[max(iy - 2, 0):iy + 3, max(ix - 2, 0):ix + 3] = background
+    second = max(masked.max(), background)
+    confidence = float((peak - second) / (peak - background)) if peak > background else 0.0
+
+    # Refine with a thresholded centroid in a full resolution window around the coarse peak
+    cx = int(ix * downsample + downsample // 2)
+    cy = int(iy * downsample + downsample // 2)
+    x0, x1 = max(cx - window, 0), min(cx + window + 1, width)
+    y0, y1 = max(cy - window, 0), min(cy + window + 1, height)
+    x, y = centroid(image[None, y0:y1, x0:x1])
+    return float(x[0] + x0), float(y[0] + y0), confidence
+
+
+def track_positions(frames, method='centroid', chunk_bytes=CHUNK_BYTES, **options):
+    """
+    Params:
+    frames: (N, H, W) stack, in memory or lazy
+    method (str) one of METHODS
+    chunk_bytes (int) bound on frame data processed at once
+    Returns:
+    (x, y) float arrays of length N
+    """
+    num_frames = frames.shape[0]
+    x = np.empty(num_frames, dtype=np.float64)
+    y = np.empty(num_frames, dtype=np.float64)
+    for start, block in iter_chunks(frames, chunk_bytes):
+        stop = start + len(block)
+        x[start:stop], y[start:stop] = estimate_positions(block, method, **options)
+    return x, y
+
+
+class PositionStream:
+    """
+    Online tracker with the frame store append interface: each frame's bead position
+    is estimated as it arrives and written into preallocated arrays, so a trial can
+    be tracked during acquisition with or without keeping the raw frames.
+    """
+    def __init__(self, capacity, method='centroid', path=POSITIONS_NAME, **options):
+        """
+        Params:
+        capacity (int) maximum number of frames tracked
+        method (str) one of METHODS
+        path (str) npz file written on close (None to keep in memory only)
+        options: estimator options, see estimate_positions
+        """
+        self.capacity = int(capacity)
+        self.method = method
+        self.path = path
+        self.options = options
+        self.count = 0
+        self.overflow = 0
+        self.frame_id = np.zeros(self.capacity, dtype=np.uint64)
+        self.timestamp = np.zeros(self.capacity, dtype=np.float64)
+        self.camera_time = np.zeros(self.capacity, dtype=np.uint64)
+        self.x = np.zeros(self.capacity, dtype=np.float64)
+        self.y = np.zeros(self.capacity, dtype=np.float64)
+
+    def append(self, frame_id, timestamp, image, camera_time=0):
+        if self.count >= self.capacity:
+            self.overflow += 1
+            return False
+        x, y = estimate_positions(image[None], self.method, **self.options)
+        i = self.count
+        self.frame_id[i] = frame_id
+        self.timestamp[i] = timestamp
+        self.camera_time[i] = camera_time
+        self.x[i] = x[0]
+        self.y[i] = y[0]
+        self.count += 1
+        return True
+
+    def positions(self):
+        # (x, y) of the frames tracked so far
+        return self.x[:self.count], self.y[:self.count]
+
+    def close(self):
+        if self.path is not None:
+            save_positions(self.path, self.x[:self.count], self.y[:self.count],
+                           self.frame_id[:self.count], self.timestamp[:self.count], self.method,
+                           self.camera_time[:self.count])
+
+
+def save_positions(path, x, y, frame_id, timestamp, method, camera_time=None):
+    if camera_time is None:
+        camera_time = np.zeros(len(x), dtype=np.uint64)
+    np.savez(path, x=x, y=y, frame_id=frame_id, timestamp=timestamp, method=method, camera_time=camera_time)
+
+
+def load_positions(path=POSITIONS_NAME):
+    """
+    Returns:
+    dict with x, y, frame_id, timestamp, camera_time arrays and the tracking method of
+    a positions file (camera_time is all zeros for files written before it was recorded)
+    """
+    with np.load(path) as data:
+        camera_time = data['camera_time'] if 'camera_time' in data else np.zeros(len(data['x']), dtype=np.uint64)
+        return {'x': data['x'], 'y': data['y'], 'frame_id': data['frame_id'],
+                'timestamp': data['timestamp'], 'camera_time': camera_time, 'method': str(data['method'])}
@@ -0,0 +1,229 @@
+# Acquisition throughput benchmark
+# Drives aquire_frames/save_frame against the simulated camera over a sweep of
+# frame rate, ROI size, camera buffer count and storage format, and writes one
+# json record per configuration so runs can be compared between versions.
+# --cameras instead sweeps the number of concurrent cameras (multi_camera), to
+# check total throughput scales with the camera count.
+#
+# Usage: python benchmark_acquisition.py [--quick] [--duration 2] [--out bench_acquisition.json]
+#        python benchmark_acquisition.py --cameras 1 2 4 [--duration 2]
+
+import argparse
+import contextlib
+import io
+import itertools
+import json
+import os
+import platform
+import shutil
+import subprocess
+import tempfile
+import time
+
+import numpy as np
+
+import acquisition_health
+import camera_backend
+import camera_session
+import camera_control_analysis as cca
+import frame_store
+import multi_camera
+
+FRAME_RATES = [100, 500, 1000, 2000]
+ROI_SIZES = [(16, 16), (32, 32), (64, 64), (128, 128), (320, 240), (640, 480)] # (width, height)
+BUFFERS = [8, 50, 200]
+STORAGE = ['container', 'compressed', 'npy']
+
+QUICK = {'frame_rates': [500, 2000],
+         'roi_sizes': [(16, 16), (640, 480)],
+         'buffers': [50],
+         'storage': STORAGE}
+
+
+def set_sim_roi(width, height, camera_id=0):
+    # Sets a centered ROI on a simulated camera, through the session aquire_frames uses
+    session = camera_session.get_session(camera_id)
+    session.set('Width', width)
+    session.set('Height', height)
+    session.set('OffsetX', (cca.MAX_WIDTH - width) // 2 // 8 * 8)
+    session.set('OffsetY', (cca.MAX_HEIGHT - height) // 2 // 2 * 2)
+
+
+def stored_bytes(trial):
+    # Bytes a trial's frame files actually hold: the filled part of preallocated containers
+    # (header plus index records and frames of the stored count), all of compressed and npy files
+    total = 0
+    for directory, _, names in os.walk(trial):
+        for name in names:
+            path = os.path.join(directory, name)
+            if frame_store.is_container(path):
+                header = frame_store.read_header(path)
+                frame_bytes = header['height'] * header['width'] * header['dtype'].itemsize
+                total += frame_store.HEADER_SIZE + header['count'] * (header['index_dtype'].itemsize + frame_bytes)
+            elif frame_store.is_compressed(path) or name.endswith('.npy'):
+                total += os.path.getsize(path)
+    return total
+
+
+def run_config(frame_rate, roi, buffer, storage, duration, workdir):
+    """
+    Params:
+    frame_rate (int) requested frame rate [Hz]
+    roi (tuple) (width, height) of the ROI
+    buffer (int) number of camera frames announced
+    storage (str) 'container', 'compressed' or 'npy'
+    duration (float) capture time [s]
+    workdir (str) scratch directory, emptied afterwards
+    Returns:
+    dict with sustained fps, drop rate, CPU time per frame (with and without the
+    simulator's frame rendering, which runs in this process) and bytes written per
+    second of capture
+    """
+    camera_backend.use_backend('sim', noise=0.0, wander=0.0, seed=0)
+    set_sim_roi(*roi)
+    trial = tempfile.mkdtemp(dir=workdir)
+    cwd = os.getcwd()
+    try:
+        cpu_start = time.process_time()
+        with contextlib.redirect_stdout(io.StringIO()):
+            cca.aquire_frames(frame_rate, duration, trial, buffer=buffer, storage=storage, progress=False)
+        cpu = time.process_time() - cpu_start
+        written = stored_bytes(trial)
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(trial, ignore_errors=True)
+
+    health = cca.health
+    camera = camera_backend.sim_camera_state()
+    expected = health['expected']
+    stored = health.get('stored', health['received'])
+    return {'frame_rate': frame_rate,
+            'width': roi[0],
+            'height': roi[1],
+            'buffer': buffer,
+            'storage': storage,
+            'duration': duration,
+            'expected': expected,
+            'stored': stored,
+            'camera_underruns': camera.underruns,
+            'sustained_fps': health['achieved_fps'],
+            'drop_rate': 1 - stored / expected if expected else 0.0,
+            'cpu_per_frame_us': 1e6 * (cpu - camera.render_cpu) / max(stored, 1),
+            'cpu_per_frame_us_incl_sim': 1e6 * cpu / max(stored, 1),
+            'bytes_written': written,
+            'bytes_per_s': written / health['capture_s'] if health['capture_s'] else 0.0,
+            'writer_max_depth': health['writer']['max_depth']}
+
+
+def run_cameras(num_cameras, frame_rate, roi, storage, duration, workdir):
+    """
+    Params:
+    num_cameras (int) simulated cameras captured concurrently
+    frame_rate, roi, storage, duration, workdir: see run_config
+    Returns:
+    dict with the per-camera and total sustained fps and stored frame rate, drop rate
+    and bytes written per second of capture, summed over cameras
+    """
+    camera_backend.use_backend('sim', num_cameras=num_cameras, noise=0.0, wander=0.0, seed=0)
+    for camera_id in range(num_cameras):
+        set_sim_roi(*roi, camera_id=camera_id)
+    trial = tempfile.mkdtemp(dir=workdir)
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            counts = multi_camera.aquire_frames_multi(frame_rate, duration, trial, camera_ids=range(num_cameras),
+                                                      storage=storage, progress=False)
+        bytes_per_s = 0.0
+        for camera_id in range(num_cameras):
+            stream = os.path.join(trial, multi_camera.CAMERA_DIR.format(camera_id))
+            with open(os.path.join(stream, acquisition_health.HEALTH_NAME)) as f:
+                capture = json.load(f)['capture_s']
+            bytes_per_s += stored_bytes(stream) / capture if capture else 0.0
+    finally:
+        shutil.rmtree(trial, ignore_errors=True)
+
+    expected = num_cameras * int(frame_rate * duration)
+    stored = sum(counts.values())
+    return {'cameras': num_cameras,
+            'frame_rate': frame_rate,
+            'width': roi[0],
+            'height': roi[1],
+            'storage': storage,
+            'duration': duration,
+            'expected': expected,
+            'stored': stored,
+            'stored_fps': stored / duration,
+            'stored_fps_per_camera': stored / duration / num_cameras,
+            'drop_rate': 1 - stored / expected if expected else 0.0,
+            'bytes_per_s': bytes_per_s}
+
+
+def environment():
+    # Identifies the code version and machine for comparing result files
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except OSError:
+        commit = ''
+    return {'commit': commit,
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'machine': platform.platform(),
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S')}
+
+
+def run_sweep(frame_rates, roi_sizes, buffers, storage, duration, out):
+    workdir = tempfile.mkdtemp(prefix='acq_bench_')
+    results = []
+    try:
+        for frame_rate, roi, buffer, fmt in itertools.product(frame_rates, roi_sizes, buffers, storage):
+            result = run_config(frame_rate, roi, buffer, fmt, duration, workdir)
+            results.append(result)
+            print('{frame_rate:5d} fps {width:3d}x{height:<3d} buf {buffer:3d} {storage:10s} | '
+                  '{sustained_fps:8.1f} fps  drop {drop_rate:6.2%}  cpu {cpu_per_frame_us:7.1f} us/frame  '
+                  '{bytes_per_s:12.0f} B/s'.format(**result))
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    with open(out, 'w') as f:
+        json.dump({'environment': environment(), 'results': results}, f, indent=2)
+    print('Results written to', out)
+    return results
+
+
+def run_camera_sweep(cameras, frame_rate, roi, duration, out, storage='container'):
+    workdir = tempfile.mkdtemp(prefix='acq_bench_')
+    results = []
+    try:
+        for num_cameras in cameras:
+            result = run_cameras(num_cameras, frame_rate, roi, storage, duration, workdir)
+            results.append(result)
+            print('{cameras:2d} cameras {frame_rate:5d} fps {width:3d}x{height:<3d} | stored {stored_fps:9.1f} fps '
+                  'total, {stored_fps_per_camera:8.1f} per camera  drop {drop_rate:6.2%}'.format(**result))
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    with open(out, 'w') as f:
+        json.dump({'environment': environment(), 'results': results}, f, indent=2)
+    print('Results written to', out)
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Acquisition throughput benchmark (simulated camera)')
+    parser.add_argument('--duration', type=float, default=2.0, help='capture time per configuration [s]')
+    parser.add_argument('--quick', action='store_true', help='small sweep for a fast check')
+    parser.add_argument('--out', default='bench_acquisition.json', help='json results file')
+    parser.add_argument('--cameras', type=int, nargs='+', default=None,
+                        help='sweep concurrent camera counts instead (at --rate, --roi)')
+    parser.add_argument('--rate', type=int, default=1000, help='frame rate of the camera sweep [Hz]')
+    parser.add_argument('--roi', type=int, nargs=2, default=[128, 128], help='ROI of the camera sweep (width height)')
+    args = parser.parse_args()
+
+    if args.cameras:
+        run_camera_sweep(args.cameras, args.rate, tuple(args.roi), args.duration, os.path.abspath(args.out))
+    else:
+        if args.quick:
+            grid = QUICK
+        else:
+            grid = {'frame_rates': FRAME_RATES, 'roi_sizes': ROI_SIZES, 'buffers': BUFFERS, 'storage': STORAGE}
+        run_sweep(duration=args.duration, out=os.path.abspath(args.out), **grid)
@@ -0,0 +1,102 @@
+# Frame compression benchmark
+# Compression ratio against write and read throughput of each storage format,
+# on synthetic bead frames (sim_camera.render_bead) written to a scratch file
+# through the same store classes acquisition uses
+#
+# Usage: python benchmark_compression.py [--frames 2000] [--roi 64] [--noise 2] [--out bench_compression.json]
+
+import argparse
+import json
+import os
+import shutil
+import tempfile
+import time
+
+import numpy as np
+
+import bead_tracking
+import frame_store
+from sim_camera import render_bead
+
+# (name, codec, level); lz4 entries are skipped when the package is missing
+CONFIGS = [('container', None, None),
+           ('zlib-1', 'zlib', 1),
+           ('zlib-3', 'zlib', 3),
+           ('zlib-6', 'zlib', 6),
+           ('lz4-0', 'lz4', 0),
+           ('lz4-4', 'lz4', 4)]
+
+
+def bead_frames(num_frames, roi, sigma=3.0, noise=2.0, wander=0.5, seed=0):
+    # (N, roi, roi) uint8 frames of a bead wandering around the ROI center
+    rng = np.random.default_rng(seed)
+    frames = np.empty((num_frames, roi, roi), dtype=np.uint8)
+    center = (roi - 1) / 2
+    for i in range(num_frames):
+        x, y = center + rng.normal(0.0, wander, size=2)
+        render_bead((roi, roi), x, y, sigma=sigma, noise=noise, rng=rng, out=frames[i])
+    return frames
+
+
+def run_config(frames, name, codec, level, workdir):
+    """
+    Returns:
+    dict with compression ratio, write and read throughput [MB/s of raw frames]
+    """
+    num_frames, height, width = frames.shape
+    if codec is None:
+        path = os.path.join(workdir, frame_store.CONTAINER_NAME)
+        store = frame_store.FrameStore(path, (height, width), frames.dtype, num_frames)
+    else:
+        path = os.path.join(workdir, frame_store.COMPRESSED_NAME)
+        store = frame_store.CompressedFrameStore(path, (height, width), frames.dtype, codec=codec, level=level)
+
+    start = time.perf_counter()
+    for i in range(num_frames):
+        store.append(i + 1, 0.0, frames[i])
+    store.close()
+    write = time.perf_counter() - start
+
+    start = time.perf_counter()
+    stack = frame_store.open_trial([path])
+    for _, block in bead_tracking.iter_chunks(stack):
+        pass
+    read = time.perf_counter() - start
+    assert np.array_equal(np.asarray(stack[:]), frames), 'Round trip mismatch for {}'.format(name)
+
+    raw = frames.nbytes
+    size = os.path.getsize(path)
+    os.remove(path)
+    return {'format': name,
+            'ratio': raw / size,
+            'write_MBps': raw / write / 2**20,
+            'read_MBps': raw / read / 2**20,
+            'file_bytes': size}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Frame compression ratio vs throughput benchmark')
+    parser.add_argument('--frames', type=int, default=2000)
+    parser.add_argument('--roi', type=int, default=64, help='square ROI size [pixels]')
+    parser.add_argument('--sigma', type=float, default=3.0, help='bead width [pixels]')
+    parser.add_argument('--noise', type=float, default=2.0, help='read noise std [counts]')
+    parser.add_argument('--out', default=None, help='optional json results file')
+    args = parser.parse_args()
+
+    frames = bead_frames(args.frames, args.roi, args.sigma, args.noise)
+    workdir = tempfile.mkdtemp(prefix='compress_bench_')
+    results = []
+    try:
+        for name, codec, level in CONFIGS:
+            if codec == 'lz4' and frame_store.lz4 is None:
+                print('{:10s} skipped (lz4 not installed)'.format(name))
+                continue
+            result = run_config(frames, name, codec, level, workdir)
+            results.append(result)
+            print('{format:10s} ratio {ratio:6.2f}   write {write_MBps:8.1f} MB/s   '
+                  'read {read_MBps:8.1f} MB/s'.format(**result))
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+    if args.out:
+        with open(args.out, 'w') as f:
+            json.dump({'params': vars(args), 'results': results}, f, indent=2)
@@ -0,0 +1,96 @@
+# Multi-bead tracking benchmark
+# Time per frame of multi_bead.track_beads against the number of beads K and the
+# frame size, next to a full-frame centroid of the same stack. Window tracking
+# should grow with K and stay flat in the frame size; the full-frame pass grows
+# with the pixel count.
+#
+# Usage: python benchmark_multi_bead.py [--frames 500] [--beads 1 2 4 8 16] [--sizes 128 256 512] [--out bench_multi_bead.json]
+
+import argparse
+import json
+import time
+
+import numpy as np
+
+import bead_tracking
+import multi_bead
+from sim_camera import render_bead
+
+
+def bead_stack(num_frames, size, num_beads, sigma=2.5, noise=2.0, wander=0.3, seed=0):
+    # (N, size, size) uint8 frames of num_beads beads on a grid, each wandering about its center
+    rng = np.random.default_rng(seed)
+    per_side = int(np.ceil(np.sqrt(num_beads)))
+    spacing = size / per_side
+    grid = (np.arange(per_side) + 0.5) * spacing
+    centers = np.array([(x, y) for y in grid for x in grid])[:num_beads]
+    sprite_half = int(np.ceil(4 * sigma))
+    frames = np.empty((num_frames, size, size), dtype=np.uint8)
+    for i in range(num_frames):
+        image = 10.0 + rng.normal(0.0, noise, size=(size, size))
+        for x, y in centers + rng.normal(0.0, wander, size=centers.shape):
+            # Each bead is rendered into a small patch only, so big frames stay quick to build
+            x0 = min(max(int(x) - sprite_half, 0), size - 2 * sprite_half - 1)
+            y0 = min(max(int(y) - sprite_half, 0), size - 2 * sprite_half - 1)
+            patch = (slice(y0, y0 + 2 * sprite_half + 1), slice(x0, x0 + 2 * sprite_half + 1))
+            image[patch] += render_bead((2 * sprite_half + 1,) * 2, x - x0, y - y0, sigma=sigma,
+                                        background=0.0, noise=0.0, dtype=np.float64)
+        np.clip(image, 0, 255, out=image)
+        frames[i] = image
+    return frames, centers
+
+
+def time_per_frame(func, num_frames, repeats=3):
+    # Best of repeats wall time of func() divided by num_frames [s]
+    best = np.inf
+    for _ in range(repeats):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    return best / num_frames
+
+
+def run_case(num_frames, size, num_beads, half_width):
+    """
+    Returns:
+    dict with detection time, per-frame window tracking and full-frame centroid times,
+    and the largest tracking error against the true grid centers [pixels]
+    """
+    frames, centers = bead_stack(num_frames, size, num_beads)
+    start = time.perf_counter()
+    found = multi_bead.detect_beads(frames[:4])
+    detect = time.perf_counter() - start
+    tracked = multi_bead.track_beads(frames, found, half_width=half_width)
+    # Match each true center to its nearest detected bead
+    nearest = np.argmin(((found[None] - centers[:, None]) ** 2).sum(axis=2), axis=1)
+    error = np.abs(tracked[:, nearest].mean(axis=0) - centers).max()
+    return {'size': size,
+            'beads': num_beads,
+            'detected': len(found),
+            'detect_s': detect,
+            'windows_us': 1e6 * time_per_frame(lambda: multi_bead.track_beads(frames, found, half_width=half_width),
+                                               num_frames),
+            'full_frame_us': 1e6 * time_per_frame(lambda: bead_tracking.estimate_positions(frames, 'centroid'),
+                                                  num_frames),
+            'max_error_px': float(error)}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Multi-bead tracking cost vs bead count and frame size')
+    parser.add_argument('--frames', type=int, default=500)
+    parser.add_argument('--beads', type=int, nargs='+', default=[1, 2, 4, 8, 16])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[128, 256, 512], help='square frame sizes [pixels]')
+    parser.add_argument('--half-width', type=int, default=multi_bead.HALF_WIDTH)
+    parser.add_argument('--out', default=None, help='optional json results file')
+    args = parser.parse_args()
+
+    results = []
+    for size in args.sizes:
+        for num_beads in args.beads:
+            result = run_case(args.frames, size, num_beads, args.half_width)
+            results.append(result)
+            print('{size:4d} px  K={beads:2d} (found {detected:2d})   windows {windows_us:8.1f} us/frame   '
+                  'full frame {full_frame_us:8.1f} us/frame   max error {max_error_px:.2f} px'.format(**result))
+    if args.out:
+        with open(args.out, 'w') as f:
+            json.dump({'params': vars(args), 'results': results}, f, indent=2)
@@ -0,0 +1,68 @@
+# Bead tracking benchmark
+# Speed and precision of each bead_tracking estimator on synthetic frames with
+# known sub-pixel bead positions (sim_camera.render_bead)
+#
+# Usage: python benchmark_tracking.py [--frames 5000] [--roi 16] [--noise 2] [--out bench_tracking.json]
+
+import argparse
+import json
+import time
+
+import numpy as np
+
+import bead_tracking
+from sim_camera import render_bead
+
+
+def synthetic_stack(num_frames, roi, sigma=3.0, noise=2.0, seed=0):
+    """
+    Returns:
+    (frames, x, y): (N, roi, roi) uint8 stack and the true bead centers,
+    uniformly spread over the central half of the ROI
+    """
+    rng = np.random.default_rng(seed)
+    x = roi / 4 + rng.random(num_frames) * roi / 2
+    y = roi / 4 + rng.random(num_frames) * roi / 2
+    frames = np.empty((num_frames, roi, roi), dtype=np.uint8)
+    for i in range(num_frames):
+        render_bead((roi, roi), x[i], y[i], sigma=sigma, noise=noise, rng=rng, out=frames[i])
+    return frames, x, y
+
+
+def benchmark(frames, x, y, methods=bead_tracking.METHODS, repeat=3):
+    """
+    Returns:
+    list of dicts with time per frame [us] (best of repeat) and rms / max error [pixels]
+    """
+    results = []
+    for method in methods:
+        best = np.inf
+        for _ in range(repeat):
+            start = time.perf_counter()
+            x_est, y_est = bead_tracking.track_positions(frames, method)
+            best = min(best, time.perf_counter() - start)
+        error = np.hypot(x_est - x, y_est - y)
+        results.append({'method': method,
+                        'us_per_frame': 1e6 * best / len(frames),
+                        'rms_error_px': float(np.sqrt(np.mean(error ** 2))),
+                        'max_error_px': float(error.max())})
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Bead tracking speed/precision benchmark')
+    parser.add_argument('--frames', type=int, default=5000)
+    parser.add_argument('--roi', type=int, default=16, help='square ROI size [pixels]')
+    parser.add_argument('--sigma', type=float, default=3.0, help='bead width [pixels]')
+    parser.add_argument('--noise', type=float, default=2.0, help='read noise std [counts]')
+    parser.add_argument('--out', default=None, help='optional json results file')
+    args = parser.parse_args()
+
+    frames, x, y = synthetic_stack(args.frames, args.roi, args.sigma, args.noise)
+    results = benchmark(frames, x, y)
+    for r in results:
+        print('{method:10s} {us_per_frame:8.2f} us/frame   rms error {rms_error_px:.4f} px   '
+              'max error {max_error_px:.4f} px'.format(**r))
+    if args.out:
+        with open(args.out, 'w') as f:
+            json.dump({'params': vars(args), 'results': results}, f, indent=2)
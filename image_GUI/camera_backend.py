@@ -0,0 +1,51 @@
+# Camera backend selection
+# camera_control_analysis gets Vimba from here instead of pymba directly, so the
+# simulated camera can stand in for the hardware (GGG_CAMERA_BACKEND=sim or use_backend('sim'))
+
+import os
+
+import sim_camera
+
+BACKEND = os.environ.get('GGG_CAMERA_BACKEND', 'vimba')
+
+_sim_options = {}
+_sim_cameras = {} # simulated cameras keep their features across Vimba sessions
+_generation = 0 # bumped by use_backend, so open camera sessions know they are stale
+
+try:
+    from pymba import Frame
+except (ImportError, OSError): # pymba missing or Vimba SDK not installed
+    Frame = sim_camera.SimFrame
+
+
+def use_backend(name, **options):
+    """
+    Params:
+    name (str) 'vimba' for the pymba hardware backend, 'sim' for the simulator
+    options: keyword options for sim_camera.SimVimba/SimCamera (fps jitter, drop_rate, bead, ...)
+    """
+    global BACKEND, _sim_options, _generation
+    if name not in ('vimba', 'sim'):
+        raise ValueError('Unknown camera backend {}'.format(name))
+    BACKEND = name
+    _sim_options = options
+    _sim_cameras.clear()
+    _generation += 1
+
+
+def generation():
+    # Changes whenever the backend (or its simulator options) is switched
+    return _generation
+
+
+def Vimba():
+    # Returns a Vimba instance for the selected backend
+    if BACKEND == 'sim':
+        return sim_camera.SimVimba(cameras=_sim_cameras, **_sim_options)
+    import pymba
+    return pymba.Vimba()
+
+
+def sim_camera_state(camera_id=0):
+    # Simulated camera instance, for inspecting generated/dropped counters after a run
+    return _sim_cameras.get(int(camera_id))
@@ -11,230 +11,578 @@ import matplotlib.pyplot as plt
 import matplotlib.mlab as mlab
 from matplotlib.mlab import psd
 
+import threading
 import time
 from time import sleep
-from pymba import Vimba
+from camera_backend import Frame
 from typing import Optional
-from pymba import Frame
 from tqdm import tqdm
 
 from pixel_data import Pixel_Data
+import frame_store
+import bead_tracking
+import spectra
+from frame_writer import FrameWriter, get_buffer_pool
+import acquisition_health
+import trial_manifest
+import camera_session
+import roi_tracking
 #sys.path.append('/home/analysis_user/New_trap_code/Tools/')
 import h5py
-import BeadDataFile
 
 imageDir = r"home/emmetth/EmmettH/data/"
 ROI_size = 16
 MAX_HEIGHT = 480
 MAX_WIDTH = 640
 MIN_EXPOSURE = 44.209
-
-def set_camera_defaults():
+FRAME_LATENCY = 0.1 # seconds of frames the camera pool covers before the callback re-queues
+WRITE_LATENCY = 1.0 # seconds of disk stall the host buffers absorb before dropping frames
+POOL_MEMORY = 256 * 2**20 # byte cap for each of the camera and host buffer pools
+MIN_POOL = 8
+STATUS_INTERVAL = 0.25 # seconds between status callbacks during acquisition
+TRACK_METHOD = 'centroid' # bead_tracking estimator used by data_analysis
+LOCALIZE_FRAMES = 4 # frames averaged when locating the bead for the ROI
+MIN_CONFIDENCE = 0.3 # localization confidence below which a warning is printed
+TICK_FREQUENCY = 1e9 # camera timestamp ticks per second when the camera does not report it
+
+def set_camera_defaults(session=None):
     # Resets frame from ROI to default (full frame)
-    with Vimba() as vimba:
-        vimba.startup()
-        camera = vimba.camera(0)
-        camera.open()
-        
-        camera.feature('OffsetX').value = 0
-        camera.feature('OffsetY').value = 0
-        camera.feature('Height').value = MAX_HEIGHT
-        camera.feature('Width').value = MAX_WIDTH
-        camera.feature('ExposureTime').value = MIN_EXPOSURE
-        camera.feature('AcquisitionFrameRateMode').value = 'Basic'
-
-
-        camera.close()
-    
-
-def aquire_frames(frame_rate, duration, path):
-    # Handles frame capture, according to params frame_rate and duration
-    if os.getcwd() != path:
-        os.chdir(path)
-    
-    global total # for use with progress bar in save_frame
-    total = frame_rate*duration
-
-    with Vimba() as vimba:
-        vimba.startup()
-        camera = vimba.camera(0)
-        camera.open()
-
-        # Create frame buffer queue
-        buffer = 50
-        frame_pool = [camera.new_frame() for _ in range(buffer)]
-        for frame in frame_pool:
+    # Only values the camera does not already have are sent
+    if session is None:
+        session = camera_session.get_session()
+    session.set('OffsetX', 0)
+    session.set('OffsetY', 0)
+    session.set('Height', MAX_HEIGHT)
+    session.set('Width', MAX_WIDTH)
+    session.set('ExposureTime', MIN_EXPOSURE)
+    session.set('AcquisitionFrameRateMode', 'Basic')
+
+
+def frame_pool_size(frame_rate, payload_size, latency, max_bytes=POOL_MEMORY, min_frames=MIN_POOL):
+    # Number of frame buffers covering latency seconds of capture at frame_rate,
+    # capped so the pool never takes more than max_bytes
+    frames = int(np.ceil(frame_rate * latency))
+    cap = max(min_frames, max_bytes // max(int(payload_size), 1))
+    return int(min(max(frames, min_frames), cap))
+
+
+class CameraStream:
+    """
+    One camera's capture: stores, writer thread, health monitor and frame callback,
+    bound to that camera's session and trial directory. aquire_frames runs one stream,
+    multi_camera.aquire_frames_multi one per camera.
+    """
+    def __init__(self, session, directory, frame_rate, duration, storage='container', track=None,
+                 frame_latency=FRAME_LATENCY, write_latency=WRITE_LATENCY, buffer=None, preview=None,
+                 follow_roi=False, progress=False):
+        """
+        Params:
+        session (camera_session.CameraSession) opened camera
+        directory (str) trial (or stream) directory, created if needed
+        frame_rate, duration, storage, track, frame_latency, write_latency, buffer,
+        preview, follow_roi: as for aquire_frames
+        progress (bool) print the capture progress from the frame callback
+        """
+        self.session = session
+        self.camera_id = session.camera_id
+        self.directory = directory
+        self.frame_rate = frame_rate
+        self.storage = storage
+        self.track = track
+        self.progress = progress
+        self.total = int(frame_rate * duration)
+        os.makedirs(directory, exist_ok=True)
+
+        # Preallocate one container for the whole trial
+        self.shape = (session.get('Height'), session.get('Width'))
+        self.dtype = pixel_dtype(session.camera)
+        self.offsets = (session.get('OffsetX'), session.get('OffsetY'))
+        self.stores = trial_stores(storage, self.shape, self.dtype, self.total, track, directory)
+        self.positions = self.stores[-1] if track is not None else None
+        self.roi = None
+        stores = list(self.stores)
+        if follow_roi:
+            if not stores:
+                raise ValueError('follow_roi needs storage and/or track')
+            self.roi = roi_tracking.RoiTracker(self.shape, self.offsets,
+                                               (session.get('HeightMax'), session.get('WidthMax')),
+                                               path=os.path.join(directory, roi_tracking.ROI_LOG_NAME))
+            stores.append(self.roi)
+        if not stores:
+            if preview is None:
+                raise ValueError('Nothing to record: set storage, track and/or preview')
+            stores.append(frame_store.NullStore())
+        self.store = stores[0] if len(stores) == 1 else frame_store.TeeStore(stores)
+
+        # Host buffers are allocated once per session and recycled across trials
+        payload = session.get('PayloadSize')
+        pool = get_buffer_pool(self.shape, self.dtype, frame_pool_size(frame_rate, payload, write_latency),
+                               owner=self.camera_id)
+        self.writer = FrameWriter(self.store, pool=pool, preview=preview,
+                                  name='FrameWriter-{}'.format(self.camera_id))
+        self.tick_frequency = timestamp_frequency(session)
+        self.monitor = acquisition_health.AcquisitionMonitor(self.total, frame_rate,
+                                                             tick_frequency=self.tick_frequency)
+        self.buffer = buffer if buffer is not None else frame_pool_size(frame_rate, payload, frame_latency)
+        if self.roi is not None:
+            self.roi.guard = self.buffer # frames already exposed with the old offsets when a shift is written
+        self.frame_pool = []
+        self.capturing = False
+        self.released = False
+        self.start_time = None
+        self.stop_time = None
+        self.health = None
+        self.manifest = None
+
+    def save_frame(self, frame: Frame):
+        # Frame callback, copies frame to the writer queue and re-queues the buffer
+        received = time.time()
+        self.monitor.record(frame.data.frameID, received, frame.data.timestamp)
+        self.writer.submit(frame.data.frameID, received, frame.buffer_data_numpy(), frame.data.timestamp)
+        frame.queue_for_capture(frame_callback=self.save_frame)
+        if self.progress:
+            print("\rProgress: {:2.1%}".format(frame.data.frameID/self.total), end='\r')
+
+    def arm(self):
+        # Starts the writer, announces and queues the frame pool and configures the
+        # capture; frames only flow after start()
+        self.writer.start()
+        camera = self.session.camera
+        self.frame_pool = [camera.new_frame() for _ in range(self.buffer)]
+        for frame in self.frame_pool:
             # Tell camera about each frame in queue with designated callback
             frame.announce()
-            frame.queue_for_capture(frame_callback=save_frame)
-
+            frame.queue_for_capture(frame_callback=self.save_frame)
         # Initialize camera in MultiFrame mode and announce how many frames it will capture
-        camera.feature('AcquisitionMode').value = 'MultiFrame'
-        camera.feature('AcquisitionFrameCount').value = frame_rate*duration
-        camera.feature('AcquisitionFrameRate').value = frame_rate 
-        print("Starting Acquisition\n")
-
-        # Start/stop acquisition
-        start = time.time()
+        self.session.set('AcquisitionMode', 'MultiFrame')
+        self.session.set('AcquisitionFrameCount', self.total)
+        self.session.set('AcquisitionFrameRate', self.frame_rate)
         camera.start_capture()
-        camera.AcquisitionStart()
-
-        sleep(duration)
+        self.capturing = True
+
+    def start(self, barrier=None):
+        # Starts acquisition, once every camera waiting on barrier is ready
+        if barrier is not None:
+            barrier.wait()
+        self.start_time = time.time()
+        self.session.camera.AcquisitionStart()
+
+    def follow(self):
+        # Re-centers the ROI on the bead once it has drifted (follow_roi)
+        if self.roi is None:
+            return
+        shift = self.roi.check(self.writer.submitted - self.writer.dropped)
+        if shift is not None:
+            self.session.set('OffsetX', shift[0])
+            self.session.set('OffsetY', shift[1])
+
+    def stop(self):
+        self.session.camera.AcquisitionStop()
+        self.stop_time = time.time()
+
+    def finish(self, stopped=False, group=True):
+        """
+        Releases the camera's frames, drains the writer and writes the health report
+        and, when anything was saved, the manifest.
+        Params:
+        stopped (bool) capture was ended early, expect only the frames of the time run
+        group (bool) the stream is one camera of a multi-camera trial: its manifest names
+            the camera and stays out of the session index (the group manifest is indexed)
+        Returns:
+        Number of frames stored
+        """
+        self.release()
+        if stopped:
+            self.monitor.expected = min(self.total, int(round((self.stop_time - self.start_time) * self.frame_rate)))
+        self.health = self.monitor.save(os.path.join(self.directory, acquisition_health.HEALTH_NAME),
+                                        writer_stats=self.writer.stats())
+        if self.storage is not None or self.track is not None:
+            self.manifest = write_trial_manifest(self.directory, self.stores[0], self.shape, self.dtype,
+                                                 self.frame_rate, self.offsets, self.storage, self.track,
+                                                 self.roi is not None, self.camera_id if group else None,
+                                                 not group, self.tick_frequency)
+        return self.store.count
+
+    def release(self, quiet=False):
+        """
+        Stops the camera and releases this trial's frames, writer thread and files.
+        Only undoes what arm()/start() got to, does nothing when called again, so it
+        is safe in a finally block after any failure.
+        Params:
+        quiet (bool) print failing steps and carry on instead of raising the first,
+            for cleaning up while another exception is on its way out
+        """
+        if self.released:
+            return
+        self.released = True
+        # The camera stays open in the session, release this trial's frames
+        camera = self.session.camera
+        steps = []
+        if self.start_time is not None and self.stop_time is None:
+            steps.append(camera.AcquisitionStop)
+        if self.capturing:
+            steps += [camera.end_capture, camera.flush_capture_queue]
+        if self.frame_pool:
+            steps.append(camera.revoke_all_frames)
+        if self.writer.is_alive():
+            steps.append(self.writer.stop)
+        steps.append(self.store.close)
+        error = None
+        for step in steps:
+            try:
+                step()
+            except Exception as e:
+                if not quiet and error is None:
+                    error = e
+                print('Camera {}: {} failed during cleanup: {}'.format(self.camera_id, step.__name__, e))
+        if error is not None:
+            raise error
+
+    def status(self):
+        # Frames received/expected, frames lost so far, writer queue depth
+        received, gap_frames = self.monitor.progress()
+        return {'received': received,
+                'expected': self.total,
+                'gap_frames': gap_frames,
+                'writer_dropped': self.writer.dropped,
+                'queue_depth': self.writer.queue.qsize(),
+                'max_queue': self.writer.max_queue}
+
+
+def aquire_frames(frame_rate, duration, path, frame_latency=FRAME_LATENCY, write_latency=WRITE_LATENCY,
+                  buffer=None, storage='container', progress=True, track=None, stop_event=None, status=None,
+                  preview=None, session=None, follow_roi=False):
+    # Handles frame capture, according to params frame_rate and duration
+    # Frames are handed to a writer thread, see writer.stats() for queue depth and drops
+    # Camera and host pools are sized from frame rate x payload x latency budget,
+    # unless buffer gives the camera pool size explicitly
+    # storage: 'container' (one trial.frames file), 'compressed' (trial.cframes, zlib blocks),
+    # 'npy' (legacy file per frame) or None
+    # track: bead_tracking method to track each frame as it arrives (positions.npz), None for off
+    # Writes a health report (drops, jitter, achieved fps) to health.json in the trial
+    # stop_event (threading.Event) ends the capture early when set, e.g. from a GUI Stop button
+    # status is called with acquisition_status() every STATUS_INTERVAL while capturing
+    # preview (frame_writer.PreviewTap) receives throttled frames for live display; with
+    # storage=None and track=None the capture is preview only and nothing is saved
+    # Saved trials get a manifest.json and an entry in the session index (trials.json) one level up
+    # session (camera_session.CameraSession) camera to use, default the shared open session
+    # follow_roi: move the ROI offsets with the bead as it drifts, logging shifts to roi_shifts.json
+    # Every frame's camera timestamp is stored with its frameID (tick rate in the manifest)
+    if os.getcwd() != path:
+        os.chdir(path)
 
-        camera.AcquisitionStop()
-        end = time.time()
+    global stream # CameraStream of the running trial
+    global total # frames expected
+    global store # trial container
+    global positions # online tracker, when track is set
+    global writer # writer thread fed by the frame callback
+    global monitor # per-frame receive log for the health report
+    global health # health report of the last trial
+
+    if session is None:
+        session = camera_session.get_session()
+    stream = CameraStream(session, os.getcwd(), frame_rate, duration, storage, track, frame_latency,
+                          write_latency, buffer, preview, follow_roi, progress)
+    total, store, positions = stream.total, stream.store, stream.positions
+    writer, monitor = stream.writer, stream.monitor
+
+    # Whatever fails below, the finally leaves the camera stopped with its frames
+    # revoked and the writer and files closed, ready for the next trial
+    stopper = stop_event if stop_event is not None else threading.Event()
+    try:
+        stream.arm()
+        print("Starting Acquisition\n")
+        stream.start()
+        start = stream.start_time
+
+        # Wait out the capture, reporting progress and watching for a stop request
+        # With a tracking ROI the loop also re-centers the ROI on the bead
+        interval = roi_tracking.CHECK_INTERVAL if stream.roi is not None else STATUS_INTERVAL
+        next_status = 0.0
+        while not stopper.is_set():
+            remaining = start + duration - time.time()
+            if remaining <= 0:
+                break
+            stopper.wait(min(remaining, interval))
+            stream.follow()
+            if status is not None and time.time() >= next_status:
+                status(acquisition_status())
+                next_status = time.time() + STATUS_INTERVAL
+
+        stream.stop()
         sleep(0.2)
 
-        camera.end_capture()
-        camera.flush_capture_queue()
-        camera.close()
-
-        vimba.shutdown()
-        print('\n')
-        print('total time: ', end-start)
+        count = stream.finish(stopper.is_set(), group=False)
+    finally:
+        stream.release(quiet=True)
+    health = stream.health
+    print('\n')
+    print('total time: ', stream.stop_time-start)
+    stats = writer.stats()
+    print('writer queue: max depth {max_depth}/{max_queue}, {blocked} full, {dropped} dropped'.format(**stats))
+    acquisition_health.print_report(health)
+    if stream.roi is not None:
+        print('ROI followed the bead with {} shifts'.format(len(stream.roi.shifts) - 1))
 
     print('Capture complete\n')
+    return count
+
+
+def trial_stores(storage, shape, dtype, total, track, directory=''):
+    # Stores a trial's frames go to, in directory: the frame file for storage ('container',
+    # 'compressed', 'npy' or None), then the online PositionStream when track is set
+    stores = []
+    if storage == 'container':
+        stores.append(frame_store.FrameStore(os.path.join(directory, frame_store.CONTAINER_NAME),
+                                             shape, dtype, total))
+    elif storage == 'compressed':
+        stores.append(frame_store.CompressedFrameStore(os.path.join(directory, frame_store.COMPRESSED_NAME),
+                                                       shape, dtype))
+    elif storage == 'npy':
+        stores.append(frame_store.NpyFrameStore(directory or '.'))
+    elif storage is not None:
+        raise ValueError('Unknown storage format {}'.format(storage))
+    if track is not None:
+        stores.append(bead_tracking.PositionStream(total, method=track,
+                                                   path=os.path.join(directory, bead_tracking.POSITIONS_NAME)))
+    return stores
+
+
+def write_trial_manifest(path, main_store, shape, dtype, frame_rate, offsets, storage, track, follow_roi=False,
+                         camera=None, index=True, tick_frequency=None):
+    # Manifest of the trial just captured in path, added to the session index of its parent directory
+    # camera: camera ID of a multi-camera stream, whose manifest is left out of the index (index=False)
+    # tick_frequency: camera timestamp ticks per second
+    if storage == 'container':
+        files = [frame_store.CONTAINER_NAME]
+    elif storage == 'compressed':
+        files = [frame_store.COMPRESSED_NAME]
+    elif storage == 'npy':
+        files = main_store.files
+    else:
+        files = []
+    manifest = trial_manifest.write_manifest(path, main_store.count, shape, dtype, frame_rate, offsets, storage,
+                                             files, bead_tracking.POSITIONS_NAME if track is not None else None,
+                                             roi_tracking.ROI_LOG_NAME if follow_roi else None, camera,
+                                             tick_frequency)
+    if not index:
+        return manifest
+    try:
+        trial_manifest.add_to_index(os.path.dirname(os.path.abspath(path)), manifest)
+    except OSError as e:
+        print('Trial index not updated:', e)
+    return manifest
 
     
+def acquisition_status():
+    # Snapshot of the running acquisition: frames received/expected, frames lost so far, writer queue depth
+    return stream.status()
+
+
 def save_frame(frame: Frame):
-    # Callable for camera.arm(), saves frame as numpy file
-    global total
-    frame_num = 'frame_{}'.format(frame.data.frameID)
-    print("\rProgress: {:2.1%}".format(frame.data.frameID/total), end='\r')
-
-    image = frame.buffer_data_numpy()
-    np.save(frame_num, image)
-    frame.queue_for_capture(frame_callback=save_frame)
-        
+    # Frame callback of the running acquisition, see CameraStream.save_frame
+    stream.save_frame(frame)
 
-def bead_height(imshow=False):
-    # Same algorithm used with ROI set, but called seperately with option to show image
-    # with highlighted bead
-    with Vimba() as vimba:
-        vimba.startup()
-        camera = vimba.camera(0)
-        camera.open()
 
-        camera.arm('SingleFrame')
-        frame = camera.acquire_frame()
-        image = frame.buffer_data_numpy()
-        camera.disarm()
+def timestamp_frequency(session):
+    # Camera timestamp ticks per second (GigE cameras report it, others count ns)
+    try:
+        return float(session.get('GevTimestampTickFrequency'))
+    except Exception:
+        return TICK_FREQUENCY
+
 
-        x_mean = np.mean(image, axis=0)
-        y_mean = np.mean(image, axis=1)
-        x_pos = int(np.argmax(x_mean))
-        y_pos = int(np.argmax(y_mean))
+def pixel_dtype(camera):
+    # Numpy dtype matching the camera's current pixel format
+    if camera.feature('PixelFormat').value in ('Mono8', 'BayerRG8', 'BayerGR8'):
+        return np.uint8
+    return np.uint16
+        
 
-        camera.close()
-        vimba.shutdown()
+def snapshot(num_frames=1, session=None):
+    # (num_frames, H, W) copies of single frames grabbed from the current ROI
+    if session is None:
+        session = camera_session.get_session()
+    camera = session.camera
+
+    camera.arm('SingleFrame')
+    images = []
+    for _ in range(num_frames):
+        frame = camera.acquire_frame()
+        images.append(np.array(frame.buffer_data_numpy())) # the frame buffer may be reused
+    camera.disarm()
+    session.invalidate('AcquisitionMode') # arm() wrote it behind the session's back
+    return np.stack(images)
+
+
+def locate_bead(num_frames=LOCALIZE_FRAMES, session=None):
+    # Bead center in sensor coordinates from a few averaged frames of the current ROI,
+    # see bead_tracking.localize_bead; returns (x, y, confidence, image)
+    if session is None:
+        session = camera_session.get_session()
+    images = snapshot(num_frames, session)
+    x, y, confidence = bead_tracking.localize_bead(images)
+    x += session.get('OffsetX')
+    y += session.get('OffsetY')
+    if confidence < MIN_CONFIDENCE:
+        print('Warning: bead localization confidence only {:.2f}'.format(confidence))
+    return x, y, confidence, images.mean(axis=0)
+
+
+def bead_height(imshow=False, session=None):
+    # Same localization used to set the ROI, but called seperately with option to show image
+    # with highlighted bead
+    # Returns (x, y, confidence), position in sensor coordinates
+    if session is None:
+        session = camera_session.get_session()
+    x_pos, y_pos, confidence, image = locate_bead(session=session)
 
     if imshow:
+        # Image is of the current ROI, so plot in its coordinates
+        x_roi, y_roi = x_pos - session.get('OffsetX'), y_pos - session.get('OffsetY')
         plt.figure()
         plt.imshow(image)
-        plt.annotate('detected bead: {},{}'.format(x_pos,y_pos), xy=(x_pos,y_pos), xytext=(x_pos+25,y_pos+25), c='w')
-        plt.scatter(x_pos, y_pos, c='r')
+        plt.annotate('detected bead: {:.1f},{:.1f} ({:.0%})'.format(x_pos, y_pos, confidence),
+                     xy=(x_roi,y_roi), xytext=(x_roi+25,y_roi+25), c='w')
+        plt.scatter(x_roi, y_roi, c='r')
         plt.show()
-    return x_pos, y_pos
+    return x_pos, y_pos, confidence
 
         
-def set_roi(size=ROI_size):
+def set_roi(size=ROI_size, session=None):
     # Handles region of interest selection
-    # Finds center of bead via averaging one frame and argmax to pick pixel
-    # Vimba only accepts certain values of offsets, as found through Vimba Viewer
-    # Assumes full frame input (i.e. no ROI set before this funtion is called)
-    # Might need additional support for bead in corner of frame
+    # Locates the bead in a few averaged frames (bead_tracking.localize_bead) and centers
+    # the ROI on it as closely as the camera allows (roi_tracking.roi_offsets): offsets on
+    # their 8/2 pixel grid and the ROI clamped onto the sensor, also near edges and corners
+    # Returns (x, y, confidence), bead position in sensor coordinates
     
     print()
     print('Setting ROI...\n')
-    with Vimba() as vimba:
-        vimba.startup()
-        camera = vimba.camera(0)
-        camera.open()
-
-        camera.arm('SingleFrame')
-        frame = camera.acquire_frame()
-        image = frame.buffer_data_numpy()
-        camera.disarm()
-
-        # Grab brightest pixel from single image
-        x_mean = np.mean(image, axis=0)
-        y_mean = np.mean(image, axis=1)
-        x_pos = int(np.argmax(x_mean))
-        y_pos = int(np.argmax(y_mean))
-
-        camera.feature('Height').value = size // 2 * 2 # increment of 2
-        camera.feature('Width').value = size // 8 * 8 # must be increment of 8
-
-        print("Center: ", x_pos, ",", y_pos)
-
-        x_offset = 8 * ((x_pos - (size/2))//8)
-        y_offset = 2 * ((y_pos - (size/2))//2)
-
-        # In bounds
-        if x_offset > 0 and x_offset + size < camera.feature('WidthMax').value:
-            if y_offset > 0 and y_offset + size < camera.feature('HeightMax').value:
-                camera.feature('OffsetX').value = int(x_offset)
-                camera.feature('OffsetY').value = int(y_offset)
-                print('Center ROI set')
-        # x_offset too large
-        elif x_offset + size > camera.feature('WidthMax').value:
-            if y_offset + size > camera.feature('HeightMax').value:
-                camera.feature('OffsetX').value = camera.feature('WidthMax').value - size
-                camera.feature('OffsetY').value = camera.featrue('HeightMax').value - size
-            else:
-                camera.feature('OffsetX').value = camera.feature('WidthMax').value - size
-                camera.feature('OffsetY').value = int(y_offset)
-            print('x bound hit, ROI set')
-        # y_offset too large
-        elif y_offset + size > camera.feature('HeightMax').value:
-            # bottom corner case covered in above elif
-            camera.feature('OffsetX').value = int(x_offset)
-            camera.feature('OffsetY').value = camera.featrue('HeightMax').value - size
-            print('y bound hit, ROI set')
-        # just set ROI in corner because I'm lazy
-        else:
-            camera.feature('OffsetX').value = 0
-            camera.feature('OffsetY').value = 0
-            print('Corner ROI set')
-
-        camera.close()
-        vimba.shutdown()
-
-    return (x_pos,y_pos)
-
-        
-def create_image_path():
+    if session is None:
+        session = camera_session.get_session()
+
+    x_pos, y_pos, confidence = bead_height(session=session)
+    print("Center: {:.1f}, {:.1f} (confidence {:.2f})".format(x_pos, y_pos, confidence))
+
+    offset_x, offset_y, width, height = roi_tracking.roi_offsets(
+        x_pos, y_pos, size, (session.get('HeightMax'), session.get('WidthMax')))
+    # Shrinking: size first, growing: offsets first, so the ROI stays on the sensor in between
+    if width <= session.get('Width'):
+        session.set('Width', width)
+        session.set('OffsetX', offset_x)
+    else:
+        session.set('OffsetX', offset_x)
+        session.set('Width', width)
+    if height <= session.get('Height'):
+        session.set('Height', height)
+        session.set('OffsetY', offset_y)
+    else:
+        session.set('OffsetY', offset_y)
+        session.set('Height', height)
+    print('ROI set: {}x{} at offsets {}, {}'.format(width, height, offset_x, offset_y))
+
+    return (x_pos, y_pos, confidence)
+
+def create_image_path(directory=None):
     #image path and valid extensions
+    #directory defaults to the working directory
+    #trials with a manifest list their files there, older trials are scanned
     
+    if directory is None:
+        directory = os.getcwd()
+    manifest = trial_manifest.read_manifest(directory)
+    if manifest is not None:
+        return trial_manifest.manifest_paths(directory, manifest)
     image_path_list = []
-    valid_image_extensions = [".jpg", ".jpeg", ".bmp", ".npy", '.h5']
+    valid_image_extensions = [".jpg", ".jpeg", ".bmp", ".npy", '.h5', frame_store.CONTAINER_EXT, frame_store.COMPRESSED_EXT]
     valid_image_extensions = [item.lower() for item in valid_image_extensions]
     
     #create a list all files in directory and
     #append files with a vaild extention to image_path_list
-    for file in os.listdir(os.getcwd()):
+    for file in os.listdir(directory):
         extension = os.path.splitext(file)[1]
         if extension.lower() not in valid_image_extensions:
             continue
-        image_path_list.append(os.path.join(os.getcwd(), file))
+        image_path_list.append(os.path.join(directory, file))
     
     return image_path_list
 
 
 def load_images(image_path_list):
-    # Takes a list of paths to images and returns a list of the sorted frame arrays
+    # Takes a list of paths to images and returns the sorted frames as a lazy (N, H, W) stack
+    # Container trials are one memory map; legacy .npy trials are memory mapped per frame on access
     
-    images = []
-    # sort the string filenames by int frame number
-    image_path_list.sort(key=lambda f: int(f.split('/')[-1].split('.')[0].split('_')[-1]))
-    for img_path in image_path_list:
-        img = np.load(img_path)
-        images.append(img)
-    return images
+    return frame_store.open_trial(image_path_list)
+
+
+def load_trial(directory=None, camera=None):
+    # Lazy (N, H, W) frame stack of the trial in directory (default working directory)
+    # With a manifest this needs no directory listing or per-file reads
+    # camera: camera ID to load from a multi-camera trial, default its first stream
+    if directory is None:
+        directory = os.getcwd()
+    manifest = trial_manifest.read_manifest(directory)
+    if manifest is None:
+        return load_images(create_image_path(directory))
+    streams = trial_manifest.stream_dirs(directory, manifest)
+    if streams:
+        return load_trial(streams[str(camera)] if camera is not None else next(iter(streams.values())))
+    return frame_store.open_trial(trial_manifest.manifest_paths(directory, manifest),
+                                  shape=manifest['shape'], dtype=manifest['dtype'], ordered=True)
+
+
+def trial_streams(directory=None):
+    # Camera ID -> stream directory of a multi-camera trial, {None: directory} for a single camera
+    if directory is None:
+        directory = os.getcwd()
+    return trial_manifest.stream_dirs(directory) or {None: directory}
+
+
+def load_frame_index(directory=''):
+    # (N,) frame_id/timestamp records of the frames stored in directory's trial,
+    # from its container or online positions; None for npy trials, which keep no index
+    manifest = trial_manifest.read_manifest(directory)
+    paths = trial_manifest.manifest_paths(directory, manifest) if manifest is not None else create_image_path(directory)
+    for path in paths:
+        if frame_store.is_container(path):
+            return frame_store.open_frames(path)[1]
+        if frame_store.is_compressed(path):
+            return frame_store.open_compressed(path)[1]
+    path = os.path.join(directory, bead_tracking.POSITIONS_NAME)
+    if os.path.exists(path):
+        tracked = bead_tracking.load_positions(path)
+        index = np.zeros(len(tracked['x']), dtype=frame_store.INDEX_DTYPE)
+        index['frame_id'] = tracked['frame_id']
+        index['timestamp'] = tracked['timestamp']
+        index['camera_time'] = tracked['camera_time']
+        return index
+    return None
+
+
+def load_frame_times(directory='', frame_rate=None):
+    # (N,) sample time [s] of every stored frame of directory's trial, from the first frame
+    # Camera timestamps when the trial has them; otherwise frame IDs at frame_rate (default
+    # the trial's), which still place dropped frames exactly; host receive times as a last
+    # resort. None if the trial keeps no frame index (npy storage)
+    index = load_frame_index(directory)
+    if index is None or len(index) == 0:
+        return None
+    manifest = trial_manifest.read_manifest(directory) or {}
+    tick_frequency = manifest.get('timestamp_frequency')
+    if tick_frequency and 'camera_time' in index.dtype.names and index['camera_time'].all():
+        camera_time = index['camera_time'].astype(np.int64)
+        return (camera_time - camera_time[0]) / tick_frequency
+    if frame_rate is None:
+        frame_rate = trial_frame_rate(directory)
+    if frame_rate:
+        frame_id = index['frame_id'].astype(np.int64)
+        return (frame_id - frame_id[0]) / frame_rate
+    return index['timestamp'] - index['timestamp'][0]
 
 
 def load_h5(filename): 
     # Loads a .h5 dataset into x, y, and z components
+    import BeadDataFile # lab-only module, not needed for acquisition
     
     bd = BeadDataFile.BeadDataFile(fname) #h5.wrapper written by Nadav
     x = bd.x2 # x coordinate, invisble for us
@@ -244,9 +592,55 @@ def load_h5(filename):
     return (x,y,z)
 
 
-def data_analysis(image_list):
+def find_trials(directory=None):
+    # Sorted trial_N subdirectory names of directory (default working directory)
+    # Read from the session index, which is built by scanning on first use
+    if directory is None:
+        directory = os.getcwd()
+    return trial_manifest.trial_names(directory)
+
+
+def load_positions(directory=''):
+    # Positions tracked online during acquisition, for trials recorded without frames
+    path = os.path.join(directory, bead_tracking.POSITIONS_NAME)
+    if not os.path.exists(path):
+        return None
+    tracked = bead_tracking.load_positions(path)
+    return tracked['x'], tracked['y']
+
+
+def trial_frame_rate(directory=''):
+    # Frame rate the trial in directory (default working directory) was captured at,
+    # from its manifest or health report
+    manifest = trial_manifest.read_manifest(directory)
+    if manifest is not None:
+        return manifest['frame_rate']
+    path = os.path.join(directory, acquisition_health.HEALTH_NAME)
+    if not os.path.exists(path):
+        return None
+    return acquisition_health.load_report(path)['requested_fps']
+
+
+def position_analysis(positions, frame_rate=None, nperseg=None, roi_shifts=None, timestamps=None):
+    # Same outputs as data_analysis, starting from already tracked (x, y) positions
+    # roi_shifts: shift log of a tracking-ROI trial, positions are then stitched to sensor coordinates
+    # timestamps: per-frame sample times [s] (see load_frame_times); dropped frames or jitter
+    # then switch the PSDs to a gap-tolerant estimator (spectra.sampled_psd)
+    if roi_shifts is not None:
+        positions = roi_tracking.absolute_positions(positions[0], positions[1], roi_shifts)
+    freqs, psds = spectra.sampled_psd(np.stack(positions), timestamps, fs=frame_rate, nperseg=nperseg)
+    return positions, (freqs, psds[0], psds[1])
+
+
+def data_analysis(image_list, method=TRACK_METHOD, frame_rate=None, nperseg=None, roi_shifts=None, timestamps=None):
     # Any data analysis wanted goes in here
     # Pixel_Data instance created, any submethods called on that
+    # frame_rate [Hz] puts the PSDs on a physical frequency axis
+    # roi_shifts: shift log of a tracking-ROI trial, see position_analysis
+    # timestamps: per-frame sample times [s], see position_analysis
     
     data = Pixel_Data(image_list)
-    return data.track_mean(), data.bead_temporal_fft()
+    if roi_shifts is not None:
+        return position_analysis(data.track_mean(method=method), frame_rate, nperseg, roi_shifts, timestamps)
+    return data.track_mean(method=method), data.bead_temporal_fft(frame_rate=frame_rate, timestamps=timestamps,
+                                                                   nperseg=nperseg)
@@ -0,0 +1,168 @@
+# Long-lived camera session
+# One started Vimba instance and one opened session per camera, shared by every
+# call and trial, instead of a Vimba startup/open handshake per function. Feature
+# writes go through a cache so values the camera already has are not re-sent.
+
+import atexit
+
+import camera_backend
+import frame_writer
+
+# Features the camera may change by itself when others are written (e.g. the
+# frame rate is clamped to what a new ROI allows), never skipped as unchanged
+VOLATILE = ('AcquisitionFrameRate',)
+
+_MISSING = object()
+
+
+class CameraSession:
+    """
+    Owns one opened camera. Write features with set() so unchanged values are skipped;
+    anything that writes the camera outside the session must call invalidate().
+    """
+    def __init__(self, camera_id=0, vimba=None):
+        """
+        Params:
+        camera_id (int) camera to open
+        vimba: started Vimba instance to open the camera from, shared with other
+            sessions and left running on close; None to start (and shut down) its own
+        """
+        self.camera_id = camera_id
+        self.shared_vimba = vimba
+        self.vimba = None
+        self.camera = None
+        self.backend = None # camera_backend generation the camera belongs to
+        self.writes = 0
+        self.skipped = 0
+        self._features = {} # name -> last value written or read
+
+    @property
+    def is_open(self):
+        return self.camera is not None
+
+    def open(self):
+        # Starts Vimba and opens the camera, once
+        if self.is_open:
+            return self
+        vimba = self.shared_vimba
+        if vimba is None:
+            vimba = camera_backend.Vimba()
+            vimba.startup()
+        camera = vimba.camera(self.camera_id)
+        camera.open()
+        self.vimba, self.camera = vimba, camera
+        self.backend = camera_backend.generation()
+        return self
+
+    def close(self):
+        # Clean shutdown: closes the camera (and Vimba, if the session started it),
+        # forgets cached features
+        if not self.is_open:
+            return
+        try:
+            self.camera.close()
+        finally:
+            if self.shared_vimba is None:
+                self.vimba.shutdown()
+            self.vimba = None
+            self.camera = None
+            self._features.clear()
+
+    def __enter__(self):
+        return self.open()
+
+    def __exit__(self, *args):
+        self.close()
+
+    def get(self, name):
+        # Current value of a feature, read from the camera
+        value = self.camera.feature(name).value
+        self._features[name] = value
+        return value
+
+    def set(self, name, value):
+        """
+        Params:
+        name (str) camera feature
+        value: new value, not sent if the camera already has it
+        Returns:
+        True if the value was written to the camera
+        """
+        if name not in VOLATILE and self._features.get(name, _MISSING) == value:
+            self.skipped += 1
+            return False
+        try:
+            self.camera.feature(name).value = value
+        except Exception:
+            self._features.pop(name, None) # the camera may hold anything now
+            raise
+        self._features[name] = value
+        self.writes += 1
+        return True
+
+    def configure(self, **features):
+        # Writes several features in order, skipping unchanged ones
+        for name, value in features.items():
+            self.set(name, value)
+
+    def invalidate(self, name=None):
+        # Forgets one (or every) cached feature value, e.g. after writes outside the session
+        if name is None:
+            self._features.clear()
+        else:
+            self._features.pop(name, None)
+
+
+_vimba = None # Vimba instance shared by the sessions below
+_vimba_generation = None
+_sessions = {} # camera_id -> CameraSession
+
+
+def shared_vimba():
+    # Started Vimba instance for the current backend, restarted after a backend switch
+    global _vimba, _vimba_generation
+    if _vimba is not None and _vimba_generation != camera_backend.generation():
+        close_session()
+    if _vimba is None:
+        _vimba = camera_backend.Vimba()
+        _vimba.startup()
+        _vimba_generation = camera_backend.generation()
+    return _vimba
+
+
+def get_session(camera_id=0):
+    """
+    Returns:
+    The shared, opened session for camera_id (one per camera, all on one Vimba
+    instance). Sessions are reopened if they were closed or the camera backend was
+    switched (camera_backend.use_backend) since they were opened.
+    """
+    vimba = shared_vimba()
+    session = _sessions.get(camera_id)
+    if session is None:
+        session = _sessions[camera_id] = CameraSession(camera_id, vimba)
+    return session.open()
+
+
+def close_session(camera_id=None):
+    # Shuts one camera's session down, or every session and Vimba for camera_id=None
+    # (safe to call when none is open); the host buffer pools of those cameras go with them
+    global _vimba
+    if camera_id is not None:
+        session = _sessions.pop(camera_id, None)
+        frame_writer.release_buffer_pools(camera_id)
+        if session is not None:
+            session.close()
+        return
+    try:
+        for session in list(_sessions.values()):
+            session.close()
+    finally:
+        _sessions.clear()
+        frame_writer.release_buffer_pools()
+        if _vimba is not None:
+            _vimba.shutdown()
+            _vimba = None
+
+
+atexit.register(close_session)
@@ -0,0 +1,493 @@
+# Trial frame container
+# One preallocated binary file per trial instead of one .npy file per frame
+#
+# Layout:
+#   header (HEADER_SIZE bytes): magic, version, dtype, height, width, capacity, count
+#   index  (capacity records):  frame_id (uint64), timestamp (float64), camera_time (uint64)
+#   data   (capacity frames):   C-ordered (height, width) frames, page aligned
+#
+# Compressed container (trial.cframes), written as blocks of frames:
+#   header (HEADER_SIZE bytes): magic, version, dtype, height, width, codec, chunk_frames
+#   blocks: frame count and compressed size, index records, compressed frames
+#
+# timestamp is the host receive time [s], camera_time the camera's own timestamp
+# of the frame in ticks (see the trial manifest for the tick frequency). Version 1
+# containers have no camera_time and are still read.
+
+import os
+import struct
+import zlib
+
+import numpy as np
+
+try:
+    import lz4.frame
+except ImportError: # optional, zlib is always available
+    lz4 = None
+
+CONTAINER_NAME = 'trial.frames'
+CONTAINER_EXT = '.frames'
+
+MAGIC = b'GGGFRAME'
+VERSION = 2
+HEADER_FORMAT = '<8sI16sIIQQ'
+HEADER_SIZE = 64
+DATA_ALIGN = 4096
+
+INDEX_DTYPE = np.dtype([('frame_id', '<u8'), ('timestamp', '<f8'), ('camera_time', '<u8')])
+INDEX_DTYPES = {1: np.dtype([('frame_id', '<u8'), ('timestamp', '<f8')]),
+                2: INDEX_DTYPE} # index record layout by container version
+
+COMPRESSED_NAME = 'trial.cframes'
+COMPRESSED_EXT = '.cframes'
+COMPRESSED_MAGIC = b'GGGCFRAM'
+COMPRESSED_HEADER_FORMAT = '<8sI16sII8sI'
+BLOCK_FORMAT = '<IQ'
+BLOCK_SIZE = struct.calcsize(BLOCK_FORMAT)
+CODECS = ('zlib', 'lz4')
+
+
+def _data_offset(capacity, index_dtype=INDEX_DTYPE):
+    # Frame data starts on the first page boundary after the index
+    index_end = HEADER_SIZE + capacity * index_dtype.itemsize
+    return -(-index_end // DATA_ALIGN) * DATA_ALIGN
+
+
+def _pack_header(dtype, height, width, capacity, count):
+    header = struct.pack(HEADER_FORMAT, MAGIC, VERSION, np.dtype(dtype).str.encode(),
+                         height, width, capacity, count)
+    return header.ljust(HEADER_SIZE, b'\0')
+
+
+def read_header(path):
+    """
+    Params:
+    path (str) path to a trial container
+    Returns:
+    dict with version, index_dtype, dtype, height, width, capacity, count and
+    data_offset of the container
+    """
+    with open(path, 'rb') as f:
+        raw = f.read(struct.calcsize(HEADER_FORMAT))
+    magic, version, dtype, height, width, capacity, count = struct.unpack(HEADER_FORMAT, raw)
+    if magic != MAGIC:
+        raise ValueError('{} is not a trial frame container'.format(path))
+    if version not in INDEX_DTYPES:
+        raise ValueError('Unsupported container version {} in {}'.format(version, path))
+    return {'version': version,
+            'index_dtype': INDEX_DTYPES[version],
+            'dtype': np.dtype(dtype.rstrip(b'\0').decode()),
+            'height': height,
+            'width': width,
+            'capacity': capacity,
+            'count': count,
+            'data_offset': _data_offset(capacity, INDEX_DTYPES[version])}
+
+
+class FrameStore:
+    """
+    Append-only writer for a trial container. The file is preallocated for
+    capacity frames up front so acquisition never grows or creates files.
+    """
+    def __init__(self, path, shape, dtype, capacity, flush_every=1000):
+        """
+        Params:
+        path (str) container file to create (overwritten if present)
+        shape (tuple) (height, width) of every frame
+        dtype numpy dtype of the frames
+        capacity (int) maximum number of frames the container holds
+        flush_every (int) frames between index/header flushes to disk
+        """
+        self.path = path
+        self.height, self.width = int(shape[0]), int(shape[1])
+        self.dtype = np.dtype(dtype)
+        self.capacity = int(capacity)
+        self.frame_bytes = self.height * self.width * self.dtype.itemsize
+        self.flush_every = flush_every
+        self.count = 0
+        self.overflow = 0
+        self.index = np.zeros(self.capacity, dtype=INDEX_DTYPE)
+
+        self._data_offset = _data_offset(self.capacity)
+        self._flushed = 0
+        self._file = open(path, 'w+b')
+        self._file.write(_pack_header(self.dtype, self.height, self.width, self.capacity, 0))
+        self._file.truncate(self._data_offset + self.capacity * self.frame_bytes)
+        self._file.seek(self._data_offset)
+
+    def append(self, frame_id, timestamp, image, camera_time=0):
+        """
+        Params:
+        frame_id (int) camera frame ID
+        timestamp (float) receive time of the frame
+        image (np.ndarray) (height, width) frame
+        camera_time (int) camera timestamp of the frame [ticks], 0 if unknown
+        Returns:
+        True if the frame was stored, False if the container is full
+        """
+        if self.count >= self.capacity:
+            self.overflow += 1
+            return False
+        if image.dtype != self.dtype or image.shape != (self.height, self.width):
+            image = np.asarray(image, dtype=self.dtype).reshape(self.height, self.width)
+        self._file.write(np.ascontiguousarray(image).data)
+        self.index[self.count] = (frame_id, timestamp, camera_time)
+        self.count += 1
+        if self.count - self._flushed >= self.flush_every:
+            self.flush()
+        return True
+
+    def flush(self):
+        # Writes new index records and the frame count, then returns to the data tail
+        position = self._file.tell()
+        self._file.seek(HEADER_SIZE + self._flushed * INDEX_DTYPE.itemsize)
+        self._file.write(self.index[self._flushed:self.count].tobytes())
+        self._file.seek(0)
+        self._file.write(_pack_header(self.dtype, self.height, self.width, self.capacity, self.count))
+        self._file.seek(position)
+        self._file.flush()
+        self._flushed = self.count
+
+    def close(self):
+        if self._file.closed:
+            return
+        self.flush()
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+class NpyFrameStore:
+    """
+    Legacy layout: one frame_{id}.npy file per frame in directory. Same append
+    interface as FrameStore, kept for comparison and older tools.
+    """
+    def __init__(self, directory='.'):
+        self.directory = directory
+        self.count = 0
+        self.files = [] # frame file names in arrival order, for the trial manifest
+
+    def append(self, frame_id, timestamp, image, camera_time=0):
+        name = 'frame_{}.npy'.format(frame_id)
+        np.save(os.path.join(self.directory, name), image)
+        self.files.append(name)
+        self.count += 1
+        return True
+
+    def close(self):
+        pass
+
+
+class TeeStore:
+    """
+    Forwards every appended frame to several stores (e.g. a container and an online
+    tracker). count follows the first store.
+    """
+    def __init__(self, stores):
+        self.stores = list(stores)
+
+    @property
+    def count(self):
+        return self.stores[0].count
+
+    def append(self, frame_id, timestamp, image, camera_time=0):
+        stored = True
+        for store in self.stores:
+            stored = store.append(frame_id, timestamp, image, camera_time) and stored
+        return stored
+
+    def close(self):
+        for store in self.stores:
+            store.close()
+
+
+class NullStore:
+    # Counts frames without keeping them, for preview-only acquisitions
+    def __init__(self):
+        self.count = 0
+
+    def append(self, frame_id, timestamp, image, camera_time=0):
+        self.count += 1
+        return True
+
+    def close(self):
+        pass
+
+
+class NpyTrial:
+    """
+    Lazy (N, H, W) view of a legacy trial stored as frame_{id}.npy files. Frames are
+    memory mapped only when indexed, so the trial never has to fit in RAM.
+    """
+    def __init__(self, paths, shape=None, dtype=None):
+        """
+        Params:
+        paths (list) frame file paths, already sorted by frame number
+        shape, dtype: (height, width) and dtype of the frames if known (e.g. from the
+            trial manifest), otherwise read from the first frame
+        """
+        self.paths = list(paths)
+        if shape is None or dtype is None:
+            first = np.load(self.paths[0], mmap_mode='r')
+            shape, dtype = first.shape, first.dtype
+        self.shape = (len(self.paths),) + tuple(shape)
+        self.dtype = np.dtype(dtype)
+        self.ndim = 3
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __getitem__(self, key):
+        if not isinstance(key, tuple):
+            key = (key,)
+        frame_key, rest = key[0], key[1:]
+        if isinstance(frame_key, (int, np.integer)):
+            return np.load(self.paths[frame_key], mmap_mode='r')[rest]
+        if isinstance(frame_key, slice):
+            paths = self.paths[frame_key]
+        else:
+            paths = [self.paths[i] for i in np.arange(self.shape[0])[frame_key]]
+        if not paths:
+            return np.empty((0,) + self.shape[1:], dtype=self.dtype)[(slice(None),) + rest]
+        return np.stack([np.load(p, mmap_mode='r') for p in paths])[(slice(None),) + rest]
+
+
+def compress(data, codec='zlib', level=1):
+    # Compresses a bytes-like block with codec ('zlib' or 'lz4') at level
+    if codec == 'zlib':
+        return zlib.compress(data, level)
+    if codec == 'lz4':
+        if lz4 is None:
+            raise ValueError('lz4 compression needs the lz4 package (pip install lz4)')
+        return lz4.frame.compress(data, compression_level=level)
+    raise ValueError('Unknown codec {}, use one of {}'.format(codec, CODECS))
+
+
+def decompress(data, codec='zlib'):
+    if codec == 'zlib':
+        return zlib.decompress(data)
+    if codec == 'lz4':
+        if lz4 is None:
+            raise ValueError('Reading lz4 compressed frames needs the lz4 package (pip install lz4)')
+        return lz4.frame.decompress(data)
+    raise ValueError('Unknown codec {}, use one of {}'.format(codec, CODECS))
+
+
+class CompressedFrameStore:
+    """
+    Append-only writer for a compressed trial container. Frames are gathered into
+    blocks of chunk_frames, and each full block is compressed and written in one go,
+    trading writer CPU for far fewer bytes on disk (dark bead ROIs compress well).
+    """
+    def __init__(self, path, shape, dtype, chunk_frames=256, codec='zlib', level=1):
+        """
+        Params:
+        path (str) container file to create (overwritten if present)
+        shape (tuple) (height, width) of every frame
+        dtype numpy dtype of the frames
+        chunk_frames (int) frames per compressed block
+        codec (str) one of CODECS
+        level (int) compression level (1 is fastest)
+        """
+        compress(b'', codec, level) # fail early on an unusable codec
+        self.path = path
+        self.height, self.width = int(shape[0]), int(shape[1])
+        self.dtype = np.dtype(dtype)
+        self.chunk_frames = int(chunk_frames)
+        self.codec = codec
+        self.level = level
+        self.count = 0
+        self.raw_bytes = 0
+        self.compressed_bytes = 0
+        self._chunk = np.empty((self.chunk_frames, self.height, self.width), dtype=self.dtype)
+        self._index = np.zeros(self.chunk_frames, dtype=INDEX_DTYPE)
+        self._fill = 0
+        self._file = open(path, 'wb')
+        header = struct.pack(COMPRESSED_HEADER_FORMAT, COMPRESSED_MAGIC, VERSION, self.dtype.str.encode(),
+                             self.height, self.width, codec.encode(), self.chunk_frames)
+        self._file.write(header.ljust(HEADER_SIZE, b'\0'))
+
+    def append(self, frame_id, timestamp, image, camera_time=0):
+        self._chunk[self._fill] = image
+        self._index[self._fill] = (frame_id, timestamp, camera_time)
+        self._fill += 1
+        self.count += 1
+        if self._fill == self.chunk_frames:
+            self.flush()
+        return True
+
+    def flush(self):
+        # Compresses and writes the frames gathered so far as one block
+        if self._fill == 0:
+            return
+        raw = self._chunk[:self._fill]
+        data = compress(raw.data, self.codec, self.level)
+        self._file.write(struct.pack(BLOCK_FORMAT, self._fill, len(data)))
+        self._file.write(self._index[:self._fill].tobytes())
+        self._file.write(data)
+        self.raw_bytes += raw.nbytes
+        self.compressed_bytes += len(data)
+        self._fill = 0
+
+    def close(self):
+        if self._file.closed:
+            return
+        self.flush()
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+class CompressedTrial:
+    """
+    Lazy (N, H, W) view of a compressed container. Indexing decompresses only the
+    blocks holding the requested frames; the last block is kept, so sequential
+    chunked reads (bead_tracking.iter_chunks) decompress every block once.
+    """
+    def __init__(self, path, blocks, shape, dtype, codec):
+        """
+        Params:
+        path (str) compressed container
+        blocks (list) (data offset, compressed size, first frame, num frames) per block
+        shape (tuple) (N, height, width)
+        dtype numpy dtype of the frames
+        codec (str) codec the blocks were written with
+        """
+        self.path = path
+        self.blocks = blocks
+        self.starts = np.array([block[2] for block in blocks], dtype=np.int64)
+        self.shape = tuple(shape)
+        self.dtype = np.dtype(dtype)
+        self.codec = codec
+        self.ndim = 3
+        self._cached = (None, None)
+
+    def __len__(self):
+        return self.shape[0]
+
+    def block(self, b):
+        # Decompressed (n, H, W) frames of block b
+        if self._cached[0] == b:
+            return self._cached[1]
+        offset, size, start, num = self.blocks[b]
+        with open(self.path, 'rb') as f:
+            f.seek(offset)
+            data = decompress(f.read(size), self.codec)
+        frames = np.frombuffer(data, dtype=self.dtype).reshape((num,) + self.shape[1:])
+        self._cached = (b, frames)
+        return frames
+
+    def __getitem__(self, key):
+        if not isinstance(key, tuple):
+            key = (key,)
+        frame_key, rest = key[0], key[1:]
+        if isinstance(frame_key, (int, np.integer)):
+            if not -self.shape[0] <= frame_key < self.shape[0]:
+                raise IndexError('Frame {} out of range for {} frames'.format(frame_key, self.shape[0]))
+            frame = int(frame_key) % self.shape[0]
+            b = int(np.searchsorted(self.starts, frame, side='right')) - 1
+            return self.block(b)[frame - self.starts[b]][rest]
+        frames = np.arange(self.shape[0])[frame_key]
+        out = np.empty((len(frames),) + self.shape[1:], dtype=self.dtype)
+        which = np.searchsorted(self.starts, frames, side='right') - 1
+        for b in np.unique(which):
+            mask = which == b
+            out[mask] = self.block(int(b))[frames[mask] - self.starts[b]]
+        return out[(slice(None),) + rest]
+
+
+def open_compressed(path):
+    """
+    Params:
+    path (str) path to a compressed trial container
+    Returns:
+    (frames, index): frames is a lazy (N, H, W) CompressedTrial, index the (N,)
+    structured array of frame_id, timestamp and (from version 2) camera_time. A block cut short (e.g. by a crash)
+    ends the trial.
+    """
+    with open(path, 'rb') as f:
+        raw = f.read(struct.calcsize(COMPRESSED_HEADER_FORMAT))
+        magic, version, dtype, height, width, codec, chunk_frames = struct.unpack(COMPRESSED_HEADER_FORMAT, raw)
+        if magic != COMPRESSED_MAGIC:
+            raise ValueError('{} is not a compressed trial container'.format(path))
+        if version not in INDEX_DTYPES:
+            raise ValueError('Unsupported container version {} in {}'.format(version, path))
+        index_dtype = INDEX_DTYPES[version]
+        dtype = np.dtype(dtype.rstrip(b'\0').decode())
+        codec = codec.rstrip(b'\0').decode()
+        end = os.fstat(f.fileno()).st_size
+
+        blocks, indices = [], []
+        count = 0
+        offset = HEADER_SIZE
+        while offset + BLOCK_SIZE <= end:
+            f.seek(offset)
+            num, size = struct.unpack(BLOCK_FORMAT, f.read(BLOCK_SIZE))
+            data_offset = offset + BLOCK_SIZE + num * index_dtype.itemsize
+            if data_offset + size > end:
+                break
+            indices.append(np.frombuffer(f.read(num * index_dtype.itemsize), dtype=index_dtype))
+            blocks.append((data_offset, size, count, num))
+            count += num
+            offset = data_offset + size
+
+    index = np.concatenate(indices) if indices else np.zeros(0, dtype=index_dtype)
+    return CompressedTrial(path, blocks, (count, height, width), dtype, codec), index
+
+
+def is_compressed(path):
+    return os.path.splitext(path)[1].lower() == COMPRESSED_EXT
+
+
+def is_container(path):
+    return os.path.splitext(path)[1].lower() == CONTAINER_EXT
+
+
+def open_frames(path, mode='r'):
+    """
+    Params:
+    path (str) path to a trial container
+    mode (str) np.memmap mode, 'r' for read only
+    Returns:
+    (frames, index): frames is an (N, H, W) memmap of the stored frames,
+    index is the (N,) structured array of frame_id, timestamp and (from version 2)
+    camera_time
+    """
+    header = read_header(path)
+    count = header['count']
+    index = np.fromfile(path, dtype=header['index_dtype'], count=count, offset=HEADER_SIZE)
+    if count == 0:
+        frames = np.empty((0, header['height'], header['width']), dtype=header['dtype'])
+    else:
+        frames = np.memmap(path, dtype=header['dtype'], mode=mode, offset=header['data_offset'],
+                           shape=(count, header['height'], header['width']))
+    return frames, index
+
+
+def open_trial(paths, shape=None, dtype=None, ordered=False):
+    """
+    Params:
+    paths (list) frame file paths of one trial (as from create_image_path)
+    shape, dtype: frame (height, width) and dtype if known, see NpyTrial
+    ordered (bool) paths are already in frame order (e.g. from a manifest)
+    Returns:
+    Lazy (N, H, W) frame stack: the container memmap if the trial has one, a
+    CompressedTrial for a compressed container, otherwise an NpyTrial over the
+    frame_{id}.npy files sorted by frame number
+    """
+    for path in paths:
+        if is_container(path):
+            return open_frames(path)[0]
+        if is_compressed(path):
+            return open_compressed(path)[0]
+    if not ordered:
+        paths = sorted(paths, key=lambda f: int(os.path.splitext(os.path.basename(f))[0].split('_')[-1]))
+    return NpyTrial(paths, shape, dtype)
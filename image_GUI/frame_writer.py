@@ -0,0 +1,236 @@
+# Asynchronous frame writer
+# Decouples the Vimba frame callback from disk I/O: the callback copies the frame
+# into a bounded queue and re-queues its buffer, a dedicated thread does the writing
+
+import queue
+import threading
+import time
+
+import numpy as np
+
+_pools = {} # owner -> session buffer pool, replaced when the owner's frame shape or dtype changes
+
+
+class BufferPool:
+    """
+    Fixed set of preallocated host frame buffers, handed out by acquire() and
+    returned by release(). Buffers are recycled rather than allocated per frame.
+    """
+    def __init__(self, shape, dtype, count):
+        self.shape = tuple(shape)
+        self.dtype = np.dtype(dtype)
+        self.count = 0
+        self._free = queue.Queue()
+        self.grow(count)
+
+    def grow(self, count):
+        # Allocates buffers until the pool holds at least count of them
+        while self.count < count:
+            self._free.put(np.empty(self.shape, dtype=self.dtype))
+            self.count += 1
+
+    def acquire(self, timeout=0.0):
+        # Returns a free buffer, or None if none frees up within timeout seconds
+        try:
+            if timeout <= 0:
+                return self._free.get_nowait()
+            return self._free.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def release(self, buf):
+        self._free.put(buf)
+
+    def available(self):
+        return self._free.qsize()
+
+
+def get_buffer_pool(shape, dtype, count, owner=0):
+    """
+    Params:
+    shape (tuple) frame shape
+    dtype numpy dtype of the frames
+    count (int) number of buffers needed
+    owner: pool user, e.g. the camera ID, so concurrent cameras never share buffers
+    Returns:
+    Session-wide BufferPool of this owner, allocated on first use and reused (grown if
+    needed) by later trials with the same shape and dtype; a new ROI shape or pixel
+    format replaces it, so an owner never holds more than one pool
+    """
+    pool = _pools.get(owner)
+    if pool is None or pool.shape != tuple(shape) or pool.dtype != np.dtype(dtype):
+        pool = _pools[owner] = BufferPool(shape, dtype, count)
+    else:
+        pool.grow(count)
+    return pool
+
+
+def release_buffer_pools(owner=None):
+    # Drops the buffer pool of owner, or every pool for owner=None, so their memory can be reclaimed
+    if owner is None:
+        _pools.clear()
+    else:
+        _pools.pop(owner, None)
+
+
+class FrameWriter(threading.Thread):
+    """
+    Writer thread draining a bounded queue of frames into a frame store
+    (anything with an append(frame_id, timestamp, image, camera_time) method).
+    """
+    def __init__(self, store, max_queue=256, block_timeout=0.0, pool=None, preview=None, name='FrameWriter'):
+        """
+        Params:
+        store: destination with append(frame_id, timestamp, image, camera_time)
+        max_queue (int) maximum number of frames waiting to be written
+        block_timeout (float) seconds submit() may wait on a full queue before
+            dropping the frame (0 drops immediately, never stalling the callback)
+        pool (BufferPool) optional preallocated buffers to copy frames into;
+            the queue is then bounded by the pool size
+        preview (PreviewTap) optional tap offered every written frame for live display
+        name (str) thread name, e.g. per camera
+        """
+        threading.Thread.__init__(self, name=name, daemon=True)
+        self.store = store
+        self.pool = pool
+        self.preview = preview
+        if pool is not None:
+            max_queue = pool.count
+        self.max_queue = max_queue
+        self.block_timeout = block_timeout
+        self.queue = queue.Queue(maxsize=max_queue)
+
+        self.submitted = 0
+        self.written = 0
+        self.dropped = 0
+        self.blocked = 0
+        self.max_depth = 0
+        self.write_time = 0.0
+        self.error = None
+
+    def submit(self, frame_id, timestamp, image, camera_time=0):
+        """
+        Called from the frame callback. Copies image so the camera buffer can be
+        re-queued straight away. camera_time is the camera's timestamp of the frame [ticks].
+        Returns:
+        True if the frame was queued, False if it was dropped
+        """
+        self.submitted += 1
+        if self.pool is not None:
+            buf = self.pool.acquire()
+            if buf is None:
+                # Back-pressure: every buffer is still waiting to be written
+                self.blocked += 1
+                buf = self.pool.acquire(self.block_timeout)
+                if buf is None:
+                    self.dropped += 1
+                    return False
+            np.copyto(buf, image.reshape(buf.shape))
+            self.queue.put_nowait((frame_id, timestamp, buf, camera_time))
+        else:
+            item = (frame_id, timestamp, image.copy(), camera_time)
+            try:
+                self.queue.put_nowait(item)
+            except queue.Full:
+                # Back-pressure: writer is not keeping up
+                self.blocked += 1
+                try:
+                    if self.block_timeout <= 0:
+                        raise queue.Full
+                    self.queue.put(item, timeout=self.block_timeout)
+                except queue.Full:
+                    self.dropped += 1
+                    return False
+        depth = self.queue.qsize()
+        if depth > self.max_depth:
+            self.max_depth = depth
+        return True
+
+    def run(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                break
+            frame_id, timestamp, image, camera_time = item
+            start = time.perf_counter()
+            try:
+                self.store.append(frame_id, timestamp, image, camera_time)
+                if self.preview is not None:
+                    self.preview.offer(frame_id, image)
+            except Exception as e:
+                # Keep draining so the callback never blocks on a dead writer
+                self.error = e
+                self.dropped += 1
+                continue
+            finally:
+                if self.pool is not None:
+                    self.pool.release(image)
+            self.write_time += time.perf_counter() - start
+            self.written += 1
+
+    def stop(self):
+        # Writes out everything still queued, then ends the thread
+        self.queue.put(None)
+        self.join()
+
+    def stats(self):
+        """
+        Returns:
+        dict of queue depth, high-water mark, capacity and frame counters
+        """
+        return {'depth': self.queue.qsize(),
+                'max_depth': self.max_depth,
+                'max_queue': self.max_queue,
+                'submitted': self.submitted,
+                'written': self.written,
+                'dropped': self.dropped,
+                'blocked': self.blocked,
+                'write_time': self.write_time}
+
+
+class PreviewTap:
+    """
+    Throttled hand-off of frames for live display. offer() is called by the writer
+    for every frame but only keeps one every interval seconds, so preview costs the
+    acquisition a clock read per frame; the display polls latest() at its own rate.
+    """
+    def __init__(self, interval=0.05, track=None):
+        """
+        Params:
+        interval (float) minimum time between kept frames [s]
+        track (str) bead_tracking method for the overlay position, None for no overlay
+        """
+        self.interval = interval
+        self.track = track
+        self.offered = 0
+        self.kept = 0
+        self._last = 0.0
+        self._latest = None
+        self._seen = None
+
+    def offer(self, frame_id, image):
+        self.offered += 1
+        now = time.perf_counter()
+        if now - self._last < self.interval:
+            return
+        self._last = now
+        image = image.copy() # the writer's buffer goes back to the pool
+        position = None
+        if self.track is not None:
+            import bead_tracking
+            x, y = bead_tracking.estimate_positions(image[None], self.track)
+            position = (float(x[0]), float(y[0]))
+        self._latest = (frame_id, image, position) # single assignment, safe to read from the GUI thread
+        self.kept += 1
+
+    def latest(self):
+        """
+        Returns:
+        (frame_id, image, (x, y) or None) of the newest kept frame, or None if there is
+        nothing new since the last call
+        """
+        latest = self._latest
+        if latest is None or latest is self._seen:
+            return None
+        self._seen = latest
+        return latest
@@ -4,7 +4,12 @@
 import sys
 import os
 import traceback
+import threading
+import queue
+import shutil
+import tempfile
 from time import sleep
+from concurrent.futures import ThreadPoolExecutor
 import tkinter as tk
 from tkinter import filedialog
 
@@ -16,10 +21,19 @@ from matplotlib.backend_bases import key_press_handler
 from matplotlib.figure import Figure
 
 import camera_control_analysis as cca
+import batch_analysis
+import camera_session
+import trial_manifest
+from frame_writer import PreviewTap
+from trial_cache import TrialCache
 
 LARGE_FONT = ("Verdana 24 bold")
 MEDIUM_FONT = ("Verdana 18")
 ROI_size = 16
+CACHE_BYTES = 512 * 2**20 # analysis results kept in memory by the analysis page
+POLL_MS = 100 # acquisition worker message polling interval
+PREVIEW_MS = 50 # live preview refresh interval, independent of the capture frame rate
+PREVIEW_SECONDS = 600 # longest preview-only run, ended early with STOP
 
 global path 
 path = os.getcwd()
@@ -127,9 +141,30 @@ class AcquisitionPage(tk.Frame):
         self.imshow_var = tk.BooleanVar()
         imshow_chkbtn = tk.Checkbutton(frame3, text='Show Test Image', variable=self.imshow_var, onvalue=True, offvalue=False)
 
-        height_btn = tk.Button(frame3, text="Bead Height", command=self.bead_height)
+        self.track_var = tk.BooleanVar()
+        track_chkbtn = tk.Checkbutton(frame3, text="Track live", variable=self.track_var, onvalue=True, offvalue=False)
 
-        start_btn = tk.Button(frame3, text="START", relief=tk.RAISED, command=lambda: self.start_acquisition(controller))
+        self.save_var = tk.BooleanVar(value=True)
+        save_chkbtn = tk.Checkbutton(frame3, text="Save frames", variable=self.save_var, onvalue=True, offvalue=False)
+
+        self.compress_var = tk.BooleanVar()
+        compress_chkbtn = tk.Checkbutton(frame3, text="Compress frames", variable=self.compress_var, onvalue=True, offvalue=False)
+
+        self.follow_var = tk.BooleanVar()
+        follow_chkbtn = tk.Checkbutton(frame3, text="Follow bead", variable=self.follow_var, onvalue=True, offvalue=False)
+
+        self.height_btn = tk.Button(frame3, text="Bead Height", command=self.bead_height)
+
+        self.start_btn = tk.Button(frame3, text="START", relief=tk.RAISED, command=lambda: self.start_acquisition(controller))
+        self.stop_btn = tk.Button(frame3, text="STOP", relief=tk.RAISED, state=tk.DISABLED, command=self.stop_acquisition)
+        self.preview_btn = tk.Button(frame3, text="PREVIEW", relief=tk.RAISED, command=self.start_preview)
+        self.progress_lbl = tk.Label(frame3, text='')
+
+        # Acquisition worker state
+        self.worker = None
+        self.stop_event = threading.Event()
+        self.messages = queue.Queue()
+        self.preview = None
 
         # geometry manager for controls frame
         framerate_lbl.grid(row=0, column=0, sticky='w', padx=5, pady=5)
@@ -140,15 +175,34 @@ class AcquisitionPage(tk.Frame):
         self.trialpath_ent.grid(row=2, column=1, stick='e', padx=5, pady=5)
         roi_chkbtn.grid(row=3, column=0, sticky='w', padx=5, pady=5)
         show_chkbtn.grid(row=3, column=1, sticky='w', padx=5, pady=5)
-        height_btn.grid(row=4, column=0, sticky='w', padx=5, pady=5)
+        self.height_btn.grid(row=4, column=0, sticky='w', padx=5, pady=5)
         imshow_chkbtn.grid(row=4, column=1, sticky='w', padx=5, pady=5)
-        start_btn.grid(row=5, column=0, sticky='nsew', padx=5, pady=5)
+        track_chkbtn.grid(row=5, column=0, sticky='w', padx=5, pady=5)
+        save_chkbtn.grid(row=5, column=1, sticky='w', padx=5, pady=5)
+        compress_chkbtn.grid(row=6, column=0, sticky='w', padx=5, pady=5)
+        follow_chkbtn.grid(row=6, column=1, sticky='w', padx=5, pady=5)
+        self.start_btn.grid(row=7, column=0, sticky='nsew', padx=5, pady=5)
+        self.stop_btn.grid(row=7, column=1, sticky='nsew', padx=5, pady=5)
+        self.preview_btn.grid(row=8, column=0, columnspan=2, sticky='nsew', padx=5, pady=5)
+        self.progress_lbl.grid(row=9, column=0, columnspan=2, sticky='w', padx=5, pady=5)
 
         for col in range(2):
             frame3.columnconfigure(col, weight=1)
-        for row in range(6):
+        for row in range(10):
             frame3.rowconfigure(row, weight=1)
         
+        # Live preview, drawn by blitting the image and bead marker onto a cached background
+        self.preview_fig = Figure(figsize=(4,3), dpi=100)
+        self.preview_ax = self.preview_fig.add_subplot(111)
+        self.preview_ax.set_axis_off()
+        self.preview_im = self.preview_ax.imshow(np.zeros((2,2)), cmap='gray', vmin=0, vmax=255, animated=True)
+        self.preview_marker, = self.preview_ax.plot([], [], 'r+', markersize=12, animated=True)
+        self.preview_canvas = FigureCanvasTkAgg(self.preview_fig, master=frame4)
+        self.preview_canvas.get_tk_widget().pack(side=tk.TOP, fill=tk.X, padx=5, pady=5)
+        self.preview_canvas.mpl_connect('draw_event', self.capture_preview_background)
+        self.preview_background = None
+        self.preview_shape = None
+
         # Console frame
         scrollbar = tk.Scrollbar(frame4) 
         self.listbox = tk.Listbox(frame4, width=50)
@@ -163,6 +217,9 @@ class AcquisitionPage(tk.Frame):
     def start_acquisition(self, controller):
 
         # Called upon push of START button, handles directory management and starts frame acquisition
+        # Camera work runs in a worker thread, reporting back through self.messages (see poll_acquisition)
+        if self.worker is not None and self.worker.is_alive():
+            return
         if os.getcwd() != path:
             os.chdir(path)
         try: 
@@ -170,7 +227,6 @@ class AcquisitionPage(tk.Frame):
             duration = int(self.duration_ent.get()) 
 
             self.listbox.insert(tk.END, 'Starting Acquisition...')
-            self.listbox.update_idletasks()
 
             imageDir = os.path.join(os.getcwd(), self.trialpath_ent.get())
 
@@ -180,54 +236,193 @@ class AcquisitionPage(tk.Frame):
                 os.mkdir(imageDir)
                 os.chdir(imageDir)
 
-            # add trial sub-directory in imageDir
-            highest = 0
-            if len(os.listdir(os.getcwd())) != 0:
-                for file in os.listdir(os.getcwd()):
-                    if file[0] == 't': # only trial_* subdirectories
-                        num = int(file.split('_')[-1])
-                        if num > highest:
-                            highest = num
+            # add trial sub-directory in imageDir, numbered after the session's existing trials
+            trials = cca.find_trials(imageDir)
+            highest = max((trial_manifest.trial_number(trial) for trial in trials), default=0)
 
             highest += 1
             os.mkdir("trial_{}".format(highest))
             os.chdir("trial_{}".format(highest))
             self.trialnum = highest
+
+            storage = None
+            if self.save_var.get():
+                storage = 'compressed' if self.compress_var.get() else 'container'
+            settings = {'framerate': framerate,
+                        'duration': duration,
+                        'trial_dir': os.getcwd(),
+                        'imageDir': imageDir,
+                        'roi': self.roi_var.get(),
+                        'follow': self.roi_var.get() and self.follow_var.get(),
+                        'storage': storage,
+                        'track': cca.TRACK_METHOD if self.track_var.get() else None}
+            self.launch_worker(settings)
             
+        except Exception as e:
+            self.listbox.insert(tk.END, 'Acquisition failure: {}'.format(e))
+            traceback.print_exc()
+
+    def start_preview(self):
+        # Called upon push of PREVIEW button, streams the camera to the preview without saving until STOP
+        if self.worker is not None and self.worker.is_alive():
+            return
+        try:
+            framerate = int(self.framerate_ent.get())
+        except ValueError:
+            self.listbox.insert(tk.END, 'Set a frame rate to preview')
+            return
+        self.listbox.insert(tk.END, 'Starting preview...')
+        settings = {'framerate': framerate,
+                    'duration': PREVIEW_SECONDS,
+                    'trial_dir': tempfile.mkdtemp(prefix='preview_'), # health report only, removed afterwards
+                    'imageDir': None,
+                    'roi': self.roi_var.get(),
+                    'follow': False,
+                    'storage': None,
+                    'track': None}
+        self.launch_worker(settings)
+
+    def launch_worker(self, settings):
+        # Starts the acquisition worker plus the message and preview loops on the main thread
+        self.stop_event.clear()
+        self.preview = PreviewTap(interval=PREVIEW_MS / 1000, track=cca.TRACK_METHOD)
+        self.worker = threading.Thread(target=self.run_acquisition, args=(settings,), daemon=True)
+        self.worker.start()
+        self.start_btn.config(state=tk.DISABLED)
+        self.preview_btn.config(state=tk.DISABLED)
+        self.height_btn.config(state=tk.DISABLED)
+        self.stop_btn.config(state=tk.NORMAL)
+        self.after(POLL_MS, self.poll_acquisition)
+        self.after(PREVIEW_MS, self.update_preview)
+
+    def run_acquisition(self, settings):
+        # Worker thread: camera setup, capture and reset. Never touches Tk widgets,
+        # everything is posted to self.messages for the main thread
+        post = self.messages.put
+        try:
             cca.set_camera_defaults()
 
             # Set ROI if checkbutton is true
-            if self.roi_var.get():
-                self.listbox.insert(tk.END, 'Setting ROI...')
-                self.listbox.update_idletasks()
-                x, y = cca.set_roi(size=ROI_size)
-                self.listbox.insert(tk.END, 'ROI ({} pixels wide) set: center at {}, {}'.format(ROI_size,x,y))
-                self.listbox.update_idletasks()
+            if settings['roi']:
+                post(('log', 'Setting ROI...'))
+                x, y, confidence = cca.set_roi(size=ROI_size)
+                post(('log', 'ROI ({} pixels wide) set: center at {:.1f}, {:.1f} (confidence {:.2f})'.format(
+                    ROI_size,x,y,confidence)))
 
             sleep(0.5)
 
-            self.listbox.insert(tk.END, 'Starting frame capture')
-            self.listbox.update_idletasks()
-            cca.aquire_frames(framerate, duration, os.getcwd())
+            post(('log', 'Starting frame capture'))
+            num_frames = cca.aquire_frames(settings['framerate'], settings['duration'], settings['trial_dir'],
+                                           storage=settings['storage'], track=settings['track'],
+                                           progress=False, stop_event=self.stop_event,
+                                           status=lambda status: post(('progress', status)),
+                                           preview=self.preview, follow_roi=settings['follow'])
             cca.set_camera_defaults()
-
-            num_frames = len(os.listdir(os.getcwd()))
-            self.listbox.insert(tk.END, '{} frames successfully captured'.format(num_frames))
-            self.listbox.insert(tk.END, '')
-            self.listbox.update_idletasks()
-
-            os.chdir('..')
-            os.chdir('..')
-
-            if self.show_var.get():
-                # Pop up analysis window if designated
-                frame = analysis_GUI().frames[AnalysisPage]
-                frame.load_from_acquisition(path=imageDir)
-                frame.tkraise()
-            
+            if settings['imageDir'] is None:
+                post(('preview_done', num_frames, cca.health))
+            else:
+                post(('done', num_frames, cca.health, settings['imageDir']))
         except Exception as e:
-            self.listbox.insert(tk.END, 'Acquisition failure: {}'.format(e))
             traceback.print_exc()
+            post(('error', str(e)))
+        finally:
+            if settings['imageDir'] is None:
+                os.chdir(path)
+                shutil.rmtree(settings['trial_dir'], ignore_errors=True)
+
+    def poll_acquisition(self):
+        # Main thread: drains worker messages into the console, re-polls while the worker runs
+        try:
+            while True:
+                message = self.messages.get_nowait()
+                kind = message[0]
+                if kind == 'log':
+                    self.listbox.insert(tk.END, message[1])
+                elif kind == 'progress':
+                    self.progress_lbl.config(
+                        text='{received}/{expected} frames, {gap_frames} missing, {writer_dropped} dropped by writer, '
+                             'queue {queue_depth}/{max_queue}'.format(**message[1]))
+                elif kind == 'done':
+                    self.finish_acquisition(*message[1:])
+                elif kind == 'preview_done':
+                    self.listbox.insert(tk.END, 'Preview ended, {} frames received, {} shown at up to {} fps'.format(
+                        message[1], self.preview.kept, 1000 // PREVIEW_MS))
+                    self.reset_controls()
+                elif kind == 'error':
+                    self.listbox.insert(tk.END, 'Acquisition failure: {}'.format(message[1]))
+                    self.reset_controls()
+        except queue.Empty:
+            pass
+        self.listbox.see(tk.END)
+        if self.worker is not None and (self.worker.is_alive() or not self.messages.empty()):
+            self.after(POLL_MS, self.poll_acquisition)
+
+    def update_preview(self):
+        # Main thread: shows the newest frame kept by the preview tap, skipping any that
+        # arrived in between, so the display rate never follows the capture rate
+        latest = self.preview.latest() if self.preview is not None else None
+        if latest is not None:
+            frame_id, image, position = latest
+            if image.shape != self.preview_shape:
+                # New ROI: rescale the axes and redraw everything, which refreshes the background
+                height, width = image.shape
+                self.preview_shape = image.shape
+                self.preview_im.set_extent((-0.5, width - 0.5, height - 0.5, -0.5))
+                self.preview_im.set_clim(0, np.iinfo(image.dtype).max)
+                self.preview_ax.set_xlim(-0.5, width - 0.5)
+                self.preview_ax.set_ylim(height - 0.5, -0.5)
+                self.preview_canvas.draw()
+            self.preview_im.set_data(image)
+            if position is not None:
+                self.preview_marker.set_data([position[0]], [position[1]])
+            else:
+                self.preview_marker.set_data([], [])
+            self.blit_preview()
+        if self.worker is not None and self.worker.is_alive():
+            self.after(PREVIEW_MS, self.update_preview)
+
+    def capture_preview_background(self, event):
+        # After every full draw (first frame, new ROI, window resize) keep the static axes for blitting
+        self.preview_background = self.preview_canvas.copy_from_bbox(self.preview_ax.bbox)
+        self.blit_preview()
+
+    def blit_preview(self):
+        # Redraws only the image and marker artists over the cached background
+        if self.preview_background is None:
+            return
+        self.preview_canvas.restore_region(self.preview_background)
+        self.preview_ax.draw_artist(self.preview_im)
+        self.preview_ax.draw_artist(self.preview_marker)
+        self.preview_canvas.blit(self.preview_ax.bbox)
+
+    def finish_acquisition(self, num_frames, health, imageDir):
+        # Main thread: report, leave the trial directory and optionally show the analysis
+        stopped = self.stop_event.is_set()
+        self.listbox.insert(tk.END, '{} frames successfully captured{}'.format(num_frames, ' (stopped)' if stopped else ''))
+        self.listbox.insert(tk.END, '{missing} missing in {drop_runs} drop runs, {achieved_fps:.1f} fps achieved'.format(**health))
+        self.listbox.insert(tk.END, '')
+        self.reset_controls()
+
+        os.chdir('..')
+        os.chdir('..')
+
+        if self.show_var.get():
+            # Pop up analysis window if designated
+            frame = analysis_GUI().frames[AnalysisPage]
+            frame.load_from_acquisition(path=imageDir)
+            frame.tkraise()
+
+    def stop_acquisition(self):
+        # Called upon push of STOP button, ends the running capture early
+        if self.worker is not None and self.worker.is_alive():
+            self.stop_event.set()
+            self.listbox.insert(tk.END, 'Stopping...')
+
+    def reset_controls(self):
+        self.start_btn.config(state=tk.NORMAL)
+        self.preview_btn.config(state=tk.NORMAL)
+        self.height_btn.config(state=tk.NORMAL)
+        self.stop_btn.config(state=tk.DISABLED)
         
     
     def change_path(self):
@@ -243,10 +438,13 @@ class AcquisitionPage(tk.Frame):
 
     def bead_height(self):
         # Get position of bead with argmax method, either print out or show image
+        # The camera belongs to the worker while a capture or preview runs
+        if self.worker is not None and self.worker.is_alive():
+            return
         cca.set_camera_defaults()
-        x,y = cca.bead_height(imshow=self.imshow_var.get())
+        x,y,confidence = cca.bead_height(imshow=self.imshow_var.get())
         if not self.imshow_var.get():
-            self.listbox.insert(tk.END, "Bead position: {}, {}".format(x,y))
+            self.listbox.insert(tk.END, "Bead position: {:.1f}, {:.1f} (confidence {:.2f})".format(x,y,confidence))
             self.listbox.update_idletasks()
 
 
@@ -267,12 +465,23 @@ class AnalysisPage(tk.Frame):
 
         button2 = tk.Button(frame1, text="Load from directory", command=self.change_trialpath)
         button2.grid(row=0, column=1, sticky='nsew', padx=5, pady=5)
+
+        button3 = tk.Button(frame1, text="Analyze all trials", command=self.analyze_all)
+        button3.grid(row=0, column=2, sticky='nsew', padx=5, pady=5)
     
         self.imageDir = os.getcwd()
+        self.cache = TrialCache(CACHE_BYTES) # absolute stream directory -> batch_analysis result, LRU evicted
+        self.batch = None
+        self.batch_dir = None # directory the running batch analyzes
+        self.loading = None # (trial name, stream directory, future) of the trial being analyzed for display
+        self.trialframe = None
 
         self.imageDir_lbl = tk.Label(self, text='Current trial dir: ' + self.imageDir)
         self.imageDir_lbl.pack()
 
+        self.status_lbl = tk.Label(self, text='')
+        self.status_lbl.pack()
+
 
     def change_trialpath(self):
         # Called on load from directory button, handles selection and sets attribute for access across methods
@@ -300,34 +509,70 @@ class AnalysisPage(tk.Frame):
             print('No stored acquisition data... Manually select trial directory.')
     
     def populate_images(self):
-        # Reads in (sorted) files from image directory, populates trial buttons
+        # Scans the image directory for trials and populates trial buttons straight away, one
+        # per camera stream of a multi-camera trial, named like batch_analysis results
+        # Trial data is only loaded and analyzed when its button is clicked (see show_trial)
 
-        trials = []
-        for file in os.listdir(self.imageDir):
-            if file[0] == 't':
-                trials.append(file)
-        trials.sort(key=lambda t: int(t.split('_')[-1])) # sort by trial_num
-        
-        # Populate and load dictionary with numpy arrays from each trial in directory
-        images = {}
-        for trialnum in trials:
-            os.chdir(trialnum)
-            npfile_lst = cca.load_images(cca.create_image_path())
-            os.chdir('..')
-            images[trialnum] = npfile_lst
+        trials = cca.find_trials(self.imageDir)
+        self.cache.clear()
+        self.loading = None
 
         # Make and populate buttons for each trial in directory
-        # Initialize data for each button, which pulls up graphs upon call
-        trialframe = tk.Frame(self)
+        if self.trialframe is not None:
+            self.trialframe.destroy()
+        self.trialframe = tk.Frame(self)
         col = 0
         for trial in trials:
-            but = tk.Button(trialframe, text=trial, command=lambda trial=trial: self.analysis_graphs(images[trial], trial))
-            but.grid(row=0, column=col, sticky='nsew', padx=5, pady=5)
-            col += 1
-        trialframe.pack()
-    
-    def analysis_graphs(self, npfile_lst, trialnum):
-        # Called on trial button push, handles canvas and graphing
+            for camera, directory in cca.trial_streams(os.path.join(self.imageDir, trial)).items():
+                name = trial if camera is None else trial + '/' + os.path.basename(directory)
+                but = tk.Button(self.trialframe, text=name,
+                                command=lambda name=name, directory=directory: self.show_trial(name, directory))
+                but.grid(row=0, column=col, sticky='nsew', padx=5, pady=5)
+                col += 1
+        self.trialframe.pack()
+
+    def show_trial(self, trialnum, directory):
+        # Called on trial button push: analysis results come from the LRU cache, the trial's
+        # analysis sidecar, or are computed from its (memory mapped) frames or positions and cached
+        # trialnum: trial_N, or trial_N/camera_<id> for one stream of a multi-camera trial
+        # Uncached trials are analyzed off the Tk thread, see check_trial
+        key = os.path.abspath(directory)
+        result = self.cache.get(key)
+        if result is not None:
+            self.loading = None
+            self.status_lbl.config(text='')
+            self.analysis_graphs(result, trialnum)
+            return
+        self.status_lbl.config(text='Loading {}...'.format(trialnum))
+        executor = ThreadPoolExecutor(max_workers=1)
+        self.loading = (trialnum, key, executor.submit(batch_analysis.analyze_trial, directory))
+        executor.shutdown(wait=False)
+        self.after(200, self.check_trial, self.loading)
+
+    def check_trial(self, loading):
+        # Polls a trial analysis started by show_trial; the result is cached either way but
+        # only shown if no other trial (or directory) was picked in the meantime
+        trialnum, key, future = loading
+        if not future.done():
+            self.after(200, self.check_trial, loading)
+            return
+        current = loading is self.loading
+        try:
+            result = future.result()
+        except Exception as e:
+            if current:
+                self.loading = None
+                self.status_lbl.config(text='Analysis of {} failed: {}'.format(trialnum, e))
+            traceback.print_exc()
+            return
+        self.cache.put(key, result)
+        if current:
+            self.loading = None
+            self.status_lbl.config(text='')
+            self.analysis_graphs(result, trialnum)
+
+    def analysis_graphs(self, result, trialnum):
+        # Called from show_trial with the trial's analysis result, handles canvas and graphing
 
         self.frame1 = tk.Frame(self)
         self.frame1.pack()
@@ -360,8 +605,9 @@ class AnalysisPage(tk.Frame):
             self.canvas.mpl_connect('key_press_event', self.on_key_press)
 
         # Get data
-        means, ffts = cca.data_analysis(npfile_lst)
-        freqs, xfft, yfft = ffts
+        frame_rate = result['frame_rate']
+        means = (result['x'], result['y'])
+        freqs, xfft, yfft = result['freqs'], result['x_psd'], result['y_psd']
 
         # Plot!
         self.fig.suptitle(trialnum, fontweight='bold')
@@ -370,7 +616,8 @@ class AnalysisPage(tk.Frame):
         self.ax2.plot(freqs, xfft, label='x')
         self.ax2.plot(freqs, yfft, label='y')
         self.ax1.set_title("Bead positions")
-        self.ax2.set_title("Position FFTs")
+        self.ax2.set_title("Position PSDs")
+        self.ax2.set(xlabel='Frequency [Hz]' if frame_rate else 'Frequency [cycles/frame]')
         self.ax1.legend()
         self.ax2.loglog()
         self.ax2.legend()
@@ -378,13 +625,49 @@ class AnalysisPage(tk.Frame):
         self.canvas.draw()
 
 
+    def analyze_all(self):
+        # Analyzes every trial of the directory in a process pool, off the Tk thread
+        if self.batch is not None and not self.batch.done():
+            return
+        self.status_lbl.config(text='Analyzing all trials...')
+        executor = ThreadPoolExecutor(max_workers=1)
+        self.batch_dir = os.path.abspath(self.imageDir)
+        self.batch = executor.submit(batch_analysis.analyze_directory, self.batch_dir)
+        executor.shutdown(wait=False)
+        self.after(200, self.check_batch)
+
+    def check_batch(self):
+        # Polls the batch analysis, results go into the trial cache once done
+        # Results are dropped if another directory was loaded in the meantime
+        if not self.batch.done():
+            self.after(200, self.check_batch)
+            return
+        try:
+            results = self.batch.result()
+            if self.batch_dir != os.path.abspath(self.imageDir):
+                self.status_lbl.config(text='')
+                return
+            for trial, result in results.items():
+                # trial_N or trial_N/camera_<id>, relative to the analyzed directory
+                self.cache.put(os.path.join(self.batch_dir, *trial.split('/')), result)
+            self.status_lbl.config(text='{} trials analyzed'.format(len(results)))
+        except Exception as e:
+            self.status_lbl.config(text='Batch analysis failed: {}'.format(e))
+            traceback.print_exc()
+
     def on_key_press(self, event):
         if event.key == 's':
             print("Saving plots...")
         key_press_handler(event, self.canvas, self.toolbar)
 
+def close_window(window):
+    # Shuts the camera session down cleanly before the GUI exits
+    camera_session.close_session()
+    window.destroy()
+
 if __name__ == '__main__':  
     window = analysis_GUI()
     window.rowconfigure(0, weight=1)
     window.columnconfigure(0, weight=1)
+    window.protocol('WM_DELETE_WINDOW', lambda: close_window(window))
     window.mainloop()
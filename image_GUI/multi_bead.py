@@ -0,0 +1,151 @@
+# Multi-bead detection and tracking
+# Beads are found once in a reference frame (threshold + connected components),
+# then each is followed through the stack inside its own small window. Windows
+# are gathered with one fancy index per chunk, so the cost grows with the number
+# of beads K and the window size, not with the full frame pixel count.
+
+import numpy as np
+
+import bead_tracking
+import spectra
+
+HALF_WIDTH = 8 # bead window is (2 * HALF_WIDTH + 1) pixels square
+
+
+def label(mask):
+    """
+    Connected components of a boolean image (4-connectivity), by propagating the
+    smallest label through each component until nothing changes
+    Params:
+    mask (H, W) bool array
+    Returns:
+    (labels, count): int32 (H, W) labels, 0 for background and 1..count per component
+    """
+    height, width = mask.shape
+    big = np.iinfo(np.int32).max
+    labels = np.where(mask, np.arange(1, height * width + 1, dtype=np.int32).reshape(height, width), big)
+    while True:
+        spread = labels.copy()
+        np.minimum(spread[1:], labels[:-1], out=spread[1:])
+        np.minimum(spread[:-1], labels[1:], out=spread[:-1])
+        np.minimum(spread[:, 1:], labels[:, :-1], out=spread[:, 1:])
+        np.minimum(spread[:, :-1], labels[:, 1:], out=spread[:, :-1])
+        spread[~mask] = big
+        if np.array_equal(spread, labels):
+            break
+        labels = spread
+    # Renumber the surviving (minimum) labels 1..count
+    labels[~mask] = 0
+    roots, labels = np.unique(labels, return_inverse=True)
+    labels = labels.reshape(height, width).astype(np.int32)
+    if roots[0] != 0:
+        labels += 1
+    return labels, len(roots) - (roots[0] == 0)
+
+
+def detect_beads(reference, threshold=0.5, min_pixels=4, max_beads=None):
+    """
+    Params:
+    reference: (H, W) frame or (n, H, W) frames averaged into one
+    threshold (float) fraction of the (max - background) range a pixel must exceed
+    min_pixels (int) smallest component kept (drops hot pixels and noise specks)
+    max_beads (int) keep only the brightest max_beads components, None for all
+    Returns:
+    (K, 2) array of bead (x, y) centers, intensity weighted, brightest first
+    """
+    reference = np.asarray(reference)
+    image = reference.reshape((-1,) + reference.shape[-2:]).mean(axis=0, dtype=np.float64)
+    background = np.median(image)
+    mask = image > background + threshold * (image.max() - background)
+    labels, count = label(mask)
+    if count == 0:
+        return np.zeros((0, 2))
+
+    weights = np.where(mask, image - background, 0.0).ravel()
+    flat = labels.ravel()
+    pixels = np.bincount(flat, minlength=count + 1)[1:]
+    total = np.bincount(flat, weights, minlength=count + 1)[1:]
+    rows, cols = np.indices(image.shape)
+    x = np.bincount(flat, weights * cols.ravel(), minlength=count + 1)[1:] / total
+    y = np.bincount(flat, weights * rows.ravel(), minlength=count + 1)[1:] / total
+
+    keep = np.flatnonzero(pixels >= min_pixels)
+    keep = keep[np.argsort(-total[keep])]
+    if max_beads is not None:
+        keep = keep[:max_beads]
+    return np.stack([x[keep], y[keep]], axis=1)
+
+
+def window_origins(centers, shape, half_width=HALF_WIDTH):
+    # (K, 2) integer (x0, y0) corners of the bead windows, kept inside the frame
+    height, width = shape
+    size = 2 * half_width + 1
+    x0 = np.clip(np.rint(centers[:, 0]).astype(np.int64) - half_width, 0, max(width - size, 0))
+    y0 = np.clip(np.rint(centers[:, 1]).astype(np.int64) - half_width, 0, max(height - size, 0))
+    return np.stack([x0, y0], axis=1)
+
+
+def gather_windows(block, origins, half_width=HALF_WIDTH):
+    """
+    Params:
+    block: (n, H, W) frames (in memory or a memmap slice)
+    origins (K, 2) window corners from window_origins
+    Returns:
+    (n, K, S, S) bead windows, S = 2 * half_width + 1
+    """
+    offsets = np.arange(2 * half_width + 1)
+    rows = origins[:, 1, None] + offsets # (K, S)
+    cols = origins[:, 0, None] + offsets
+    return block[:, rows[:, :, None], cols[:, None, :]]
+
+
+def track_beads(frames, centers, half_width=HALF_WIDTH, method='centroid', follow=True,
+                chunk_bytes=bead_tracking.CHUNK_BYTES, **options):
+    """
+    Params:
+    frames: (N, H, W) stack, in memory or lazy (memmap, frame_store.NpyTrial, ...)
+    centers (K, 2) starting bead (x, y) centers, e.g. from detect_beads
+    half_width (int) bead window half size
+    method (str) bead_tracking estimator applied in each window
+    follow (bool) re-center the windows on the beads after every chunk, for drifting beads
+    chunk_bytes (int) bound on the window data processed at once
+    options: estimator options, see bead_tracking.estimate_positions
+    Returns:
+    (N, K, 2) float array of bead (x, y) positions in frame coordinates
+    """
+    num_frames, height, width = frames.shape
+    centers = np.asarray(centers, dtype=np.float64).reshape(-1, 2)
+    num_beads = len(centers)
+    size = 2 * half_width + 1
+    positions = np.empty((num_frames, num_beads, 2), dtype=np.float64)
+    if num_beads == 0:
+        return positions
+
+    step = max(1, chunk_bytes // (num_beads * size * size * np.dtype(frames.dtype).itemsize))
+    origins = window_origins(centers, (height, width), half_width)
+    for start in range(0, num_frames, step):
+        stop = min(start + step, num_frames)
+        if isinstance(frames, np.ndarray): # memmaps included: only the window pixels are read
+            windows = gather_windows(frames[start:stop], origins, half_width)
+        else:
+            windows = gather_windows(np.asarray(frames[start:stop]), origins, half_width)
+        n = stop - start
+        x, y = bead_tracking.estimate_positions(windows.reshape(n * num_beads, size, size), method, **options)
+        positions[start:stop, :, 0] = x.reshape(n, num_beads) + origins[:, 0]
+        positions[start:stop, :, 1] = y.reshape(n, num_beads) + origins[:, 1]
+        if follow:
+            origins = window_origins(positions[stop - 1], (height, width), half_width)
+    return positions
+
+
+def bead_psds(positions, fs=None, nperseg=None, timestamps=None, **welch_options):
+    """
+    Params:
+    positions (N, K, 2) bead positions from track_beads
+    fs, nperseg, welch_options: see spectra.welch_psd
+    timestamps (N,) per-frame times [s]; gaps or jitter switch to Lomb-Scargle, see spectra.sampled_psd
+    Returns:
+    (freqs, psds): freqs (F,) and psds (K, 2, F), the x and y PSD of every bead
+    """
+    return spectra.sampled_psd(np.asarray(positions).transpose(1, 2, 0), timestamps, fs=fs, nperseg=nperseg,
+                               **welch_options)
@@ -0,0 +1,156 @@
+# Concurrent multi-camera acquisition
+# Images the trap from several cameras at once. Every camera gets its own session,
+# frame pool, callback, host buffer pool and writer thread (a CameraStream, as for a
+# single camera in camera_control_analysis.aquire_frames), so streams run side by
+# side. All cameras are armed first and then started together from a barrier. A trial keeps each stream in its own camera_<id>
+# subdirectory (a complete trial with manifest and health report) and lists them in
+# the trial's group manifest; frames are matched across cameras by their receive
+# times, which all come from the same host clock (align_frames).
+
+import os
+import threading
+import time
+from time import sleep
+
+import numpy as np
+
+import acquisition_health
+import camera_control_analysis as cca
+import camera_session
+import trial_manifest
+from camera_control_analysis import CameraStream
+
+CAMERA_DIR = 'camera_{}'
+
+
+def aquire_frames_multi(frame_rate, duration, path, camera_ids=(0, 1), frame_latency=cca.FRAME_LATENCY,
+                        write_latency=cca.WRITE_LATENCY, buffer=None, storage='container', track=None,
+                        progress=True, stop_event=None, status=None):
+    """
+    Captures from several cameras concurrently, all at frame_rate, into one trial.
+    Params:
+    path (str) trial directory; camera <id> writes into path/camera_<id>
+    camera_ids (tuple) cameras to use, each through its shared session
+    frame_rate, duration, frame_latency, write_latency, buffer, storage, track,
+    progress, stop_event: as for camera_control_analysis.aquire_frames
+    status: called with {camera_id: status dict} every STATUS_INTERVAL while capturing
+    Returns:
+    dict camera ID -> frames stored
+    """
+    path = os.path.abspath(path)
+    sessions = [camera_session.get_session(camera_id) for camera_id in camera_ids]
+    streams = []
+    stopper = stop_event if stop_event is not None else threading.Event()
+    # Whatever fails below, every stream created so far is stopped and released
+    try:
+        for session in sessions:
+            streams.append(CameraStream(session, os.path.join(path, CAMERA_DIR.format(session.camera_id)),
+                                        frame_rate, duration, storage, track, frame_latency, write_latency, buffer))
+        for stream in streams:
+            stream.arm()
+
+        # Shared start: one thread per camera, released together
+        print("Starting Acquisition on {} cameras\n".format(len(streams)))
+        barrier = threading.Barrier(len(streams))
+        starters = [threading.Thread(target=stream.start, args=(barrier,), name='Start-{}'.format(stream.camera_id))
+                    for stream in streams]
+        for starter in starters:
+            starter.start()
+        for starter in starters:
+            starter.join()
+        start = min(stream.start_time for stream in streams)
+
+        while not stopper.is_set():
+            remaining = start + duration - time.time()
+            if remaining <= 0:
+                break
+            stopper.wait(min(remaining, cca.STATUS_INTERVAL))
+            if status is not None:
+                status({stream.camera_id: stream.status() for stream in streams})
+            if progress:
+                print('\rProgress: ' + '  '.join('cam {}: {:2.1%}'.format(stream.camera_id,
+                                                                         stream.monitor.count / max(stream.total, 1))
+                                                 for stream in streams), end='\r')
+
+        for stream in streams:
+            stream.stop()
+        end = time.time()
+        sleep(0.2)
+
+        counts = {}
+        for stream in streams:
+            counts[stream.camera_id] = stream.finish(stopper.is_set())
+    finally:
+        for stream in streams:
+            stream.release(quiet=True)
+    print('\n')
+    print('total time: ', end - start)
+    for stream in streams:
+        print('Camera {}: started {:+.2f} ms after the first'.format(stream.camera_id,
+                                                                    1e3 * (stream.start_time - start)))
+        acquisition_health.print_report(stream.health)
+    if storage is not None or track is not None:
+        manifest = trial_manifest.write_group_manifest(
+            path, {stream.camera_id: stream.manifest for stream in streams}, frame_rate,
+            {stream.camera_id: stream.start_time for stream in streams})
+        try:
+            trial_manifest.add_to_index(os.path.dirname(path), manifest)
+        except OSError as e:
+            print('Trial index not updated:', e)
+
+    print('Capture complete\n')
+    return counts
+
+
+def align_frames(timestamps, tolerance=None, reference=0):
+    """
+    Matches frames across cameras by receive time.
+    Params:
+    timestamps (list) per-camera (N_c,) increasing frame times [s] on a common clock
+    tolerance (float) largest time difference still counted as the same instant [s],
+        default half the reference camera's median frame period
+    reference (int) camera (position in timestamps) whose frames set the instants
+    Returns:
+    (M, C) int array: row m holds the index of the same instant's frame in every
+    camera's stream, for the M reference frames every camera has a match for
+    """
+    ref = np.asarray(timestamps[reference], dtype=np.float64)
+    if tolerance is None:
+        tolerance = 0.5 * np.median(np.diff(ref)) if len(ref) > 1 else np.inf
+    matched = np.zeros((len(ref), len(timestamps)), dtype=np.int64)
+    keep = np.ones(len(ref), dtype=bool)
+    for c, times in enumerate(timestamps):
+        times = np.asarray(times, dtype=np.float64)
+        if len(times) == 0:
+            return matched[:0]
+        after = np.clip(np.searchsorted(times, ref), 0, len(times) - 1)
+        before = np.clip(after - 1, 0, len(times) - 1)
+        nearest = np.where(np.abs(times[before] - ref) <= np.abs(times[after] - ref), before, after)
+        matched[:, c] = nearest
+        keep &= np.abs(times[nearest] - ref) <= tolerance
+    return matched[keep]
+
+
+def stream_timestamps(trial_dir):
+    # Camera ID -> (N,) frame receive times of each stream of a multi-camera trial
+    timestamps = {}
+    for camera, directory in trial_manifest.stream_dirs(trial_dir).items():
+        index = cca.load_frame_index(directory)
+        if index is None:
+            raise ValueError('Stream {} keeps no frame times (npy storage)'.format(directory))
+        timestamps[camera] = index['timestamp']
+    return timestamps
+
+
+def align_trial(trial_dir, tolerance=None):
+    """
+    Params:
+    trial_dir (str) multi-camera trial directory
+    tolerance (float) see align_frames
+    Returns:
+    (camera_ids, matched): camera IDs in column order and the (M, C) frame indices of
+    instants seen by every camera, e.g. cca.load_trial(trial_dir, camera)[matched[:, c]]
+    """
+    timestamps = stream_timestamps(trial_dir)
+    cameras = list(timestamps)
+    return cameras, align_frames([timestamps[camera] for camera in cameras], tolerance)
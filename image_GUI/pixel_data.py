@@ -1,17 +1,67 @@
 # Pixel Data Class
 # v2.0, June 25, 2020
 import numpy as np
-from numpy.fft import rfft
 import matplotlib.pyplot as plt
 
+import bead_tracking
+import multi_bead
+import spectra
+
+CHUNK_BYTES = bead_tracking.CHUNK_BYTES # max frame data held in memory at once by the reductions
+
+
+def plot_positions(x_means, y_means, timestamps=None):
+    # Plots the bead's x and y positions against frame number, or timestamps [s]
+    if timestamps is None:
+        times, unit = np.arange(len(x_means)), 'frame_num'
+    else:
+        times, unit = timestamps, 's'
+    plt.plot(times, x_means, label='x')
+    plt.plot(times, y_means, label='y')
+    plt.xlabel('Time [{}]'.format(unit)); plt.ylabel('Pixel')
+    plt.legend()
+    plt.title('x and y positions of bead', fontsize=20)
+    plt.show()
+
+
+def plot_psds(freqs, x_psd, y_psd, unit='cycles/frame'):
+    # Log-log plot of the x and y position PSDs, frequencies in unit ('Hz' or 'cycles/frame')
+    plt.loglog(freqs, x_psd, label='x')
+    plt.loglog(freqs, y_psd, label='y')
+    plt.xlabel('Frequency [{}]'.format(unit)); plt.ylabel('PSD [pixel$^2$/{}]'.format(unit))
+    plt.legend()
+    plt.title('Temporal PSD of means', fontsize=20)
+    plt.show()
+
+
 class Pixel_Data:
-    def __init__(self, image_list):
-        assert type(image_list) == list, 'Incorrect image_list type'
-        assert type(image_list[0]) == np.ndarray, 'Frames not numpy arrays'
-        self.image_list = image_list
-        self.num_frames = len(image_list)
-        self.frame_height = np.shape(image_list[0])[0]
-        self.frame_width = np.shape(image_list[0])[1]
+    def __init__(self, image_list, chunk_bytes=CHUNK_BYTES):
+        """
+        Params:
+        image_list: (N, H, W) frame stack (e.g. straight from the trial container),
+        a lazy stack (memmap or frame_store.NpyTrial), or a list of 2-D frames which
+        is stacked into one contiguous array
+        chunk_bytes (int) bound on frame data loaded at once by reductions
+        """
+        if type(image_list) == list:
+            assert type(image_list[0]) == np.ndarray, 'Frames not numpy arrays'
+            image_list = np.stack(image_list)
+        assert hasattr(image_list, 'shape') and hasattr(image_list, '__getitem__'), 'Incorrect image_list type'
+        assert len(image_list.shape) == 3, 'Frame stack must be (N, H, W)'
+        if type(image_list) == np.ndarray:
+            image_list = np.ascontiguousarray(image_list)
+        # memmaps and lazy stacks are kept as they are, never read in whole
+        self.frames = image_list
+        self.image_list = self.frames
+        self.num_frames, self.frame_height, self.frame_width = self.frames.shape
+        self.chunk_bytes = chunk_bytes
+
+    def chunks(self):
+        """
+        Yields (start, block) with block an in-memory (n, H, W) slice of the stack,
+        n chosen so a block stays under chunk_bytes
+        """
+        return bead_tracking.iter_chunks(self.frames, self.chunk_bytes)
 
     def return_pixel_val(self, frame_num, position):
         """
@@ -22,21 +72,19 @@ class Pixel_Data:
         pixel value of given frame at position (x,y)
         """
         x,y = position
-        frame = image_list[frame_num]
-        return frame[y,x]
+        return self.frames[frame_num, y, x]
 
     def return_pixel_list(self, position):
         """
         Params:
         position (tuple) 0-indexed x-y position of pixel in question
         Returns:
-        List of that pixel's value at every frame in the trial
+        Array of that pixel's value at every frame in the trial
         """
         x,y = position
-        pixel_vals = []
-        for frame in self.image_list:
-            pixel_vals.append(frame[y,x])
-
+        pixel_vals = np.empty(self.num_frames, dtype=self.frames.dtype)
+        for start, block in self.chunks():
+            pixel_vals[start:start + len(block)] = block[:, y, x]
         return pixel_vals
 
     def track_pixels(self, x_list, y_list):
@@ -44,74 +92,124 @@ class Pixel_Data:
         Params:
         x_list, y_list: list of corresponding x,y values for the pixel
         Returns:
-        List of the pixel values corresponding to the x,y lists
+        Array of the pixel values corresponding to the x,y lists
         """
         assert len(x_list) == self.num_frames, 'x_list too short/long'
         assert len(y_list) == self.num_frames, 'y_list too short/long'
-        pixel_vals = []
-        for i in range(self.num_frames):
-            x = x_list[i]
-            y = y_list[i]
-            frame = self.image_list[i]
-            pixel_vals.append(frame[y,x])
-
+        x_list = np.asarray(x_list)
+        y_list = np.asarray(y_list)
+        pixel_vals = np.empty(self.num_frames, dtype=self.frames.dtype)
+        for start, block in self.chunks():
+            stop = start + len(block)
+            pixel_vals[start:stop] = block[np.arange(len(block)), y_list[start:stop], x_list[start:stop]]
         return pixel_vals
     
-    def track_mean(self):
+    def track_mean(self, method='argmax', **options):
         """
+        Params:
+        method (str) position estimator from bead_tracking.METHODS: 'argmax' (integer
+        argmax of the row/column means), or sub-pixel 'centroid', 'gaussian', 'quadratic'
+        options: estimator options, see bead_tracking.estimate_positions
         Returns tuple (x_list,y_list) containing the x,y position of the mean of 
         each frame in the trial (i.e. bead tracking)
         """
-        x_means = []
-        y_means = []
-
-        for image in self.image_list:
-            col_means = np.mean(image, axis=0)
-            row_means = np.mean(image, axis=1)
-
-            x_means.append(np.argmax(col_means))
-            y_means.append(np.argmax(row_means))
+        # Estimated a chunk of frames at a time over the whole stack
+        x_means = np.empty(self.num_frames, dtype=np.float64)
+        y_means = np.empty(self.num_frames, dtype=np.float64)
+        for start, block in self.chunks():
+            stop = start + len(block)
+            x_means[start:stop], y_means[start:stop] = bead_tracking.estimate_positions(block, method, **options)
+        if method == 'argmax':
+            # integer pixels, usable as track_pixels indices
+            x_means = x_means.astype(np.int64)
+            y_means = y_means.astype(np.int64)
 
         self.bead_positions = (x_means, y_means)
 
         return (x_means, y_means)
 
-    def plot_mean(self):
+    def plot_mean(self, timestamps=None):
         """
         Plots argmax bead position approximation over the dataset
+        Params:
+        timestamps (array) per-frame times [s], None to plot against frame number
         """
-        times = np.arange(self.num_frames)
         x_means, y_means = self.bead_positions
-        plt.plot(times, x_means, label='x')
-        plt.plot(times, y_means, label='y')
-        plt.xlabel('Time [frame_num]'); plt.ylabel('Pixel')
-        plt.legend()
-        plt.title('x and y positions of bead', fontsize=20)
-        plt.show()
+        plot_positions(x_means, y_means, timestamps)
 
-    def bead_temporal_fft(self, plot=False):
+    def bead_temporal_fft(self, plot=False, frame_rate=None, timestamps=None, nperseg=None,
+                          overlap=0.5, window='hann', detrend='constant'):
         """
-        Plots the temporal fft for the bead positions, as given by self.bead_positions
+        Welch-averaged PSDs of the bead positions, as given by self.bead_positions
+        Params:
+        frame_rate (float) sampling rate [Hz]; without it (or timestamps) frequencies are
+            in cycles/frame
+        timestamps (array) per-frame times [s] (e.g. camera timestamps), which set the
+            sampling rate in place of frame_rate; the sampling is checked and trials
+            with dropped frames or jitter get a Lomb-Scargle estimate
+            (spectra.sampled_psd), the check result is kept in self.sampling
+        nperseg, overlap, window, detrend: Welch parameters, see spectra.welch_psd
+        Returns:
+        freqs [Hz], x_psd, y_psd [pixel^2/Hz]
         Precondition: track_mean has been called
         """
-        try:
-            freqs = np.linspace(0,int(self.num_frames/2),(int(self.num_frames/2))+1) 
-            x_means, y_means = self.bead_positions
-
-            x_fft = rfft(x_means)
-            x_psd = (x_fft * x_fft.conj()).real
-            y_fft = rfft(y_means)
-            y_psd = (y_fft * y_fft.conj()).real
-
-            if plot:
-                plt.loglog(freqs,x_psd, label='x')
-                plt.loglog(freqs,y_psd, label='y')
-                plt.xlabel('Frequency [units??]'); plt.ylabel('Amplitude [arb.]')
-                # plt.ylim(0, 1.5*max_y)
-                plt.legend()
-                plt.title('Temporal FFT of means', fontsize=20)
-                plt.show()
-            return freqs,x_psd,y_psd
-        except:
+        if not hasattr(self, 'bead_positions'):
             print('No bead position data! Call "track_mean" submethod first.')
-            return        
+            return
+        self.sampling = spectra.check_sampling(timestamps) if timestamps is not None else None
+        freqs, psds = spectra.sampled_psd(np.stack(self.bead_positions), timestamps, fs=frame_rate, nperseg=nperseg,
+                                          overlap=overlap, window=window, detrend=detrend)
+        x_psd, y_psd = psds
+
+        if plot:
+            unit = 'Hz' if frame_rate is not None or timestamps is not None else 'cycles/frame'
+            plot_psds(freqs, x_psd, y_psd, unit)
+        return freqs,x_psd,y_psd
+
+    def pixel_psd(self, frame_rate=None, nperseg=None, overlap=0.5, window='hann', detrend='constant'):
+        """
+        Params:
+        frame_rate (float) sampling rate [Hz], None for cycles/frame
+        nperseg, overlap, window, detrend: Welch parameters, see spectra.welch_psd
+        Returns:
+        freqs, (H, W, F) cube with the PSD of every pixel's time series
+        """
+        fs = frame_rate if frame_rate is not None else 1.0
+        return spectra.pixel_psd_cube(self.frames, fs=fs, nperseg=nperseg, overlap=overlap,
+                                      window=window, detrend=detrend)
+
+    def track_beads(self, centers=None, reference_frames=4, half_width=multi_bead.HALF_WIDTH,
+                    method='centroid', **options):
+        """
+        Params:
+        centers (K, 2) starting bead (x, y) centers, None to detect every bead in the
+        mean of the first reference_frames frames (multi_bead.detect_beads)
+        half_width (int) half size of each bead's tracking window
+        method (str) bead_tracking estimator applied in each window
+        Returns:
+        (N, K, 2) array of every bead's x,y position in every frame
+        """
+        if centers is None:
+            centers = multi_bead.detect_beads(np.asarray(self.frames[:reference_frames]))
+        self.bead_centers = np.asarray(centers, dtype=np.float64).reshape(-1, 2)
+        self.bead_tracks = multi_bead.track_beads(self.frames, self.bead_centers, half_width=half_width,
+                                                  method=method, chunk_bytes=self.chunk_bytes, **options)
+        return self.bead_tracks
+
+    def bead_psds(self, frame_rate=None, nperseg=None, overlap=0.5, window='hann', detrend='constant',
+                  timestamps=None):
+        """
+        Welch-averaged PSDs of every bead tracked by track_beads
+        Params:
+        frame_rate (float) sampling rate [Hz], None for cycles/frame
+        nperseg, overlap, window, detrend: Welch parameters, see spectra.welch_psd
+        timestamps (array) per-frame times [s], see bead_temporal_fft
+        Returns:
+        freqs, (K, 2, F) x and y PSDs of each bead
+        Precondition: track_beads has been called
+        """
+        if not hasattr(self, 'bead_tracks'):
+            print('No bead tracks! Call "track_beads" submethod first.')
+            return
+        return multi_bead.bead_psds(self.bead_tracks, fs=frame_rate, nperseg=nperseg, timestamps=timestamps,
+                                    overlap=overlap, window=window, detrend=detrend)
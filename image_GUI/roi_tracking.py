@@ -0,0 +1,182 @@
+# Tracking ROI
+# Keeps a small ROI centered on a drifting bead during long acquisitions: a
+# RoiTracker in the writer's store chain estimates the bead position in streamed
+# frames, and the acquisition loop moves OffsetX/OffsetY (in the camera's 8/2
+# pixel steps) when the bead nears an edge. Every shift is logged to
+# roi_shifts.json so ROI-relative positions can be stitched back into absolute
+# sensor coordinates.
+
+import json
+import os
+
+import numpy as np
+
+import bead_tracking
+
+ROI_LOG_NAME = 'roi_shifts.json'
+X_STEP = 8 # OffsetX increment
+Y_STEP = 2 # OffsetY increment
+CHECK_INTERVAL = 0.05 # seconds between ROI checks in the acquisition loop
+
+
+def legal_offset(center, size, step, sensor):
+    """
+    Params:
+    center (float) desired ROI center on the sensor [pixels]
+    size (int) ROI width or height
+    step (int) offset increment the camera accepts
+    sensor (int) sensor width or height
+    Returns:
+    Offset nearest to centering the ROI on center, on the step grid and inside the sensor
+    """
+    highest = (sensor - size) // step * step
+    offset = int(round((center - size / 2) / step)) * step
+    return int(min(max(offset, 0), highest))
+
+
+def roi_offsets(x, y, size, sensor_shape):
+    """
+    Params:
+    x, y (float) bead center on the sensor
+    size (int) requested ROI size [pixels]
+    sensor_shape (tuple) (HeightMax, WidthMax) of the sensor
+    Returns:
+    (offset_x, offset_y, width, height) of the legal ROI closest to centered on the
+    bead: width a multiple of 8, height of 2, offsets on the same grids and the
+    whole ROI on the sensor, also for beads near an edge or corner
+    """
+    sensor_height, sensor_width = int(sensor_shape[0]), int(sensor_shape[1])
+    width = int(min(max(size // X_STEP * X_STEP, X_STEP), sensor_width // X_STEP * X_STEP))
+    height = int(min(max(size // Y_STEP * Y_STEP, Y_STEP), sensor_height // Y_STEP * Y_STEP))
+    return (legal_offset(x, width, X_STEP, sensor_width),
+            legal_offset(y, height, Y_STEP, sensor_height),
+            width, height)
+
+
+class RoiTracker:
+    """
+    Store (append interface) that watches bead positions in streamed frames and
+    proposes new ROI offsets when the bead comes within margin pixels of an edge.
+    Shifts are logged by stored frame number: frame is the first frame expected
+    to carry the new offsets.
+    """
+    def __init__(self, shape, offsets, sensor_shape, margin=None, stride=1, guard=0,
+                 method='centroid', path=ROI_LOG_NAME):
+        """
+        Params:
+        shape (tuple) (height, width) of the ROI
+        offsets (tuple) (OffsetX, OffsetY) at the start of the trial
+        sensor_shape (tuple) (HeightMax, WidthMax) of the sensor
+        margin (int) edge distance that triggers a shift, default a quarter of the ROI
+        stride (int) estimate the position on every stride-th frame
+        guard (int) frames to ignore after a shift (still in flight with the old offsets)
+        method (str) bead_tracking estimator
+        path (str) json shift log written on close (None to keep in memory only)
+        """
+        self.height, self.width = int(shape[0]), int(shape[1])
+        self.sensor_height, self.sensor_width = int(sensor_shape[0]), int(sensor_shape[1])
+        self.margin = margin if margin is not None else min(self.height, self.width) // 4
+        self.stride = max(1, int(stride))
+        self.guard = int(guard)
+        self.method = method
+        self.path = path
+        self.offsets = (int(offsets[0]), int(offsets[1]))
+        self.shifts = [{'frame': 0, 'offset_x': self.offsets[0], 'offset_y': self.offsets[1]}]
+        self.count = 0
+        self.latest = None # (frame, x, y) in ROI coordinates
+        self._settle = 0
+
+    def append(self, frame_id, timestamp, image, camera_time=0):
+        if self.count % self.stride == 0:
+            x, y = bead_tracking.estimate_positions(image[None], self.method)
+            self.latest = (self.count, float(x[0]), float(y[0])) # one tuple, read by the acquisition thread
+        self.count += 1
+        return True
+
+    def check(self, next_frame):
+        """
+        Called from the acquisition loop.
+        Params:
+        next_frame (int) stored frame number of the next frame to arrive
+        Returns:
+        New (OffsetX, OffsetY) to write to the camera, or None to keep the ROI
+        """
+        latest = self.latest
+        if latest is None or latest[0] < self._settle:
+            return None
+        frame, x, y = latest
+        if (self.margin <= x <= self.width - 1 - self.margin and
+                self.margin <= y <= self.height - 1 - self.margin):
+            return None
+        offsets = (legal_offset(x + self.offsets[0], self.width, X_STEP, self.sensor_width),
+                   legal_offset(y + self.offsets[1], self.height, Y_STEP, self.sensor_height))
+        if offsets == self.offsets:
+            return None # bead against the sensor edge, nowhere to go
+        self.offsets = offsets
+        self.shifts.append({'frame': int(next_frame), 'offset_x': offsets[0], 'offset_y': offsets[1]})
+        self._settle = next_frame + self.guard
+        return offsets
+
+    def close(self):
+        if self.path is not None:
+            save_shifts(self.path, self.shifts)
+
+
+def save_shifts(path, shifts):
+    with open(path, 'w') as f:
+        json.dump({'x_step': X_STEP, 'y_step': Y_STEP, 'shifts': shifts}, f, indent=2)
+
+
+def load_shifts(directory=''):
+    # ROI shift log of the trial in directory, None if it was recorded with a fixed ROI
+    path = os.path.join(directory, ROI_LOG_NAME)
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return json.load(f)['shifts']
+
+
+def absolute_positions(x, y, shifts, search=16):
+    """
+    Stitches ROI-relative positions into sensor coordinates.
+    Params:
+    x, y (N,) positions of the stored frames in ROI coordinates
+    shifts (list) shift log (see RoiTracker)
+    search (int) frames either side of each logged shift searched for the true
+        switch-over, taken where the stitched track is smoothest
+    Returns:
+    (x, y) float arrays in sensor coordinates
+    """
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    num_frames = len(x)
+    offset_x = np.full(num_frames, float(shifts[0]['offset_x']))
+    offset_y = np.full(num_frames, float(shifts[0]['offset_y']))
+    for previous, shift in zip(shifts[:-1], shifts[1:]):
+        frame = int(shift['frame'])
+        if frame >= num_frames:
+            break
+        if search:
+            frame = _switch_frame(x, y, previous, shift, frame, search)
+        offset_x[frame:] = shift['offset_x']
+        offset_y[frame:] = shift['offset_y']
+    return x + offset_x, y + offset_y
+
+
+def _switch_frame(x, y, previous, shift, frame, search):
+    # Frame within search of frame where switching offsets gives the least total variation
+    lo = max(1, frame - search)
+    hi = min(len(x) - 1, frame + search)
+    if hi <= lo:
+        return frame
+    window = slice(lo - 1, hi + 1)
+    dx = shift['offset_x'] - previous['offset_x']
+    dy = shift['offset_y'] - previous['offset_y']
+    best, best_cost = frame, np.inf
+    for s in sorted(range(lo, hi + 1), key=lambda s: abs(s - frame)): # ties go to the logged frame
+        ax = x[window] + np.where(np.arange(lo - 1, hi + 1) >= s, dx, 0)
+        ay = y[window] + np.where(np.arange(lo - 1, hi + 1) >= s, dy, 0)
+        cost = np.abs(np.diff(ax)).sum() + np.abs(np.diff(ay)).sum()
+        if cost < best_cost:
+            best, best_cost = s, cost
+    return best
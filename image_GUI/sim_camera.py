@@ -0,0 +1,320 @@
+# Simulated Vimba camera
+# Hardware-free stand-in for the pymba Vimba/Camera/Frame objects used in
+# camera_control_analysis: renders a Gaussian bead at a configurable frame rate
+# and ROI, with timing jitter and dropped-frame injection
+
+import threading
+import time
+from collections import deque
+from types import SimpleNamespace
+
+import numpy as np
+
+SENSOR_WIDTH = 640
+SENSOR_HEIGHT = 480
+TICK_FREQUENCY = 1000000000 # camera timestamp ticks per second (ns, like the hardware)
+
+
+def render_bead(shape, x, y, sigma=3.0, amplitude=200.0, background=10.0, noise=2.0,
+                rng=None, dtype=np.uint8, out=None):
+    """
+    Params:
+    shape (tuple) (height, width) of the frame
+    x, y (float) bead center in frame pixel coordinates
+    sigma (float) Gaussian bead width [pixels]
+    amplitude, background (float) peak height above, and level of, the dark background
+    noise (float) std of additive Gaussian read noise (0 for none)
+    rng (np.random.Generator) noise source
+    dtype numpy dtype of the frame
+    out (np.ndarray) optional frame to render into
+    Returns:
+    Frame containing a single Gaussian bead
+    """
+    height, width = shape
+    gx = np.exp(-0.5 * ((np.arange(width) - x) / sigma) ** 2)
+    gy = np.exp(-0.5 * ((np.arange(height) - y) / sigma) ** 2)
+    image = np.outer(gy, gx)
+    image *= amplitude
+    image += background
+    if noise:
+        if rng is None:
+            rng = np.random.default_rng()
+        image += rng.normal(0.0, noise, size=image.shape)
+    limit = np.iinfo(dtype).max if np.issubdtype(dtype, np.integer) else None
+    if limit is not None:
+        np.clip(image, 0, limit, out=image)
+    if out is None:
+        return image.astype(dtype)
+    out[...] = image
+    return out
+
+
+class SimFeature:
+    # Mimics pymba's Feature: read/write through .value
+    def __init__(self, camera, name):
+        self._camera = camera
+        self._name = name
+
+    @property
+    def value(self):
+        return self._camera._get_feature(self._name)
+
+    @value.setter
+    def value(self, value):
+        self._camera._set_feature(self._name, value)
+
+
+class SimFrame:
+    """
+    Stand-in for pymba.Frame. data carries frameID and timestamp (camera ticks, ns)
+    like the VmbFrame struct.
+    """
+    def __init__(self, camera):
+        self._camera = camera
+        self._callback = None
+        self.data = SimpleNamespace(frameID=0, timestamp=0)
+        self._buffer = np.zeros(camera._roi_shape(), dtype=camera._dtype())
+
+    def announce(self):
+        self._camera._announced.append(self)
+
+    def revoke(self):
+        if self in self._camera._announced:
+            self._camera._announced.remove(self)
+
+    def queue_for_capture(self, frame_callback=None):
+        self._callback = frame_callback
+        self._camera._queued.append(self)
+
+    def buffer_data_numpy(self):
+        return self._buffer
+
+    def _fill(self, frame_id, timestamp):
+        shape = self._camera._roi_shape()
+        if self._buffer.shape != shape:
+            self._buffer = np.zeros(shape, dtype=self._camera._dtype())
+        self.data.frameID = frame_id
+        self.data.timestamp = timestamp
+        self._camera._render(out=self._buffer)
+
+
+class SimCamera:
+    """
+    Simulated camera. Frame rate and ROI come from the usual features
+    (AcquisitionFrameRate, Width, Height, OffsetX, OffsetY).
+    """
+    def __init__(self, camera_id=0, jitter=0.0, drop_rate=0.0, max_frame_rate=None,
+                 bead=None, sigma=3.0, amplitude=200.0, background=10.0, noise=2.0,
+                 wander=0.5, drift=(0.0, 0.0), seed=None):
+        """
+        Params:
+        jitter (float) std of frame timing jitter [s]
+        drop_rate (float) probability that a frame is lost on the camera side
+        max_frame_rate (float) rate cap for the current ROI, None for uncapped
+        bead (tuple) (x, y) sensor position of the bead, default sensor center
+        sigma, amplitude, background, noise: see render_bead
+        wander (float) std of the bead's random motion around its trap center [pixels]
+        drift (tuple) (x, y) velocity of the trap center during an acquisition [pixels/s]
+        seed (int) random seed for reproducible runs
+        """
+        self.camera_id = camera_id
+        self.jitter = jitter
+        self.drop_rate = drop_rate
+        self.max_frame_rate = max_frame_rate
+        self.bead = bead if bead is not None else (SENSOR_WIDTH / 2, SENSOR_HEIGHT / 2)
+        self.render_options = {'sigma': sigma, 'amplitude': amplitude,
+                               'background': background, 'noise': noise}
+        self.wander = wander
+        self.drift = np.asarray(drift, dtype=float)
+        self._started = None
+        self.rng = np.random.default_rng(seed)
+
+        self._features = {'Width': SENSOR_WIDTH,
+                          'Height': SENSOR_HEIGHT,
+                          'WidthMax': SENSOR_WIDTH,
+                          'HeightMax': SENSOR_HEIGHT,
+                          'OffsetX': 0,
+                          'OffsetY': 0,
+                          'PixelFormat': 'Mono8',
+                          'ExposureTime': 44.209,
+                          'AcquisitionMode': 'Continuous',
+                          'AcquisitionFrameCount': 1,
+                          'AcquisitionFrameRate': 100.0,
+                          'AcquisitionFrameRateMode': 'Basic',
+                          'GevTimestampTickFrequency': TICK_FREQUENCY}
+        self._announced = []
+        self._queued = deque()
+        self._thread = None
+        self._stop = threading.Event()
+        self._capturing = False
+        self._position = np.array(self.bead, dtype=float)
+        self._next_id = 0
+
+        self.generated = 0
+        self.injected_drops = 0
+        self.underruns = 0
+        self.render_cpu = 0.0 # CPU seconds spent drawing frames, simulator overhead
+
+    # Features
+    def feature(self, name):
+        if name not in self._features and name != 'PayloadSize':
+            raise ValueError('Simulated camera has no feature {}'.format(name))
+        return SimFeature(self, name)
+
+    def _get_feature(self, name):
+        if name == 'PayloadSize':
+            height, width = self._roi_shape()
+            return height * width * np.dtype(self._dtype()).itemsize
+        return self._features[name]
+
+    def _set_feature(self, name, value):
+        if name in ('WidthMax', 'HeightMax', 'GevTimestampTickFrequency'):
+            raise ValueError('{} is read only'.format(name))
+        self._features[name] = value
+
+    def _roi_shape(self):
+        return (int(self._features['Height']), int(self._features['Width']))
+
+    def _dtype(self):
+        return np.uint8 if self._features['PixelFormat'] == 'Mono8' else np.uint16
+
+    def _render(self, out):
+        # Bead moves around its trap center, rendered relative to the ROI offsets
+        step = self.rng.normal(0.0, self.wander, size=2) if self.wander else 0.0
+        center = np.asarray(self.bead, dtype=float)
+        if self._started is not None and self.drift.any():
+            center = center + self.drift * (time.perf_counter() - self._started)
+        self._position = center + step
+        x = self._position[0] - self._features['OffsetX']
+        y = self._position[1] - self._features['OffsetY']
+        render_bead(out.shape, x, y, rng=self.rng, dtype=out.dtype, out=out, **self.render_options)
+
+    # Open/close
+    def open(self):
+        pass
+
+    def close(self):
+        self.AcquisitionStop()
+
+    # Single frame capture
+    def arm(self, mode, callback=None):
+        self._features['AcquisitionMode'] = mode
+
+    def disarm(self):
+        pass
+
+    def acquire_frame(self, timeout_ms=2000):
+        frame = SimFrame(self)
+        self._next_id += 1
+        frame._fill(self._next_id, time.perf_counter_ns())
+        return frame
+
+    # Streaming capture
+    def new_frame(self):
+        return SimFrame(self)
+
+    def start_capture(self):
+        self._capturing = True
+
+    def end_capture(self):
+        self._capturing = False
+
+    def flush_capture_queue(self):
+        self._queued.clear()
+
+    def revoke_all_frames(self):
+        self._announced.clear()
+
+    def AcquisitionStart(self):
+        if not self._capturing:
+            raise RuntimeError('start_capture() must be called before AcquisitionStart()')
+        self._stop.clear()
+        self._next_id = 0 # frame IDs restart with each acquisition
+        self._started = time.perf_counter()
+        self._thread = threading.Thread(target=self._stream, name='SimCamera', daemon=True)
+        self._thread.start()
+
+    def AcquisitionStop(self):
+        self._stop.set()
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join()
+        self._thread = None
+
+    def _stream(self):
+        # Delivers frames to queued buffers on the nominal schedule plus jitter
+        rate = float(self._features['AcquisitionFrameRate'])
+        if self.max_frame_rate is not None:
+            rate = min(rate, self.max_frame_rate)
+        period = 1.0 / rate
+        if self._features['AcquisitionMode'] == 'MultiFrame':
+            count = int(self._features['AcquisitionFrameCount'])
+        else:
+            count = None
+
+        start = time.perf_counter()
+        n = 0
+        while not self._stop.is_set() and (count is None or n < count):
+            target = start + n * period
+            if self.jitter:
+                target += abs(self.rng.normal(0.0, self.jitter))
+            delay = target - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            n += 1
+            self._next_id += 1
+            self.generated += 1
+
+            if self.drop_rate and self.rng.random() < self.drop_rate:
+                self.injected_drops += 1
+                continue
+            if not self._capturing:
+                continue
+            try:
+                frame = self._queued.popleft()
+            except IndexError:
+                # No buffer queued: frame lost, as on the real camera
+                self.underruns += 1
+                continue
+            # Stamped with the exposure time, before any delivery delay, as the camera does
+            rendered = time.thread_time()
+            frame._fill(self._next_id, int(target * TICK_FREQUENCY))
+            self.render_cpu += time.thread_time() - rendered
+            if frame._callback is not None:
+                frame._callback(frame)
+
+
+class SimVimba:
+    """
+    Stand-in for pymba.Vimba, handing out SimCamera instances. Keyword options
+    are passed to every SimCamera. Pass a shared cameras dict to keep camera state
+    (ROI, frame rate, ...) across Vimba sessions like real hardware does.
+    """
+    def __init__(self, num_cameras=1, cameras=None, **options):
+        self.options = options
+        self.num_cameras = num_cameras
+        self._cameras = cameras if cameras is not None else {}
+
+    def __enter__(self):
+        self.startup()
+        return self
+
+    def __exit__(self, *args):
+        self.shutdown()
+
+    def startup(self):
+        pass
+
+    def shutdown(self):
+        for camera in self._cameras.values():
+            camera.AcquisitionStop()
+
+    def camera_ids(self):
+        return [str(i) for i in range(self.num_cameras)]
+
+    def camera(self, camera_id):
+        index = int(camera_id)
+        if index >= self.num_cameras:
+            raise ValueError('No simulated camera {}'.format(camera_id))
+        if index not in self._cameras:
+            self._cameras[index] = SimCamera(index, **self.options)
+        return self._cameras[index]
@@ -0,0 +1,308 @@
+# Spectral analysis
+# Welch-averaged power spectral densities: the trace is cut into overlapping
+# windowed segments that are detrended and transformed in one batched rFFT,
+# and the periodograms averaged. Frequencies in Hz, densities in units^2/Hz.
+# Traces with dropped samples or timing jitter (check_sampling) go through a
+# segment-averaged Lomb-Scargle estimate on the true sample times instead
+# (sampled_psd picks the estimator), on the same frequency grid and scale.
+
+import numpy as np
+from numpy.fft import rfft, rfftfreq
+from numpy.lib.stride_tricks import sliding_window_view
+
+WINDOWS = ('hann', 'hamming', 'blackman', 'boxcar')
+DEFAULT_NPERSEG = 2**12
+GAP_FACTOR = 1.5 # sample intervals this many median periods long are gaps
+MAX_JITTER = 0.01 # rms interval jitter, as a fraction of the period, still sampled uniformly
+
+
+def get_window(window, nperseg):
+    """
+    Params:
+    window (str or array) window name from WINDOWS, or the window samples themselves
+    nperseg (int) segment length
+    Returns:
+    Periodic window of length nperseg (the form used for spectral estimation)
+    """
+    if not isinstance(window, str):
+        window = np.asarray(window, dtype=np.float64)
+        assert len(window) == nperseg, 'Window length must equal nperseg'
+        return window
+    if window == 'boxcar':
+        return np.ones(nperseg)
+    if window == 'hann':
+        return np.hanning(nperseg + 1)[:-1]
+    if window == 'hamming':
+        return np.hamming(nperseg + 1)[:-1]
+    if window == 'blackman':
+        return np.blackman(nperseg + 1)[:-1]
+    raise ValueError('Unknown window {}, use one of {}'.format(window, WINDOWS))
+
+
+def window_at(window, phase, nperseg):
+    """
+    Params:
+    window (str or array) window name from WINDOWS, or nperseg window samples
+    phase (array) position of each sample within its segment, 0 at the start and
+        k / nperseg at the k-th of nperseg uniform samples
+    nperseg (int) segment length
+    Returns:
+    Window values at phase; equal to get_window(window, nperseg) for uniform samples
+    """
+    if not isinstance(window, str):
+        window = get_window(window, nperseg)
+        return np.interp(phase * nperseg, np.arange(nperseg), window)
+    if window == 'boxcar':
+        return np.ones_like(phase)
+    if window == 'hann':
+        return 0.5 - 0.5 * np.cos(2 * np.pi * phase)
+    if window == 'hamming':
+        return 0.54 - 0.46 * np.cos(2 * np.pi * phase)
+    if window == 'blackman':
+        return 0.42 - 0.5 * np.cos(2 * np.pi * phase) + 0.08 * np.cos(4 * np.pi * phase)
+    raise ValueError('Unknown window {}, use one of {}'.format(window, WINDOWS))
+
+
+def detrend_segments(segments, detrend='constant'):
+    """
+    Params:
+    segments (..., nperseg) array of segments
+    detrend (str) 'constant' removes each segment's mean, 'linear' its least squares
+        line, None leaves segments untouched
+    Returns:
+    Detrended float copy of segments
+    """
+    segments = np.array(segments, dtype=np.float64)
+    if detrend is None or detrend == 'none':
+        return segments
+    if detrend == 'constant':
+        segments -= segments.mean(axis=-1, keepdims=True)
+        return segments
+    if detrend == 'linear':
+        n = segments.shape[-1]
+        t = np.arange(n, dtype=np.float64) - (n - 1) / 2
+        slope = segments @ t / (t @ t)
+        segments -= segments.mean(axis=-1, keepdims=True)
+        segments -= slope[..., None] * t
+        return segments
+    raise ValueError("Unknown detrend {}, use 'constant', 'linear' or None".format(detrend))
+
+
+def sample_rate(timestamps):
+    # Sample rate [Hz] from per-sample timestamps [s], robust to the odd late sample
+    return 1.0 / np.median(np.diff(np.asarray(timestamps, dtype=np.float64)))
+
+
+def welch_psd(x, fs=1.0, nperseg=None, overlap=0.5, window='hann', detrend='constant', timestamps=None):
+    """
+    Params:
+    x (..., N) array, PSDs are taken along the last axis (e.g. a (2, N) stack of x and y)
+    fs (float) sample rate [Hz]; ignored if timestamps is given
+    nperseg (int) segment length, default min(N, DEFAULT_NPERSEG)
+    overlap (float) fraction of a segment shared with the next one, 0 <= overlap < 1
+    window (str or array) segment window, see get_window
+    detrend (str) per-segment detrending, see detrend_segments
+    timestamps (N,) optional sample times [s] used to derive fs
+    Returns:
+    (freqs, psd): freqs (F,) in Hz and one-sided psd (..., F) in units^2/Hz
+    """
+    x = np.asarray(x)
+    num_samples = x.shape[-1]
+    if timestamps is not None:
+        fs = sample_rate(timestamps)
+    if nperseg is None:
+        nperseg = min(num_samples, DEFAULT_NPERSEG)
+    nperseg = int(min(nperseg, num_samples))
+    assert nperseg > 0, 'Empty trace'
+    assert 0 <= overlap < 1, 'overlap must be in [0, 1)'
+    step = max(1, int(round(nperseg * (1 - overlap))))
+
+    win = get_window(window, nperseg)
+    # Segments are strided views into x, copied once by the detrend
+    segments = sliding_window_view(x, nperseg, axis=-1)[..., ::step, :]
+    segments = detrend_segments(segments, detrend)
+    segments *= win
+
+    spectrum = rfft(segments, axis=-1)
+    psd = spectrum.real ** 2 + spectrum.imag ** 2
+    psd = psd.mean(axis=-2)
+    psd /= fs * (win @ win)
+    # One-sided: double everything but DC (and Nyquist for even nperseg)
+    if nperseg % 2:
+        psd[..., 1:] *= 2
+    else:
+        psd[..., 1:-1] *= 2
+    return rfftfreq(nperseg, 1.0 / fs), psd
+
+
+def check_sampling(timestamps, gap_factor=GAP_FACTOR, max_jitter=MAX_JITTER):
+    """
+    Params:
+    timestamps (N,) increasing sample times [s]
+    gap_factor (float) intervals over gap_factor median periods count as gaps
+    max_jitter (float) largest rms interval jitter (fraction of the period) treated as uniform
+    Returns:
+    dict with period [s], fs [Hz], jitter (rms fraction of the period, gaps left out),
+    gaps (number of gaps), missing (samples lost in them) and uniform (True when Welch
+    on the samples as they come is trustworthy)
+    """
+    intervals = np.diff(np.asarray(timestamps, dtype=np.float64))
+    if len(intervals) == 0:
+        return {'period': np.nan, 'fs': np.nan, 'jitter': 0.0, 'gaps': 0, 'missing': 0, 'uniform': True}
+    assert (intervals > 0).all(), 'Sample times must be increasing'
+    period = float(np.median(intervals))
+    gaps = intervals > gap_factor * period
+    jitter = float(np.std(intervals[~gaps]) / period) if (~gaps).any() else 0.0
+    return {'period': period,
+            'fs': 1.0 / period,
+            'jitter': jitter,
+            'gaps': int(gaps.sum()),
+            'missing': int(np.sum(np.rint(intervals[gaps] / period) - 1)),
+            'uniform': not gaps.any() and jitter <= max_jitter}
+
+
+def lomb_scargle_psd(x, timestamps, fs=None, nperseg=None, overlap=0.5, window='hann', detrend='constant'):
+    """
+    Welch-style averaged Lomb-Scargle PSD for irregularly sampled traces: the samples
+    are cut into overlapping segments of nperseg samples as in welch_psd, each segment
+    is detrended and windowed along its true sample times, and its Lomb-Scargle
+    periodogram is evaluated on the Welch frequency grid with the Welch scaling, so
+    both estimators give the same PSD for uniform samples. Frequencies are stepped
+    by a complex recurrence, vectorized over segments and samples.
+    Params:
+    x (..., N) array, PSDs are taken along the last axis
+    timestamps (N,) increasing sample times [s]
+    fs (float) nominal sample rate [Hz], default from the median sample interval
+    nperseg, overlap, window, detrend: see welch_psd
+    Returns:
+    (freqs, psd): freqs (F,) in Hz and one-sided psd (..., F) in units^2/Hz
+    """
+    x = np.asarray(x, dtype=np.float64)
+    t = np.asarray(timestamps, dtype=np.float64)
+    num_samples = x.shape[-1]
+    assert len(t) == num_samples, 'One timestamp per sample'
+    if fs is None:
+        fs = sample_rate(t)
+    if nperseg is None:
+        nperseg = min(num_samples, DEFAULT_NPERSEG)
+    nperseg = int(min(nperseg, num_samples))
+    assert nperseg > 1, 'Trace too short'
+    assert 0 <= overlap < 1, 'overlap must be in [0, 1)'
+    step = max(1, int(round(nperseg * (1 - overlap))))
+
+    seg_t = sliding_window_view(t, nperseg)[::step] # (S, n)
+    seg_t = seg_t - seg_t[:, :1]
+    segments = np.array(sliding_window_view(x, nperseg, axis=-1)[..., ::step, :]) # (..., S, n)
+    if detrend == 'constant':
+        segments -= segments.mean(axis=-1, keepdims=True)
+    elif detrend == 'linear':
+        tc = seg_t - seg_t.mean(axis=-1, keepdims=True)
+        segments -= segments.mean(axis=-1, keepdims=True)
+        segments -= (segments * tc).sum(axis=-1, keepdims=True) / (tc * tc).sum(axis=-1, keepdims=True) * tc
+    elif detrend is not None and detrend != 'none':
+        raise ValueError("Unknown detrend {}, use 'constant', 'linear' or None".format(detrend))
+    # Taper over each segment's time span; a gap leaves a hole in the window
+    phase = seg_t / seg_t[:, -1:] * (nperseg - 1) / nperseg
+    win = window_at(window, phase, nperseg)
+    segments *= win
+    scale = nperseg / (fs * (win * win).sum(axis=-1)) # (S,), Welch scaling per segment
+
+    freqs = rfftfreq(nperseg, 1.0 / fs)
+    step_phase = np.exp(2j * np.pi * (freqs[1] - freqs[0]) * seg_t) # e^{i dw t}
+    phasor = np.ones_like(step_phase) # e^{i w t} at the current frequency
+    psd = np.empty(x.shape[:-1] + (len(freqs),))
+    for k in range(len(freqs)):
+        # Time offset tau making the sine and cosine terms orthogonal: e^{2i w tau} ~ sum e^{2i w t}
+        w2 = (phasor * phasor).sum(axis=-1)
+        magnitude = np.abs(w2)
+        rotated = np.einsum('...sn,sn->...s', segments, phasor) * np.exp(-0.5j * np.angle(w2))
+        cos_norm = 0.5 * (nperseg + magnitude)
+        sin_norm = 0.5 * (nperseg - magnitude)
+        power = rotated.real ** 2 / cos_norm
+        power += np.where(sin_norm > 1e-9 * nperseg, rotated.imag ** 2 / np.maximum(sin_norm, 1e-300), 0.0)
+        psd[..., k] = (power * scale).mean(axis=-1)
+        phasor *= step_phase
+    return freqs, psd
+
+
+def sampled_psd(x, timestamps=None, fs=None, nperseg=None, overlap=0.5, window='hann', detrend='constant',
+                gap_factor=GAP_FACTOR, max_jitter=MAX_JITTER):
+    """
+    PSD that checks the sampling first: welch_psd when the samples are uniform,
+    lomb_scargle_psd when check_sampling finds gaps or jitter
+    Params:
+    x (..., N) array, PSDs are taken along the last axis
+    timestamps (N,) sample times [s], None for uniform sampling at fs
+    fs (float) sample rate [Hz] without timestamps, default 1.0; with timestamps the
+        rate is measured from them (median interval) and fs is ignored, since the
+        camera may not run at the rate it was asked for
+    nperseg, overlap, window, detrend: see welch_psd
+    gap_factor, max_jitter: see check_sampling
+    Returns:
+    (freqs, psd): freqs (F,) in Hz and one-sided psd (..., F) in units^2/Hz
+    """
+    if timestamps is None:
+        return welch_psd(x, fs=fs if fs is not None else 1.0, nperseg=nperseg, overlap=overlap,
+                         window=window, detrend=detrend)
+    sampling = check_sampling(timestamps, gap_factor, max_jitter)
+    fs = sampling['fs']
+    if sampling['uniform']:
+        return welch_psd(x, fs=fs, nperseg=nperseg, overlap=overlap, window=window, detrend=detrend)
+    return lomb_scargle_psd(x, timestamps, fs=fs, nperseg=nperseg, overlap=overlap,
+                            window=window, detrend=detrend)
+
+
+def pixel_psd_cube(frames, fs=1.0, nperseg=None, overlap=0.5, window='hann', detrend='constant',
+                   tile_bytes=256 * 2**20, dtype=np.float32):
+    """
+    Per-pixel PSDs of a frame stack, one Welch estimate along time for every pixel
+    Params:
+    frames (N, H, W) stack, in memory or lazy (memmap, frame_store.NpyTrial)
+    fs, nperseg, overlap, window, detrend: see welch_psd
+    tile_bytes (int) approximate working memory per tile of pixels
+    dtype numpy dtype of the returned cube
+    Returns:
+    (freqs, cube): freqs (F,) in Hz and the (H, W, F) PSD cube in counts^2/Hz
+    """
+    num_frames, height, width = frames.shape
+    if nperseg is None:
+        nperseg = min(num_frames, DEFAULT_NPERSEG)
+    nperseg = int(min(nperseg, num_frames))
+    step = max(1, int(round(nperseg * (1 - overlap))))
+    num_segments = (num_frames - nperseg) // step + 1
+
+    # Welch periodograms are accumulated one segment at a time, so a tile holds one
+    # segment per pixel (float64 samples, detrended copy and complex spectrum) plus the
+    # running sum, whatever the trial length. A tile is a block of full-width rows when
+    # a row fits in tile_bytes, otherwise a run of columns of one row
+    pixel_bytes = 8 * (4 * nperseg + 2)
+    pixels = int(max(1, tile_bytes // pixel_bytes))
+    rows = int(min(height, max(1, pixels // width)))
+    cols = int(min(width, pixels))
+    # Lazy stacks read whole frames, so frames are read a bounded run at a time
+    chunk = int(max(1, min(num_frames, tile_bytes // max(8 * height * width, 1))))
+
+    def read(out, t0, r0, r1, c0, c1):
+        # Fills out (rows, cols, T) with frames t0 to t0 + T of the tile, one transpose per run
+        for start in range(0, out.shape[-1], chunk):
+            stop = min(start + chunk, out.shape[-1])
+            out[..., start:stop] = np.asarray(frames[t0 + start:t0 + stop, r0:r1, c0:c1]).transpose(1, 2, 0)
+
+    freqs = rfftfreq(nperseg, 1.0 / fs)
+    cube = np.empty((height, width, len(freqs)), dtype=dtype)
+    keep = nperseg - step # samples shared with the next segment
+    for r0 in range(0, height, rows):
+        r1 = min(r0 + rows, height)
+        for c0 in range(0, width, cols):
+            c1 = min(c0 + cols, width)
+            # Each frame is read once per tile: the segment slides by step, keeping the overlap
+            segment = np.empty((r1 - r0, c1 - c0, nperseg), dtype=np.float64)
+            total = np.zeros((r1 - r0, c1 - c0, len(freqs)), dtype=np.float64)
+            read(segment, 0, r0, r1, c0, c1)
+            for i in range(num_segments):
+                if i:
+                    segment[..., :keep] = segment[..., step:]
+                    read(segment[..., keep:], i * step + keep, r0, r1, c0, c1)
+                total += welch_psd(segment, fs=fs, nperseg=nperseg, window=window, detrend=detrend)[1]
+            cube[r0:r1, c0:c1] = total / num_segments
+    return freqs, cube
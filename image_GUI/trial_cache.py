@@ -0,0 +1,55 @@
+# Size-bounded LRU cache for per-trial data in the analysis GUI
+# Recently viewed trials stay in memory, the least recently used are evicted
+# once the total size passes max_bytes
+
+from collections import OrderedDict
+
+import numpy as np
+
+
+def nbytes(value):
+    # Approximate memory held by a result: arrays inside dicts/tuples/lists are counted
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    if isinstance(value, dict):
+        return sum(nbytes(v) for v in value.values())
+    if isinstance(value, (tuple, list)):
+        return sum(nbytes(v) for v in value)
+    return 0
+
+
+class TrialCache:
+    """
+    Least-recently-used cache of trial results, bounded by total array bytes
+    """
+    def __init__(self, max_bytes=512 * 2**20):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._items = OrderedDict() # key -> (value, size), most recent last
+
+    def __contains__(self, key):
+        return key in self._items
+
+    def __len__(self):
+        return len(self._items)
+
+    def get(self, key, default=None):
+        if key not in self._items:
+            return default
+        self._items.move_to_end(key)
+        return self._items[key][0]
+
+    def put(self, key, value):
+        if key in self._items:
+            self.size -= self._items.pop(key)[1]
+        size = nbytes(value)
+        self._items[key] = (value, size)
+        self.size += size
+        # Always keep the newest entry, even if it alone is over budget
+        while self.size > self.max_bytes and len(self._items) > 1:
+            evicted, (_, evicted_size) = self._items.popitem(last=False)
+            self.size -= evicted_size
+
+    def clear(self):
+        self._items.clear()
+        self.size = 0
@@ -0,0 +1,206 @@
+# Trial manifests and the session trial index
+# Acquisition writes manifest.json into each trial directory (frame count, shape,
+# dtype, frame rate, ROI offsets and the ordered list of data files) and adds the
+# trial to trials.json in the session directory. Loaders read these instead of
+# listing directories and parsing file names; trials recorded before manifests
+# existed are scanned once and indexed. A multi-camera trial keeps each camera's
+# stream in its own subdirectory (a complete trial of its own) and lists them in
+# the trial's group manifest, so the session index holds the trial once.
+
+import json
+import os
+import time
+
+import numpy as np
+
+MANIFEST_NAME = 'manifest.json'
+INDEX_NAME = 'trials.json'
+MANIFEST_VERSION = 1
+SUMMARY_KEYS = ('num_frames', 'shape', 'dtype', 'frame_rate', 'storage')
+
+
+def trial_number(name):
+    # N of a trial_N directory name
+    return int(name.split('_')[-1])
+
+
+def trial_dirs(directory):
+    # Names of the trial_N subdirectories present in directory
+    return [name for name in os.listdir(directory)
+            if name.startswith('trial_') and name.split('_')[-1].isdigit()
+            and os.path.isdir(os.path.join(directory, name))]
+
+
+def _write_json(path, data):
+    # Written to a temporary file then renamed, so readers never see a partial file
+    tmp = path + '.tmp'
+    with open(tmp, 'w') as f:
+        json.dump(data, f, indent=2)
+    os.replace(tmp, path)
+
+
+def write_manifest(trial_dir, num_frames, shape, dtype, frame_rate, offsets=(0, 0),
+                   storage='container', files=(), positions=None, roi_log=None, camera=None,
+                   timestamp_frequency=None):
+    """
+    Params:
+    trial_dir (str) trial directory
+    num_frames (int) frames stored
+    shape (tuple) (height, width) of the frames
+    dtype numpy dtype of the frames
+    frame_rate (float) requested frame rate [Hz]
+    offsets (tuple) (OffsetX, OffsetY) of the ROI on the sensor
+    storage (str) 'container', 'npy' or None when only positions were kept
+    files (list) frame data file names relative to trial_dir, in frame order
+    positions (str) online tracking positions file name, None if not tracked
+    roi_log (str) ROI shift log file name of a tracking-ROI trial, None for a fixed ROI
+    camera: camera ID of one stream of a multi-camera trial, None for a single camera
+    timestamp_frequency (float) ticks per second of the stored camera timestamps, None if not recorded
+    Returns:
+    The manifest dict
+    """
+    manifest = {'version': MANIFEST_VERSION,
+                'trial': os.path.basename(os.path.normpath(trial_dir)),
+                'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                'num_frames': int(num_frames),
+                'shape': [int(shape[0]), int(shape[1])],
+                'dtype': np.dtype(dtype).str,
+                'frame_rate': float(frame_rate),
+                'offsets': [int(offsets[0]), int(offsets[1])],
+                'storage': storage,
+                'files': list(files),
+                'positions': positions,
+                'roi_log': roi_log,
+                'timestamp_frequency': timestamp_frequency}
+    if camera is not None:
+        manifest['camera'] = camera
+    _write_json(os.path.join(trial_dir, MANIFEST_NAME), manifest)
+    return manifest
+
+
+def write_group_manifest(trial_dir, streams, frame_rate, start_times=None):
+    """
+    Manifest of a multi-camera trial.
+    Params:
+    trial_dir (str) trial directory
+    streams (dict) camera ID -> manifest of its stream subdirectory (see write_manifest)
+    frame_rate (float) requested frame rate [Hz]
+    start_times (dict) camera ID -> host time acquisition started [s]
+    Returns:
+    The manifest dict; storage is 'multi', files is empty and streams maps camera IDs
+    to subdirectory names
+    """
+    counts = [stream['num_frames'] for stream in streams.values()]
+    manifest = {'version': MANIFEST_VERSION,
+                'trial': os.path.basename(os.path.normpath(trial_dir)),
+                'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                'num_frames': min(counts) if counts else 0,
+                'shape': None,
+                'dtype': None,
+                'frame_rate': float(frame_rate),
+                'storage': 'multi',
+                'files': [],
+                'streams': {str(camera): stream['trial'] for camera, stream in streams.items()},
+                'start_times': {str(camera): t for camera, t in (start_times or {}).items()}}
+    _write_json(os.path.join(trial_dir, MANIFEST_NAME), manifest)
+    return manifest
+
+
+def read_manifest(trial_dir):
+    # Manifest dict of trial_dir, None for trials recorded without one
+    try:
+        with open(os.path.join(trial_dir, MANIFEST_NAME)) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def manifest_paths(trial_dir, manifest):
+    # Absolute frame file paths listed in a manifest, in frame order
+    return [os.path.join(trial_dir, file) for file in manifest['files']]
+
+
+def stream_dirs(trial_dir, manifest=None):
+    # Camera ID -> stream directory of a multi-camera trial, {} for single camera trials
+    if manifest is None:
+        manifest = read_manifest(trial_dir)
+    if manifest is None or 'streams' not in manifest:
+        return {}
+    return {camera: os.path.join(trial_dir, name) for camera, name in manifest['streams'].items()}
+
+
+def _summary(manifest):
+    # Index entry of a trial
+    summary = {key: manifest.get(key) for key in SUMMARY_KEYS}
+    if 'streams' in manifest:
+        summary['streams'] = manifest['streams']
+    return summary
+
+
+def read_index(directory):
+    # Session index dict {'trials': {name: summary}}, None if the directory has none
+    try:
+        with open(os.path.join(directory, INDEX_NAME)) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def add_to_index(directory, manifest):
+    # Records a trial's manifest summary in the session index of directory
+    # A session without an index is scanned first, so older trials stay listed
+    index = read_index(directory)
+    if index is None:
+        return build_index(directory)
+    index['trials'][manifest['trial']] = _summary(manifest)
+    _write_json(os.path.join(directory, INDEX_NAME), index)
+    return index
+
+
+def build_index(directory):
+    """
+    Scans directory for trial_N subdirectories and writes the session index, for data
+    recorded before trial indexing. Trials without a manifest are listed with unknown
+    (None) details.
+    Returns:
+    The index dict
+    """
+    index = {'trials': {}}
+    for name in trial_dirs(directory):
+        index['trials'][name] = _trial_summary(directory, name)
+    _try_write_index(directory, index)
+    return index
+
+
+def _trial_summary(directory, name):
+    # Index entry of trial name read from its manifest, unknown (None) details without one
+    manifest = read_manifest(os.path.join(directory, name))
+    return _summary(manifest if manifest is not None else {})
+
+
+def _try_write_index(directory, index):
+    try:
+        _write_json(os.path.join(directory, INDEX_NAME), index)
+    except OSError as e:
+        print('Trial index not written ({}): {}'.format(directory, e))
+
+
+def trial_names(directory):
+    """
+    Trial directory names of a session, sorted by trial number, from the index (built if
+    missing). The index is reconciled with the trial_N directories on disk first: trials
+    deleted since are dropped, trials never indexed (e.g. a failed acquisition that wrote
+    no manifest, or data copied in) are added.
+    """
+    index = read_index(directory)
+    if index is None:
+        index = build_index(directory)
+    present = set(trial_dirs(directory))
+    listed = set(index['trials'])
+    if present != listed:
+        for name in listed - present:
+            del index['trials'][name]
+        for name in present - listed:
+            index['trials'][name] = _trial_summary(directory, name)
+        _try_write_index(directory, index)
+    return sorted(index['trials'], key=trial_number)
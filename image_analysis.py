@@ -17,7 +17,8 @@ from typing import Optional
 from pymba import Frame
 from tqdm import tqdm
 
-from pixel_data import Pixel_Data
+from pixel_data import Pixel_Data, plot_positions, plot_psds
+import analysis_cache
 sys.path.append('/home/analysis_user/New_trap_code/Tools/')
 import h5py
 import BeadDataFile
@@ -187,14 +188,22 @@ def load_h5(filename):
     return (x,y,z)
 
 
-def data_analysis(image_list):
+def data_analysis(image_paths):
     # Any data analysis wanted goes in here
-    # Pixel_Data instance created, any submethods called on that
+    # Positions and PSDs come from Pixel_Data, or from the trial's analysis sidecar
+    # (analysis_cache) when the frames are unchanged since the last run
     
-    data = Pixel_Data(image_list)
-    data.track_mean()
-    data.plot_mean()
-    data.bead_temporal_fft(plot=True)
+    def compute():
+        data = Pixel_Data(load_images(image_paths))
+        x, y = data.track_mean()
+        freqs, x_psd, y_psd = data.bead_temporal_fft()
+        return {'x': x, 'y': y, 'freqs': freqs, 'x_psd': x_psd, 'y_psd': y_psd}
+
+    result = analysis_cache.cached_analysis(os.getcwd(), compute, image_paths, method='argmax')
+
+    plot_positions(result['x'], result['y'])
+    plot_psds(result['freqs'], result['x_psd'], result['y_psd'])
+    return result
 
 
 def main(delete=True):
@@ -224,8 +233,7 @@ def main(delete=True):
             aquire_frames(trial_params[0], trial_params[1])
             
         if not complete: # Data analysis procedures as defined in data_analysis function
-            images = load_images(create_image_path())
-            data_analysis(images)
+            data_analysis(create_image_path())
 
         os.chdir("..")
 
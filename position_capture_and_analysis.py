@@ -5,15 +5,15 @@ import cv2
 import os, os.path
 import numpy as np
 import matplotlib.pyplot as plt
-import matplotlib.mlab as mlab
-from matplotlib.mlab import psd
 from time import sleep
 from pymba import Vimba
 from typing import Optional
 from pymba import Frame
-from tqdm import tqdm
 import shutil
-from pixel_data import Pixel_Data
+from pixel_data import Pixel_Data, plot_positions, plot_psds
+import analysis_cache
+import bead_tracking
+import spectra
 
 imageDir = r"C:\Users\Beads\Documents\EmmettH\data"
 ROI_size = 100
@@ -161,25 +161,18 @@ def load_images(image_path_list):
     print()
     return images
 
-def extract_mean(image_dict, plt_show=False):
+def extract_mean(image_dict, plt_show=False, method='argmax'):
     # Given frames in image_dict, returns position dict with the x,y position of the max of the mean 
     # i.e. extracts bead position and returns dict
-    position_dict = {}
-    for image_name in image_dict.keys():
-        images = image_dict[image_name]
-        # print("Horizontal size: ", len(images[0][0]))
-        # print("Vertical size: ", len(images[0]))
-
-        x_means = np.mean(images, axis=0)
-        y_means = np.mean(images, axis=1)
-
-        x_pos = np.argmax(x_means)
-        y_pos = np.argmax(y_means)
-        # run_avg = np.dot(means / range) / np.sum(range)
-
-        position_dict[image_name] = (x_pos, y_pos)
+    # method picks the bead_tracking estimator, all frames are tracked in one batch
+    names = list(image_dict.keys())
+    x_pos, y_pos = bead_tracking.track_positions(np.stack([image_dict[name] for name in names]), method)
+    position_dict = {name: (x, y) for name, x, y in zip(names, x_pos, y_pos)}
     
     if plt_show:
+        image_name = names[-1]
+        x_means = np.mean(image_dict[image_name], axis=0)
+        y_means = np.mean(image_dict[image_name], axis=1)
         plt.plot(range(len(y_means)), y_means, label=image_name + ": y")
         plt.plot(range(len(x_means)), x_means, label=image_name + ": x")
         plt.legend()
@@ -204,38 +197,25 @@ def track_position(position_dict, plt_show=False):
     if plt_show:
         plt.show()
 
-# BELOW TO BE REPLACED WITH PIXEL DATA CLASS
+# Per-pixel spectra, computed for the whole stack by spectra.pixel_psd_cube
 
 def load_pixel_dict(images):
-    # return: dict with -> key: (x,y) pixel identifier, value: [] list of values for each frame
-    pixel_dict = {}
-    keys = [key for key in images.keys()]
-    test_img = images[keys[0]]
-    image_height, image_width = np.shape(test_img)
-    print('Image height: ', image_height)
-    for x in range(image_width - 1):
-        for y in range(image_height - 1):
-            pixel_dict[(x,y)] = []
-    print("Loading data...")
-    for name in tqdm(images):
-        frame = images[name]
-        for x in range(ROI_size - 1):
-            for y in range(ROI_size - 1):
-                pixel_val = frame[x][y]
-                pixel_dict[(x,y)].append(pixel_val)
-    
-    return pixel_dict
+    # return: (N, H, W) stack of the frames in images, in insertion order
+    # pixel (x,y) time series is stack[:, y, x]
+    stack = np.stack(list(images.values()))
+    print('Image height: ', stack.shape[1])
+    return stack
 
 def load_psd_dict(pixel_dict, frame_rate):
-    psd_dict = {}
+    # return: (psd_cube, freqs), psd_cube[y, x] is the PSD of pixel (x,y)
+    # Same estimate as the old per-pixel mlab.psd call (NFFT 2**12, Hann, no overlap or detrend),
+    # done as one batched rFFT per tile of pixels; trials shorter than NFFT take one segment of all frames
     print()
     print("Loading PSDs...")
-    for pixel in tqdm(pixel_dict.keys()):
-        pixel_data = pixel_dict[pixel]
-        (psd_data, freqs) = psd(pixel_data, Fs=frame_rate, detrend=mlab.detrend_none, NFFT=2**12)
-        psd_dict[pixel] = (psd_data, freqs)
-    
-    return psd_dict
+    nfft = min(2**12, len(pixel_dict))
+    freqs, psd_cube = spectra.pixel_psd_cube(pixel_dict, fs=frame_rate, nperseg=nfft,
+                                             overlap=0, window=np.hanning(nfft), detrend=None)
+    return psd_cube, freqs
 
 def psd_max(max_tuple, psd_dict):
     """
@@ -247,20 +227,31 @@ def psd_max(max_tuple, psd_dict):
         (psd, freqs) = psd_dict[pixel]
         plt.plot(freqs, psd, label=str(pixel))
     """
-    (psd, freqs) = psd_dict[max_tuple]
-    plt.plot(freqs, psd, label=str(pixel))
+    psd_cube, freqs = psd_dict
+    x, y = max_tuple
+    plt.plot(freqs, psd_cube[y, x], label=str(max_tuple))
     plt.legend()
     plt.xscale('log')
     plt.title('Max Pixel PSD')
     plt.show()
 
 
-def data_analysis(image_list):
+def data_analysis(image_paths):
+    # Any data analysis wanted goes in here
+    # Positions and PSDs come from Pixel_Data, or from the trial's analysis sidecar
+    # (analysis_cache) when the frames are unchanged since the last run
+    
+    def compute():
+        data = Pixel_Data(load_images(image_paths))
+        x, y = data.track_mean()
+        freqs, x_psd, y_psd = data.bead_temporal_fft()
+        return {'x': x, 'y': y, 'freqs': freqs, 'x_psd': x_psd, 'y_psd': y_psd}
+
+    result = analysis_cache.cached_analysis(os.getcwd(), compute, image_paths, method='argmax')
 
-    data = Pixel_Data(image_list)
-    data.track_mean()
-    data.plot_mean()
-    data.bead_temporal_fft(plot=True)
+    plot_positions(result['x'], result['y'])
+    plot_psds(result['freqs'], result['x_psd'], result['y_psd'])
+    return result
 
 
 
@@ -281,8 +272,7 @@ def main(delete=True):
             if trial_params[2]:
                 set_roi()
             aquire_frames(trial_params[0], trial_params[1])
-        images = load_images(create_image_path())
-        data_analysis(images)
+        data_analysis(create_image_path())
         # positions = extract_mean(images, plt_show=False)
         # psds = load_psd_dict(load_pixel_dict(images), trial_params[0])
         # psd_max(center, psds)